@@ -18,7 +18,21 @@ class AdaptorsSettings(object):
     EML_ADDRESS = 'request@csds.outernet.is'
 
 
-class Base(AdaptorsSettings, object):
+class InterfaceSettings(object):
+    """ Configuration for the web-based interfaces """
+
+    # Number of requests shown per page in CDS request list
+    CDS_PAGE_SIZE = 20
+
+    # Maximum number of requests shown in CSS content pool
+    CSS_POOL_SIZE = 100
+
+    # How votes are recorded: 'sharded' (sharded counters) or 'deferred'
+    # (vote events applied in batches by a cron job). See ``rh.votes``.
+    CSS_VOTE_MODE = 'sharded'
+
+
+class Base(AdaptorsSettings, InterfaceSettings, object):
     """ Base configuration """
     DEBUG = False
     TESTING = False
@@ -0,0 +1,98 @@
+""" Lazily loaded routes
+
+This module implements registration of routes whose modules are only
+imported when one of their URLs is first dispatched. This keeps the cost of
+importing all CSDS components (and the libraries they depend on) out of
+instance startup, so that e.g., a cron job does not have to wait for the
+Facebook SDK or locale data to load.
+
+URL rules cannot be added once an app starts serving requests, so rules for
+lazily loaded routes are registered at startup from a list of route
+specifications (see ``app.urls``). Each rule points to a ``LazyView``, which
+imports the route class and obtains its view function on first call.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import time
+import logging
+import threading
+
+from utils import import_object
+
+__all__ = ('LazyView', 'register_lazy')
+
+
+class ViewCollector(object):
+    """ App proxy that collects view functions instead of registering them
+
+    Routes keep a reference to the app object they were registered with, so
+    all other attributes are looked up on the actual app.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.views = {}
+
+    def add_url_rule(self, rule, endpoint, view_func, **options):
+        self.views[endpoint] = view_func
+
+    def __getattr__(self, name):
+        return getattr(self.app, name)
+
+
+class LazyView(object):
+    """ View function that imports a route class on first call
+
+    ``requires`` is an iterable of modules that must be imported before the
+    route class (e.g., modules that register harvested adaptors).
+    """
+
+    # Imports are serialized, because two threads must not import the same
+    # module concurrently
+    lock = threading.Lock()
+
+    def __init__(self, app, import_name, endpoint, requires=()):
+        self.app = app
+        self.import_name = import_name
+        self.endpoint = endpoint
+        self.requires = requires
+        self.view = None
+
+    def load(self):
+        """ Import the route class and return its view function """
+        with self.lock:
+            if self.view is None:
+                start = time.time()
+                for module in self.requires:
+                    __import__(module)
+                route_class = import_object(self.import_name)
+                collector = ViewCollector(self.app)
+                route_class.register(collector)
+                self.view = collector.views[self.endpoint]
+                logging.debug('Loaded %s in %.1f ms' % (
+                    self.import_name, (time.time() - start) * 1000))
+        return self.view
+
+    def __call__(self, *args, **kwargs):
+        view = self.view or self.load()
+        return view(*args, **kwargs)
+
+
+def register_lazy(app, routes):
+    """ Register URL rules for lazily loaded routes
+
+    ``routes`` is an iterable of dicts with the following keys:
+
+    - ``route``: import name of the route class
+    - ``path``: URL rule (``path`` attribute of the route)
+    - ``endpoint``: endpoint name (``name`` attribute of the route)
+    - ``methods``: methods handled by the route
+    - ``requires``: (optional) modules imported before the route class
+    """
+    for spec in routes:
+        view = LazyView(app, spec['route'], spec['endpoint'],
+                        spec.get('requires', ()))
+        app.add_url_rule(spec['path'], spec['endpoint'], view,
+                         methods=spec['methods'])
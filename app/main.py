@@ -4,38 +4,47 @@ from __future__ import unicode_literals, print_function
 
 import os
 from os.path import abspath, dirname, join
+import logging
 import sys
 
+from app.profiler import ImportProfiler
+
 PROJECT_DIR = abspath(dirname(dirname(__file__)))
 TEMPLATE_DIR = join(PROJECT_DIR, 'templates')
 VENDOR_DIR = join(PROJECT_DIR, 'vendor')
 ENV = os.environ.get('ENV', 'Development')
+PROFILE_IMPORTS = os.environ.get('PROFILE_IMPORTS')
+
+if PROFILE_IMPORTS:
+    profiler = ImportProfiler()
+    profiler.start()
 
 sys.path.insert(0, PROJECT_DIR)
 sys.path.insert(0, VENDOR_DIR)
 
 from flask import Flask, url_for
-from utils.routes import register_module
 from utils.middlewares import csrf
 
+from rh.cache import cached_fragment
+
+from app.lazy import register_lazy
+from app.urls import ROUTES
+
 # App instance
 app = Flask(__name__, template_folder=TEMPLATE_DIR)
 app.config.from_object('app.conf.%s' % ENV)
 
 # Middlewares and request-response processors
-csrf(app, excluded_paths=['/rh/hooks/email'])
-
-# Web interface handlers
-register_module(app, 'cds.webui')
-register_module(app, 'css.webui')
-register_module(app, 'rqm.webui')
-
-# Cron job handlers
-register_module(app, 'ra.outernet_facebook')
+csrf(app, excluded_paths=['/rh/hooks/email', '/rh/api/requests:batch'])
 
-# Web hook RAs
-register_module(app, 'ra.email')
+# Template helpers
+app.jinja_env.globals['cached_fragment'] = cached_fragment
 
-# Misc handlers
-register_module(app, 'app.pages')
+# Route modules (web interfaces, cron jobs, web hook RAs, and misc handlers)
+# are imported on first dispatch to one of their URLs
+register_lazy(app, ROUTES)
 
+if PROFILE_IMPORTS:
+    profiler.stop()
+    logging.info('Startup imports:\n%s' % profiler.format(
+        float(PROFILE_IMPORTS)))
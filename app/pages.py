@@ -7,10 +7,25 @@ web-based interfaces of other CSDS components.
 
 from __future__ import unicode_literals, print_function
 
-from utils.routes import HtmlRoute
+import json
+
+from flask import Response
+from utils.routes import Route, HtmlRoute
+
+from rh.cache import get_stats
 
 
 class Homepage(HtmlRoute):
     path = '/'
     template_name = 'home.html'
 
+
+
+class CacheStats(Route):
+    """ Return cache hit-rate statistics as JSON """
+    name = 'cache_stats'
+    path = '/stats/cache'
+
+    def GET(self):
+        return Response(json.dumps(get_stats()), 200,
+                        mimetype='application/json')
@@ -0,0 +1,106 @@
+""" Startup profiler
+
+This module implements a profiler that records the time spent importing
+modules, as a tree of nested imports. It is enabled by setting the
+``PROFILE_IMPORTS`` environment variable (e.g., in ``app.yaml``), in which
+case ``app.main`` logs the import tree of instance startup. The value of the
+variable is the minimum import time in milliseconds for a module to be
+included in the tree (defaults to 1).
+
+Only the standard library is used, so that the profiler can be started
+before anything else is imported.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import __builtin__
+import sys
+import time
+
+__all__ = ('ImportProfiler',)
+
+
+class ImportNode(object):
+    """ Import of a single module, and imports nested within it """
+
+    def __init__(self, name):
+        self.name = name
+        self.duration = 0
+        self.children = []
+
+    def format(self, threshold=0, depth=0):
+        """ Return lines of the import tree with durations in milliseconds """
+        lines = []
+        for child in self.children:
+            if child.duration * 1000 < threshold:
+                continue
+            lines.append('%8.1f ms  %s%s' % (child.duration * 1000,
+                                             '  ' * depth, child.name))
+            lines.extend(child.format(threshold, depth + 1))
+        return lines
+
+
+class ImportProfiler(object):
+    """ Records import times by wrapping the built-in ``__import__()``
+
+    Only imports that load at least one new module are recorded.
+    """
+
+    def __init__(self):
+        self.root = ImportNode('<startup>')
+        self.stack = [self.root]
+        self.original_import = None
+
+    def start(self):
+        self.original_import = __builtin__.__import__
+        __builtin__.__import__ = self.profiled_import
+        self.started = time.time()
+
+    def stop(self):
+        if self.original_import is not None:
+            __builtin__.__import__ = self.original_import
+            self.original_import = None
+        self.root.duration = time.time() - self.started
+
+    def profiled_import(self, name, globals=None, locals=None, fromlist=None,
+                        level=-1):
+        node = ImportNode(name)
+        loaded = len(sys.modules)
+        self.stack.append(node)
+        start = time.time()
+        try:
+            return self.original_import(name, globals, locals, fromlist,
+                                        level)
+        finally:
+            node.duration = time.time() - start
+            self.stack.pop()
+            if len(sys.modules) > loaded:
+                node.name = self.resolve(name, globals, level)
+                self.stack[-1].children.append(node)
+
+    @staticmethod
+    def resolve(name, globals, level):
+        """ Return absolute name of a (possibly relative) imported module """
+        if level == 0 or not globals or '__name__' not in globals:
+            return name
+        package = globals.get('__package__')
+        if not package:
+            package = globals['__name__']
+            if '__path__' not in globals:
+                package = package.rpartition('.')[0]
+        if level > 0:
+            package = package.rsplit('.', level - 1)[0]
+            return '%s.%s' % (package, name) if name else package
+        # Implicit relative import (Python 2)
+        relative = '%s.%s' % (package, name)
+        return relative if sys.modules.get(relative) else name
+
+    def format(self, threshold=1):
+        """ Return the import tree as a string
+
+        Imports that took less than ``threshold`` milliseconds are omitted.
+        """
+        lines = ['%8.1f ms  %s' % (self.root.duration * 1000, self.root.name)]
+        lines.extend(self.root.format(threshold, 1))
+        return '\n'.join(lines)
@@ -0,0 +1,64 @@
+""" Lazily loaded routes of CSDS components
+
+This module lists routes registered by ``app.main``. Route modules are only
+imported on first dispatch to one of their URLs (see ``app.lazy``), so the
+path, endpoint name, and methods of each route are repeated here.
+
+``methods`` are the HTTP methods the route is registered with. Because of
+method overrides, routes that implement PUT, PATCH, or DELETE are registered
+with POST instead. ``tests/test_app.py`` checks that this list matches the
+route classes, so a route that is added or changed must be updated here.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+__all__ = ('ROUTES',)
+
+# Modules that register harvested adaptors on import
+HARVESTED_ADAPTORS = ('ra.outernet_facebook',)
+
+ROUTES = (
+    # Web interface handlers
+    {'route': 'cds.webui.WebUIList', 'path': '/requests/',
+     'endpoint': 'cds_webui_list', 'methods': ['GET']},
+    {'route': 'cds.webui.WebUIRequest', 'path': '/requests/<int:request_id>',
+     'endpoint': 'cds_webui_request', 'methods': ['GET', 'POST']},
+    {'route': 'cds.webui.WebUIImage', 'path': '/images/<blob_id>',
+     'endpoint': 'cds_webui_image', 'methods': ['GET']},
+    {'route': 'css.webui.WebUIVote',
+     'path': '/requests/<int:request_id>/suggestions/<url>',
+     'endpoint': 'css_webui_vote', 'methods': ['POST']},
+    {'route': 'css.webui.WebUIPool', 'path': '/pool',
+     'endpoint': 'css_webui_pool', 'methods': ['GET']},
+    {'route': 'css.webui.WebUIPlaylist', 'path': '/playlist',
+     'endpoint': 'css_webui_playlist', 'methods': ['GET', 'POST']},
+    {'route': 'rqm.webui.WebUIProof', 'path': '/requests/<int:request_id>/proof',
+     'endpoint': 'rqm_webui_proof', 'methods': ['GET', 'POST']},
+
+    # Cron job handlers
+    {'route': 'ra.outernet_facebook.OuternetFacebookCronJob',
+     'path': '/rh/harvests/facebook', 'endpoint': 'rh_harvest_facebook',
+     'methods': ['GET']},
+    {'route': 'rh.cron.HarvestCronJob', 'path': '/rh/harvests/',
+     'endpoint': 'rh_harvest_all', 'methods': ['GET'],
+     'requires': HARVESTED_ADAPTORS},
+    {'route': 'css.cron.VoteFlushCronJob', 'path': '/css/cron/votes',
+     'endpoint': 'css_cron_votes', 'methods': ['GET']},
+    {'route': 'css.cron.VoteFoldCronJob', 'path': '/css/cron/vote-events',
+     'endpoint': 'css_cron_vote_events', 'methods': ['GET']},
+
+    # Web hook RAs
+    {'route': 'ra.email.EmailHook', 'path': '/rh/hooks/email',
+     'endpoint': 'rh_hook_email', 'methods': ['POST']},
+
+    # RH API
+    {'route': 'rh.api.RequestBatch', 'path': '/rh/api/requests:batch',
+     'endpoint': 'rh_api_requests_batch', 'methods': ['POST']},
+
+    # Misc handlers
+    {'route': 'app.pages.Homepage', 'path': '/',
+     'endpoint': 'homepage', 'methods': ['GET']},
+    {'route': 'app.pages.CacheStats', 'path': '/stats/cache',
+     'endpoint': 'cache_stats', 'methods': ['GET']},
+)
@@ -0,0 +1,15 @@
+""" App Engine instance configuration
+
+This module is imported by App Engine before any request handler. It makes
+vendored libraries importable by handlers that do not go through
+``app.main``, such as the deferred task handler.
+
+"""
+
+from os.path import abspath, dirname, join
+import sys
+
+VENDOR_DIR = join(abspath(dirname(__file__)), 'vendor')
+
+if VENDOR_DIR not in sys.path:
+    sys.path.insert(0, VENDOR_DIR)
@@ -0,0 +1,193 @@
+""" Content suggestion URL checks
+
+This module implements background checks of content suggestion URLs. Checking
+a URL can take as long as the remote server takes to respond, so suggestions
+are accepted immediately in ``Content.PENDING`` status, and the URL is
+checked in a task on the ``url-checks`` queue (see ``queue.yaml``). The queue
+limits the number of concurrently running checks, and therefore the number
+of open connections.
+
+A URL is first requested using HEAD, and if the server responds with an
+error (some servers do not implement HEAD), using GET. Redirects are
+followed. Results are cached in memcache per URL. Hosts that cannot be
+connected to at all (the host name cannot be resolved, or the connection is
+refused) are also cached, so that suggestions pointing to the same
+unreachable host do not wait for a connection timeout each time. Other
+failures, such as a slow page that times out, only affect the URL, and are
+not cached.
+
+Unreachable URLs are checked again after each of ``RECHECK_DELAYS``,
+bypassing the cache, so a suggestion is not marked as unreachable for good
+because of a temporary failure.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import errno
+import socket
+import hashlib
+import httplib
+import urllib2
+import urlparse
+
+from google.appengine.api import memcache
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
+
+from rh.db import Content
+
+__all__ = ('check_url', 'check_suggestion', 'defer_check')
+
+QUEUE = 'url-checks'
+TIMEOUT = 10  # seconds
+USER_AGENT = 'Outernet CSDS link checker'
+CACHE_PREFIX = 'urlcheck:'
+RESULT_TTL = 60 * 60  # 1 hour
+HOST_TTL = 10 * 60  # 10 minutes
+RECHECK_DELAYS = (15 * 60, 60 * 60, 6 * 60 * 60)  # seconds
+
+# Socket errors that mean the host cannot be connected to at all
+CONNECTION_ERRNOS = (errno.ECONNREFUSED, errno.EHOSTUNREACH,
+                     errno.ENETUNREACH)
+
+
+class FetchError(Exception):
+    """ Raised when the URL cannot be fetched """
+    pass
+
+
+class HostUnreachable(FetchError):
+    """ Raised when connection to the host fails """
+    pass
+
+
+class HeadRequest(urllib2.Request):
+    def get_method(self):
+        return 'HEAD'
+
+
+class RedirectHandler(urllib2.HTTPRedirectHandler):
+    """ Redirect handler that follows redirects of HEAD requests using HEAD """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new = urllib2.HTTPRedirectHandler.redirect_request(
+            self, req, fp, code, msg, headers, newurl)
+        if new is not None and req.get_method() == 'HEAD':
+            new = HeadRequest(new.get_full_url(), headers=new.headers,
+                              origin_req_host=req.get_origin_req_host(),
+                              unverifiable=True)
+        return new
+
+
+opener = urllib2.build_opener(RedirectHandler)
+
+
+def open_url(url, method='GET', timeout=TIMEOUT):
+    """ Request a URL and close the response without reading the body """
+    request_class = HeadRequest if method == 'HEAD' else urllib2.Request
+    req = request_class(url, headers={'User-Agent': USER_AGENT})
+    try:
+        opener.open(req, timeout=timeout).close()
+    except urllib2.HTTPError:
+        raise
+    except (urllib2.URLError, socket.error, httplib.HTTPException) as err:
+        if is_connection_error(err):
+            raise HostUnreachable(str(err))
+        raise FetchError(str(err))
+
+
+def is_connection_error(err):
+    """ Return whether error means that the host cannot be connected to """
+    reason = getattr(err, 'reason', err)
+    if isinstance(reason, socket.gaierror):
+        # Host name cannot be resolved
+        return True
+    if isinstance(reason, socket.timeout):
+        return False
+    return (isinstance(reason, socket.error) and
+            reason.errno in CONNECTION_ERRNOS)
+
+
+def probe_url(url, timeout=TIMEOUT):
+    """ Return ``True`` if the URL is reachable
+
+    Raises ``HostUnreachable`` if the host cannot be connected to, and
+    ``FetchError`` if the URL cannot be fetched for another reason (e.g., the
+    request times out).
+    """
+    try:
+        open_url(url, 'HEAD', timeout)
+        return True
+    except urllib2.HTTPError:
+        pass
+    try:
+        open_url(url, 'GET', timeout)
+        return True
+    except urllib2.HTTPError:
+        return False
+
+
+def get_host(url):
+    return urlparse.urlsplit(url).netloc.lower()
+
+
+def check_url(url, timeout=TIMEOUT, cached=True):
+    """ Return ``True`` if the URL is reachable
+
+    If ``cached`` is ``True``, cached results are used. Results are cached in
+    any case.
+    """
+    key = CACHE_PREFIX + hashlib.sha1(url.encode('utf8')).hexdigest()
+    host_key = CACHE_PREFIX + 'host:' + get_host(url)
+    if cached:
+        result = memcache.get(key)
+        if result is not None:
+            return result
+        if memcache.get(host_key) is not None:
+            return False
+    try:
+        result = probe_url(url, timeout)
+    except HostUnreachable:
+        memcache.set(host_key, False, HOST_TTL)
+        result = False
+    except FetchError:
+        # Failures of a single URL may be temporary, so they are not cached
+        return False
+    except ValueError:
+        # Not a URL that can be opened (e.g., unknown scheme)
+        result = False
+    memcache.set(key, result, RESULT_TTL)
+    return result
+
+
+@ndb.transactional
+def set_status(request_key, url, status):
+    """ Store reachability status of a content suggestion """
+    req = request_key.get()
+    if req is not None and req.set_suggestion_status(url, status):
+        req.put()
+
+
+def check_suggestion(request_key, url, attempt=0):
+    """ Check a content suggestion URL and store the result
+
+    ``attempt`` is the number of earlier checks of the URL. Re-checks do not
+    use cached results. If the URL is unreachable, it is checked again after
+    the next of ``RECHECK_DELAYS``.
+    """
+    if check_url(url, cached=not attempt):
+        status = Content.REACHABLE
+    else:
+        status = Content.UNREACHABLE
+    set_status(request_key, url, status)
+    if status == Content.UNREACHABLE and attempt < len(RECHECK_DELAYS):
+        defer_check(request_key, url, attempt + 1,
+                    countdown=RECHECK_DELAYS[attempt])
+    return status
+
+
+def defer_check(request_key, url, attempt=0, countdown=0):
+    """ Check a content suggestion URL in a task """
+    deferred.defer(check_suggestion, request_key, url, attempt,
+                   _queue=QUEUE, _countdown=countdown)
@@ -7,14 +7,16 @@ community members so content suggestions can be made.
 
 from __future__ import unicode_literals, print_function
 
-import urllib2
-
+from flask import Response
 from google.appengine.ext import ndb
-from utils.routes import HtmlRoute, FormRoute
+from google.appengine.api import datastore_errors
+from utils.routes import Route, HtmlRoute, FormRoute
+from werkzeug.datastructures import ContentRange
 
-from rh.db import Request, Content
+from rh.db import Request, RequestBlob, Content
 
 from .forms import ContentForm
+from .urlcheck import defer_check
 
 
 class WebUIList(HtmlRoute):
@@ -24,7 +26,15 @@ class WebUIList(HtmlRoute):
 
     def get_context(self):
         ctx = super(WebUIList, self).get_context()
-        ctx['requests'] = Request.fetch_cds_requests()
+        per_page = self.app.config['CDS_PAGE_SIZE']
+        try:
+            requests, next_cursor, prev_cursor = Request.fetch_cds_page(
+                self.request.args.get('cursor'), per_page)
+        except datastore_errors.BadValueError:
+            self.abort(400, 'Invalid page cursor')
+        ctx['requests'] = requests
+        ctx['next_cursor'] = next_cursor
+        ctx['prev_cursor'] = prev_cursor
         return ctx
 
 
@@ -54,13 +64,10 @@ class WebUIRequest(FormRoute):
                 'suggested.')
             return self.form_invalid()
 
-        try:
-            urllib2.urlopen(url, timeout=10)
-        except urllib2.HTTPError:
-            self.form.errors['url'] = ('This URL could not be opened.')
-            return self.form_invalid()
-
+        # The URL is checked in the background, and the suggestion is shown
+        # as pending until then
         self.req.put()
+        defer_check(self.req.key, url)
         return super(WebUIRequest, self).form_valid()
 
     def get_context(self):
@@ -81,3 +88,52 @@ class WebUIRequest(FormRoute):
             ctx['content'] = self.req.get_rev(rev)
         return ctx
 
+
+class WebUIImage(Route):
+    """ Serve request images
+
+    This serves both request images and their smaller sizes (see
+    ``rh.imaging``). Blobs are keyed by content digest, so they never change,
+    and are cached for a year. Images are served in chunks, and both
+    conditional requests (using the ETag) and single byte-range requests are
+    supported.
+    """
+    name = 'cds_webui_image'
+    path = '/images/<blob_id>'
+    chunk_size = 64 * 1024
+    max_age = 365 * 24 * 60 * 60  # blobs never change
+
+    def GET(self, blob_id):
+        blob = ndb.Key(RequestBlob, blob_id).get()
+        if blob is None:
+            self.abort(404, 'Image not found')
+        length = len(blob.content)
+        start, stop = 0, length
+        status = 200
+
+        rng = self.request.range
+        if_range = self.request.if_range
+        if rng and if_range.etag in (None, blob.etag):
+            bounds = rng.range_for_length(length)
+            if bounds is None:
+                resp = Response(status=416)
+                resp.headers['Content-Range'] = 'bytes */%s' % length
+                return resp
+            start, stop = bounds
+            status = 206
+
+        resp = Response(self.stream(blob.content, start, stop), status,
+                        mimetype=blob.content_format, direct_passthrough=True)
+        resp.content_length = stop - start
+        if status == 206:
+            resp.content_range = ContentRange('bytes', start, stop, length)
+        resp.headers['Accept-Ranges'] = 'bytes'
+        resp.set_etag(blob.etag)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = self.max_age
+        return resp.make_conditional(self.request)
+
+    def stream(self, content, start, stop):
+        """ Yield chunks of content between start and stop offsets """
+        for offset in range(start, stop, self.chunk_size):
+            yield content[offset:min(offset + self.chunk_size, stop)]
@@ -0,0 +1,41 @@
+""" Content Selection Subsystem cron jobs
+
+This module implements cron job handlers for maintaining voting data.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+from utils.routes import Route
+
+from rh import votes
+
+
+class VoteFlushCronJob(Route):
+    """ Write sharded vote counts back into requests """
+    name = 'css_cron_votes'
+    path = '/css/cron/votes'
+
+    def GET(self):
+        count = votes.flush()
+        self.log.info('Flushed votes for %s requests' % count)
+        return 'OK'
+
+
+class VoteFoldCronJob(Route):
+    """ Apply recorded vote events to requests """
+    name = 'css_cron_vote_events'
+    path = '/css/cron/vote-events'
+
+    # Maximum number of batches processed in a single run
+    max_batches = 20
+
+    def GET(self):
+        count = 0
+        for i in range(self.max_batches):
+            processed = votes.fold_events()
+            if not processed:
+                break
+            count += processed
+        self.log.info('Applied %s vote events' % count)
+        return 'OK'
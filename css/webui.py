@@ -11,10 +11,17 @@ from utils.routes import RedirectMixin, Route, HtmlRoute
 from werkzeug.urls import url_unquote_plus
 
 from rh.db import Request, Playlist
+from rh.votes import VoteCounter, VoteEvent, DEFERRED
 
 
 class WebUIVote(RedirectMixin, Route):
-    """ Handler that facilitates content suggestion voting """
+    """ Handler that facilitates content suggestion voting
+
+    Votes are recorded in sharded counters, and become visible on the request
+    once the counters are flushed by the ``css_cron_votes`` cron job. In
+    deferred voting mode, votes are recorded as vote events and applied by the
+    ``css_cron_vote_events`` cron job instead.
+    """
     name = 'css_webui_vote'
     path = '/requests/<int:request_id>/suggestions/<url>'
 
@@ -24,15 +31,19 @@ class WebUIVote(RedirectMixin, Route):
 
     def PATCH(self, request_id, url):
         url = url_unquote_plus(url)
+        if self.app.config['CSS_VOTE_MODE'] == DEFERRED:
+            # Events for nonexistent requests and suggestions are discarded
+            # when applied, so we don't need to fetch the request here
+            VoteEvent.record(ndb.Key('Request', request_id), url)
+            return self.redirect()
         self.req = ndb.Key('Request', request_id).get()
         if self.req is None:
             self.abort(404, 'No such request')
-        for c in self.req.content_suggestions:
-            if url == c.url:
-                c.votes += 1
-                self.req.put()
-                return self.redirect()
-        self.abort(404, 'No such content suggestion')
+        c = self.req.get_suggestion(url)
+        if c is None:
+            self.abort(404, 'No such content suggestion')
+        VoteCounter(self.req.key, c.url).increment()
+        return self.redirect()
 
 
 class WebUIPool(HtmlRoute):
@@ -42,7 +53,8 @@ class WebUIPool(HtmlRoute):
     template_name = 'css/pool.html'
 
     def get_context(self):
-        return {'pool': Request.fetch_content_pool()}
+        limit = self.app.config['CSS_POOL_SIZE']
+        return {'pool': Request.fetch_content_pool(limit)}
 
 
 class WebUIPlaylist(RedirectMixin, HtmlRoute):
@@ -0,0 +1,46 @@
+""" Migration: Add top suggestion to requests
+
+This module implements a migration endpoint that populates the denormalized
+``top_url`` and ``top_votes`` properties of existing request entities. These
+properties are computed properties, so simply re-saving the entities is enough
+to have them written to the datastore.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+from os.path import abspath, join, dirname
+import sys
+
+PROJECT_PATH = dirname(dirname(__file__))
+PROJECT_DIR = abspath(dirname(dirname(__file__)))
+VENDOR_DIR = join(PROJECT_DIR, 'vendor')
+
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, VENDOR_DIR)
+
+from flask import Flask
+
+from rh.db import Request
+from . import Migration, resave
+
+MIGRATION = '003'
+BATCH_SIZE = 100
+
+app = Flask(__name__)
+
+
+@app.route('/migrations/%s' % MIGRATION)
+def update_requests():
+    """ Re-save all requests that have content suggestions
+
+    Requests are processed in batches of ``BATCH_SIZE``.
+    """
+
+    if Migration.has_run(MIGRATION):
+        return 'Migration %s has already run' % MIGRATION
+
+    count = resave(Request.query(Request.has_suggestions == True),
+                   BATCH_SIZE)
+    Migration.create(MIGRATION)
+    return 'Updated %s requests' % count
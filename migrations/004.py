@@ -0,0 +1,58 @@
+""" Migration: Seed vote counters
+
+This module implements a migration endpoint that copies existing vote counts
+from requests' content suggestions into the seed shards of vote counters.
+Counters are also seeded when they are first incremented, so the migration
+only saves doing that on the first vote. Seeding is transactional, and
+counters that are already seeded are skipped, so the migration is safe to
+run at any time after deploy.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+from os.path import abspath, join, dirname
+import sys
+
+PROJECT_PATH = dirname(dirname(__file__))
+PROJECT_DIR = abspath(dirname(dirname(__file__)))
+VENDOR_DIR = join(PROJECT_DIR, 'vendor')
+
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, VENDOR_DIR)
+
+from flask import Flask
+
+from rh.db import Request
+from rh.votes import VoteCounter
+from . import Migration
+
+MIGRATION = '004'
+BATCH_SIZE = 100
+
+app = Flask(__name__)
+
+
+@app.route('/migrations/%s' % MIGRATION)
+def seed_counters():
+    """ Store existing votes in the seed shard of each counter
+
+    Requests are processed in batches of ``BATCH_SIZE``.
+    """
+
+    if Migration.has_run(MIGRATION):
+        return 'Migration %s has already run' % MIGRATION
+
+    q = Request.query(Request.has_suggestions == True)
+    cursor = None
+    more = True
+    count = 0
+    while more:
+        batch, cursor, more = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
+        for r in batch:
+            for c in r.content_suggestions:
+                if c.votes:
+                    VoteCounter(r.key, c.url).seed()
+                    count += 1
+    Migration.create(MIGRATION)
+    return 'Seeded %s vote counters' % count
@@ -0,0 +1,59 @@
+""" Migration: Move binary content out of requests
+
+This module implements a migration endpoint that moves binary content (images)
+stored in requests' ``binary_content`` property into separate ``RequestBlob``
+entities.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+from os.path import abspath, join, dirname
+import sys
+
+PROJECT_PATH = dirname(dirname(__file__))
+PROJECT_DIR = abspath(dirname(dirname(__file__)))
+VENDOR_DIR = join(PROJECT_DIR, 'vendor')
+
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, VENDOR_DIR)
+
+from google.appengine.ext import ndb
+from flask import Flask
+
+from rh.db import Request, RequestConstants
+from . import Migration
+
+MIGRATION = '005'
+BATCH_SIZE = 20
+
+app = Flask(__name__)
+
+
+@app.route('/migrations/%s' % MIGRATION)
+def move_blobs():
+    """ Move binary content of all non-transcribed requests to blobs
+
+    Requests are processed in batches of ``BATCH_SIZE``.
+    """
+
+    if Migration.has_run(MIGRATION):
+        return 'Migration %s has already run' % MIGRATION
+
+    q = Request.query(Request.content_type == RequestConstants.NONTRANSCRIBED)
+    cursor = None
+    more = True
+    count = 0
+    while more:
+        batch, cursor, more = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
+        changed = []
+        for r in batch:
+            if r.blob or not r.binary_content:
+                continue
+            r.set_binary_content(r.binary_content)
+            r.binary_content = None
+            changed.append(r)
+        ndb.put_multi(changed)
+        count += len(changed)
+    Migration.create(MIGRATION)
+    return 'Moved binary content of %s requests' % count
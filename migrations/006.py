@@ -0,0 +1,50 @@
+""" Migration: Store content suggestions in vote order
+
+This module implements a migration endpoint that re-saves requests with
+content suggestions. Suggestions are sorted when a request is saved, so
+re-saving the entities is enough to store existing suggestions in the order
+that ``Request.sorted_suggestions`` relies on.
+
+Migration 003 re-saves the same requests, but deployments that have run it
+did so before suggestions were sorted on save, and a migration only runs
+once, so the requests are re-saved again under a new migration number.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+from os.path import abspath, join, dirname
+import sys
+
+PROJECT_PATH = dirname(dirname(__file__))
+PROJECT_DIR = abspath(dirname(dirname(__file__)))
+VENDOR_DIR = join(PROJECT_DIR, 'vendor')
+
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, VENDOR_DIR)
+
+from flask import Flask
+
+from rh.db import Request
+from . import Migration, resave
+
+MIGRATION = '006'
+BATCH_SIZE = 100
+
+app = Flask(__name__)
+
+
+@app.route('/migrations/%s' % MIGRATION)
+def sort_suggestions():
+    """ Re-save all requests that have content suggestions
+
+    Requests are processed in batches of ``BATCH_SIZE``.
+    """
+
+    if Migration.has_run(MIGRATION):
+        return 'Migration %s has already run' % MIGRATION
+
+    count = resave(Request.query(Request.has_suggestions == True),
+                   BATCH_SIZE)
+    Migration.create(MIGRATION)
+    return 'Updated %s requests' % count
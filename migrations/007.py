@@ -0,0 +1,58 @@
+""" Migration: Move revisions out of requests
+
+This module implements a migration endpoint that moves revisions stored in
+requests' ``revisions`` property into separate ``Revision`` entities, and
+stores the current revision on the request.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+from os.path import abspath, join, dirname
+import sys
+
+PROJECT_PATH = dirname(dirname(__file__))
+PROJECT_DIR = abspath(dirname(dirname(__file__)))
+VENDOR_DIR = join(PROJECT_DIR, 'vendor')
+
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, VENDOR_DIR)
+
+from google.appengine.ext import ndb
+from flask import Flask
+
+from rh.db import Request
+from . import Migration
+
+MIGRATION = '007'
+BATCH_SIZE = 20
+
+app = Flask(__name__)
+
+
+@app.route('/migrations/%s' % MIGRATION)
+def move_revisions():
+    """ Move revisions of all requests to revision entities
+
+    Requests are processed in batches of ``BATCH_SIZE``.
+    """
+
+    if Migration.has_run(MIGRATION):
+        return 'Migration %s has already run' % MIGRATION
+
+    q = Request.query()
+    cursor = None
+    more = True
+    count = 0
+    while more:
+        batch, cursor, more = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
+        changed = []
+        for r in batch:
+            if not r.revisions:
+                continue
+            r.move_revisions()
+            changed.append(r)
+        ndb.put_multi(changed)
+        count += len(changed)
+    Migration.create(MIGRATION)
+    return 'Moved revisions of %s requests' % count
@@ -0,0 +1,100 @@
+""" Migration: Derive sizes of request images
+
+This module implements a migration endpoint that derives the capped master,
+preview, and thumbnail of images of existing image requests (see
+``rh.imaging``). Posted images that are replaced by the master are deleted
+unless other requests still use them as their image, preview, or thumbnail.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+from os.path import abspath, join, dirname
+import sys
+
+PROJECT_PATH = dirname(dirname(__file__))
+PROJECT_DIR = abspath(dirname(dirname(__file__)))
+VENDOR_DIR = join(PROJECT_DIR, 'vendor')
+
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, VENDOR_DIR)
+
+from google.appengine.ext import ndb
+from flask import Flask
+
+from rh.db import Request
+from rh.imaging import derive_images
+from . import Migration
+
+MIGRATION = '008'
+BATCH_SIZE = 10
+
+app = Flask(__name__)
+
+
+def derive(r):
+    """ Derive image sizes of a request, and return the posted blob key
+
+    ``None`` is returned if the image sizes cannot be derived.
+    """
+    blob = r.blob.get()
+    if blob is None:
+        return None
+    derivatives = derive_images(blob.content, r.content_format)
+    if not derivatives:
+        return None
+    r.set_binary_content(*derivatives['master'])
+    for name in ('preview', 'thumbnail'):
+        r.set_derivative(name, *derivatives[name])
+    return blob.key
+
+
+def used_blobs(q):
+    """ Return keys of all blobs used by requests matched by query
+
+    Blob key properties are not indexed, so requests are scanned in batches
+    of ``BATCH_SIZE``.
+    """
+    used = set()
+    for r in q.iter(batch_size=BATCH_SIZE):
+        used.update([r.blob, r.preview, r.thumbnail])
+    return used
+
+
+@app.route('/migrations/%s' % MIGRATION)
+def derive_request_images():
+    """ Derive image sizes of all image requests
+
+    Requests are processed in batches of ``BATCH_SIZE``.
+    """
+
+    if Migration.has_run(MIGRATION):
+        return 'Migration %s has already run' % MIGRATION
+
+    q = Request.query(Request.content_type == Request.NONTRANSCRIBED)
+    cursor = None
+    more = True
+    count = 0
+    replaced = []
+    while more:
+        batch, cursor, more = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
+        changed = []
+        for r in batch:
+            if r.blob is None or r.thumbnail is not None:
+                continue
+            old_key = derive(r)
+            if old_key is None:
+                continue
+            if old_key != r.blob:
+                replaced.append(old_key)
+            changed.append(r)
+        ndb.put_multi(changed)
+        count += len(changed)
+    # Keys are collected once all requests have been updated, so images
+    # that are still used by any request are kept
+    used = used_blobs(q)
+    unused = [k for k in set(replaced) if k not in used]
+    ndb.delete_multi(unused)
+    Migration.create(MIGRATION)
+    return 'Derived image sizes of %s requests, deleted %s images' % (
+        count, len(unused))
@@ -15,3 +15,19 @@ class Migration(ndb.Model):
     def create(cls, migration_number):
         cls(id=migration_number).put()
 
+
+def resave(query, batch_size=100):
+    """ Re-save all entities matched by query, and return their number
+
+    Entities are processed in batches of ``batch_size``. Re-saving entities
+    stores their computed properties, and runs their pre-put hooks.
+    """
+    cursor = None
+    more = True
+    count = 0
+    while more:
+        batch, cursor, more = query.fetch_page(batch_size,
+                                               start_cursor=cursor)
+        ndb.put_multi(batch)
+        count += len(batch)
+    return count
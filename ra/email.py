@@ -4,13 +4,25 @@ This adaptor collects requests from emails sent to request@csds.outernet.is
 using Mandrill Webhook.
 
 Because this is a hook-based adaptor, it has no cron job. It stores requests
-one by one as they are received.
+as they are received. Requests are rate-limited per adaptor and per sender
+address, and requests over the limit are stored later (see ``rh.ratelimit``).
+
+The text of each message becomes a text request, and each image attachment
+(including inline images) becomes an image request. Images larger than a
+blob are stored as their derived master (see ``rh.imaging``), and are
+rejected if they cannot be resized to fit. Attachments that could be larger
+than ``MAX_ATTACHMENT_SIZE`` once decoded are skipped without decoding them,
+and skipped attachments are logged. Attachments are decoded one by one as
+requests are stored in chunks of at most ``CHUNK_SIZE`` requests or
+``CHUNK_BYTES`` bytes of content, so a large batch of messages is never
+decoded all at once.
 
 """
 
 from __future__ import unicode_literals, print_function
 
 import datetime
+import logging
 import json
 import collections
 import base64
@@ -22,8 +34,26 @@ from flask import current_app as app
 from utils.routes import Route
 
 from rh.adaptors import Adaptor
-from rh.requests import Request
-from rh.db import HarvestHistory
+from rh.requests import Request, check_many, decode_base64
+from rh.exceptions import BinaryDecodeError
+from rh.db import HarvestHistory, RequestFingerprint
+from rh.ratelimit import admit, defer_backlog
+
+# Inbound messages are limited to 25MB by Mandrill, and attachments are
+# resized to fit in a blob once decoded
+MAX_ATTACHMENT_SIZE = 25 * 1024 * 1024  # 25MB
+MAX_ATTACHMENTS = 10  # per message
+CHUNK_SIZE = 20
+CHUNK_BYTES = 8 * 1024 * 1024  # 8MB
+
+# Request content formats of accepted attachment MIME types
+IMAGE_TYPES = {
+    'image/png': Request.PNG,
+    'image/jpeg': Request.JPG,
+    'image/jpg': Request.JPG,
+    'image/pjpeg': Request.JPG,
+    'image/gif': Request.GIF,
+}
 
 
 class OuternetEmailAdaptor(Adaptor):
@@ -39,40 +69,104 @@ class OuternetEmailAdaptor(Adaptor):
     contact = 'hello@outernet.com'
     trusted = True
 
+    # Limits of requests per second (and in a burst) from a single sender
+    sender_rate = 1 / 60.0
+    sender_burst = 10
+
     def __init__(self, data):
         self.api_id = app.config['EML_API_ID']
         self.api_key = app.config['EML_API_KEY']
         self.data = json.loads(data)
 
     def get_requests(self, last_access=None):
-        # TODO: Accept image attachments as well. The attachments are stored in
-        # attachments key, and has the following structure:
-        #
-        #     {
-        #       'name':    (string) filename
-        #       'type':    (string) mime type
-        #       'content': (string) content of the attachment
-        #       'base64':  (bool) whether attachment is base-64-encoded (this
-        #                  includes non-UTF-8 characters
-        #     }
-        #
-        # More about the inbound hook format: http://bit.ly/1kpcYlt
-        requests = []
+        """ Yield requests from messages and their image attachments
+
+        Message data is documented at http://bit.ly/1kpcYlt.
+        """
         for d in self.data:
-            timestamp = d['ts']
-            # TODO: We currently only handle text portion of the message body. The
-            # message may be HTML-only, although we assume this is rare. This case
-            # should be checked and HTML message extracted and converted to text.
-            # The HTML message is stored in ``message['html']``.
-            body = d['msg']['text']
-            requests.append(Request(
-                adaptor=self,
-                content=body,
-                timestamp=datetime.datetime.fromtimestamp(timestamp),
-                content_format=Request.TEXT,
-                world=Request.ONLINE
-            ))
-        return requests
+            msg = d['msg']
+            timestamp = datetime.datetime.fromtimestamp(d['ts'])
+            sender = msg.get('from_email')
+            # Mandrill retries failed webhook calls, so we use message ID to
+            # make sure the same message is only stored once
+            message_id = msg.get('headers', {}).get('Message-Id')
+            # TODO: We currently only handle text portion of the message body.
+            # The message may be HTML-only, although we assume this is rare.
+            # This case should be checked and HTML message extracted and
+            # converted to text. The HTML message is stored in
+            # ``message['html']``.
+            body = msg.get('text')
+            attachments = self.get_attachments(msg)
+            if body and body.strip() or not attachments:
+                yield Request(
+                    adaptor=self,
+                    content=body,
+                    timestamp=timestamp,
+                    content_format=Request.TEXT,
+                    world=Request.ONLINE,
+                    source_id=message_id,
+                    sender=sender,
+                )
+            for index, attachment in enumerate(attachments):
+                content = self.decode_attachment(attachment)
+                if content is None:
+                    continue
+                yield Request(
+                    adaptor=self,
+                    content=content,
+                    timestamp=timestamp,
+                    content_format=IMAGE_TYPES[attachment['type'].lower()],
+                    world=Request.ONLINE,
+                    # Attachments of a message may have the same name
+                    source_id=message_id and '%s:%s:%s' % (
+                        message_id, index, attachment.get('name')),
+                    sender=sender,
+                    encoded=False,
+                )
+                # The request is the only reference to the content
+                content = None
+
+    @staticmethod
+    def get_attachments(msg):
+        """ Return image attachments of a message, ordered by name
+
+        Attachments are objects with the following keys:
+
+        - ``name``: file name
+        - ``type``: MIME type
+        - ``content``: content of the attachment
+        - ``base64``: whether the content is Base64-encoded
+
+        Inline images have the same structure.
+        """
+        attachments = list((msg.get('attachments') or {}).values())
+        attachments.extend((msg.get('images') or {}).values())
+        images = [a for a in attachments
+                  if (a.get('type') or '').lower() in IMAGE_TYPES]
+        images.sort(key=lambda a: a.get('name'))
+        if len(images) > MAX_ATTACHMENTS:
+            logging.warning('Skipped %s image attachments' % (
+                len(images) - MAX_ATTACHMENTS))
+        return images[:MAX_ATTACHMENTS]
+
+    @staticmethod
+    def decode_attachment(attachment):
+        """ Return decoded attachment content, or ``None`` if invalid
+
+        The encoded content is removed from the attachment, so that it can be
+        freed once it is decoded.
+        """
+        content = attachment.pop('content', None)
+        if not content or not attachment.get('base64'):
+            logging.warning('Skipped attachment %s without image data' % (
+                attachment.get('name')))
+            return None
+        try:
+            return decode_base64(content, MAX_ATTACHMENT_SIZE)
+        except BinaryDecodeError as err:
+            logging.warning('Skipped attachment %s: %s' % (
+                attachment.get('name'), err))
+            return None
 
 
 class EmailHook(Route):
@@ -117,15 +211,39 @@ class EmailHook(Route):
             return 'OK'
         self.log.debug('Signature verification passed')
         adaptor = self.get_adaptor()
-        requests = adaptor.get_requests()
-        clean = []
-        for r in requests:
-            try:
-                r.check()
-                clean.append(r.prepare())
-            except r.RequestError as err:
-                self.log.exception('Request error: %s' % err)
-        self.log.info('Prepared %s email reqeusts' % len(clean))
-        ndb.put_multi(clean)
+        for chunk in self.chunk_requests(adaptor.get_requests()):
+            self.store_chunk(adaptor, chunk)
         return 'OK'
 
+    @staticmethod
+    def chunk_requests(requests):
+        """ Yield lists of requests limited by count and content size """
+        chunk = []
+        size = 0
+        for r in requests:
+            chunk.append(r)
+            size += len(r.raw_content or '')
+            if len(chunk) == CHUNK_SIZE or size >= CHUNK_BYTES:
+                yield chunk
+                chunk = []
+                size = 0
+        if chunk:
+            yield chunk
+
+    def store_chunk(self, adaptor, requests):
+        """ Check and store a chunk of requests """
+        requests, backlog, wait = admit(adaptor, requests)
+        if backlog:
+            self.log.info('Deferred %s email requests over rate limit' % (
+                len(backlog)))
+            defer_backlog(adaptor, backlog, wait)
+        clean, errors = check_many(requests)
+        for r, err in errors:
+            self.log.error('Request error: %s' % err)
+        self.log.info('Prepared %s email reqeusts' % len(clean))
+        unique, fingerprints = RequestFingerprint.deduplicate(clean)
+        self.log.info('Linked %s duplicate email requests' % (
+            len(clean) - len(unique)))
+        # Blobs are stored in the same batch as the requests
+        extra = [x for r in unique for x in r.pop_unsaved()]
+        ndb.put_multi(unique + fingerprints + extra)
@@ -16,10 +16,11 @@ import facebook
 from flask import current_app as app
 from utils.routes import Route
 
-from rh.adaptors import Adaptor, CronJobHandlerMixin
+from rh.adaptors import Adaptor, CronJobHandlerMixin, registry
 from rh.requests import Request
 
 
+@registry.register
 class OuternetFacebookAdaptor(Adaptor):
     """ Outernet Facebook Page Adaptor
 
@@ -40,24 +41,23 @@ class OuternetFacebookAdaptor(Adaptor):
         self.page_id = app.config['OFB_PAGE_ID']
 
     def get_requests(self, last_access):
-        """ Collect messages from the Facebook page and return the list """
+        """ Collect messages from the Facebook page and yield requests """
         data = self.get_posts(self.page_id, last_access)
-        requests = []
         print(data)
         for post in data:
             if not post['message']:
                 continue
             # TODO: First check if post is an image and do things differently
             # for them.
-            requests.append(Request(
+            yield Request(
                 adaptor=self,
                 content=post['message'],
                 timestamp=datetime.datetime.fromtimestamp(
                     int(post['created_time'])),
                 content_format=Request.TEXT,
                 world=Request.ONLINE,
-            ))
-        return requests
+                source_id=post['post_id'],
+            )
 
     def get_posts(self, page_id, last_access):
         """ Obtain all posts made by other users on a wall """
@@ -65,9 +65,10 @@ class OuternetFacebookAdaptor(Adaptor):
                                                      self.app_secret)
         timestamp = calendar.timegm(last_access.timetuple())
         graph = facebook.GraphAPI(access_token)
-        query = ('SELECT actor_id, message, created_time FROM stream '
-                 'WHERE type < 0 AND source_id=%s '
-                 'AND created_time >= %s' % (page_id, timestamp))
+        query = ('SELECT post_id, actor_id, message, created_time '
+                 'FROM stream WHERE type < 0 AND source_id=%s '
+                 'AND created_time >= %s '
+                 'ORDER BY created_time ASC' % (page_id, timestamp))
         return graph.fql(query)
 
     def get_location(self, page_id):
@@ -78,7 +79,12 @@ class OuternetFacebookAdaptor(Adaptor):
 
 
 class OuternetFacebookCronJob(CronJobHandlerMixin, Route):
-    """ Outernet Facebook adaptor quarter-daily harvest cron job """
+    """ Outernet Facebook adaptor harvest job
+
+    The adaptor is normally harvested along with other registered adaptors by
+    the ``rh_harvest_all`` cron job. This handler can be used to harvest it on
+    its own.
+    """
     name = 'rh_harvest_facebook'
     path = '/rh/harvests/facebook'
     adaptor_class = OuternetFacebookAdaptor
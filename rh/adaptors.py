@@ -9,17 +9,28 @@ incoming requests for adaptor credentials.
 
 The interfaces in this module also provide a consistent way of invoking adaptor
 actions (such as harvesting requests from a remote source), which is used by
-the hub to collect data.
+the hub to collect data. Adaptors that harvest requests periodically are
+registered in ``registry``, and ``HarvestScheduler`` harvests all of them
+concurrently.
 
 """
 
+import time
+import pickle
 import logging
+import threading
+import collections
 
 from flask import Response
 from google.appengine.ext import ndb
+from google.appengine.ext import deferred
+from google.appengine.runtime import DeadlineExceededError
 
-from .db import HarvestHistory
-from .exceptions import RequestError
+from .db import HarvestHistory, RequestFingerprint, RATE_LIMIT, RATE_BURST
+from .requests import check_many
+
+# Maximum size of a deferred chunk (deferred tasks are limited to 1MB)
+DEFER_PAYLOAD_SIZE = 900 * 1024
 
 
 class Adaptor(object):
@@ -40,6 +51,14 @@ class Adaptor(object):
     contact = None
     trusted = False
 
+    # Number of seconds a harvest using this adaptor is allowed to take
+    deadline = 60
+
+    # Number of requests per second, and in a single burst, accepted from
+    # adaptors that push requests to the hub (see ``rh.ratelimit``)
+    rate = RATE_LIMIT
+    burst = RATE_BURST
+
     def get_requests(self, last_run):
         """ Return request objects
 
@@ -48,7 +67,10 @@ class Adaptor(object):
 
         The requests can be harvested at any time including the moment this
         method is called. The only requirement for this method is that it
-        returns an interable containing all gathered requests.
+        returns an interable containing all gathered requests. The iterable
+        may be a generator, in which case requests are processed as they are
+        generated. Requests should be ordered by posting time (oldest first),
+        so that interrupted harvests can be resumed.
 
         The single argument, ``last_run``, is passed to this method. This
         argument is a datetime object representing the last time
@@ -67,59 +89,330 @@ class Adaptor(object):
         request.source = self.source
 
 
-class CronJobHandlerMixin(object):
-    """ Mixin class for creating Flask route handlers for cron jobs """
+class AdaptorRegistry(object):
+    """ Registry of adaptors whose requests are harvested by the hub
+
+    Adaptor classes are registered using the ``register()`` method, which can
+    also be used as a class decorator::
+
+        @registry.register
+        class MyAdaptor(Adaptor):
+            name = 'my-adaptor'
+
+    """
+
+    def __init__(self):
+        self.adaptors = collections.OrderedDict()
+
+    def register(self, adaptor_class):
+        """ Register an adaptor class under its name """
+        self.adaptors[adaptor_class.name] = adaptor_class
+        return adaptor_class
+
+    def get(self, name):
+        """ Return adaptor class registered under given name or ``None`` """
+        return self.adaptors.get(name)
+
+    def __iter__(self):
+        return iter(self.adaptors.values())
+
+    def __len__(self):
+        return len(self.adaptors)
+
+
+registry = AdaptorRegistry()
+
+
+def chunked(iterable, size):
+    """ Yield lists of at most ``size`` items from an iterable """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def store_chunk(entities):
+    """ Store a chunk of request entities along with their fingerprints
+
+    This function is used to retry storing chunks that could not be stored
+    during harvest, using the deferred library. Exceptions are not trapped, so
+    the task is retried until the chunk is stored.
+    """
+    ndb.put_multi(entities)
+
+
+def defer_chunk(entities, max_size=DEFER_PAYLOAD_SIZE):
+    """ Defer storing entities in tasks of at most ``max_size`` bytes
+
+    Entities are pickled by the deferred library, which keeps only their
+    stored properties, so ``entities`` must not include requests with
+    unsaved blobs or revisions (see ``rh.db.Request.pop_unsaved()``).
+    Returns the number of deferred tasks.
+    """
+    tasks = 0
+    batch = []
+    size = 0
+    for e in entities:
+        entity_size = len(pickle.dumps(e, pickle.HIGHEST_PROTOCOL))
+        if batch and size + entity_size > max_size:
+            deferred.defer(store_chunk, batch)
+            tasks += 1
+            batch = []
+            size = 0
+        batch.append(e)
+        size += entity_size
+    if batch:
+        deferred.defer(store_chunk, batch)
+        tasks += 1
+    return tasks
+
+
+class HarvestJob(object):
+    """ Harvests requests using a single adaptor
+
+    Harvest is a streaming pipeline. Requests obtained from the adaptor (which
+    may return a generator) are checked lazily, and valid requests are stored
+    in chunks of ``chunk_size``. Each chunk is stored asynchronously while the
+    next one is being checked.
+
+    A chunk that cannot be stored is retried once. If it fails again, it is
+    deferred to the task queue, so it does not affect other chunks.
+
+    After each chunk, the harvest progress is checkpointed in the adaptor's
+    harvest history as a high-water mark: the newest posting time among stored
+    requests, and source ids of requests posted at exactly that time. The next
+    harvest (including one that resumes a harvest interrupted by the request
+    deadline) starts from the high-water mark. Requests older than the mark,
+    and requests at the mark whose source ids were already seen, are skipped.
+    Requests that have a source id are also stored under a deterministic key
+    (see ``rh.keys.generate_request_id()``), and requests already stored under
+    their key are not stored again, so edits made since are kept.
+
+    Requests whose content was already stored (e.g., the same image posted to
+    several sources) are linked to the stored request through their content
+    fingerprint instead of being stored again (see
+    ``rh.db.RequestFingerprint``).
+    """
 
     # Set this to a proper Adaptor subclass
     adaptor_class = None
 
-    def GET(self):
-        """ Harvest the requests from Outernet Facebook page """
-        self.run_job()
-        return self.ok()
+    # Number of requests stored in a single datastore call
+    chunk_size = 200
+
+    # Time (as returned by ``time.time()``) after which the harvest stops at
+    # the end of the chunk in progress, or ``None`` (see ``HarvestScheduler``)
+    stop_at = None
 
     def run_job(self):
-        """ Run the cron job in a generic way """
+        """ Run the harvest in a generic way
+
+        Statistics about the run are stored in the ``stats`` attribute, and
+        also returned.
+        """
         if not self.adaptor_class:
             logging.error('No adaptor class')
             return
+        start = time.time()
+        self.stats = {'adaptor': self.adaptor_class.name, 'fetched': 0,
+                      'rejected': 0, 'skipped': 0, 'duplicates': 0, 'saved': 0,
+                      'deferred': 0}
         self.adaptor = self.adaptor_class()
-        requests = self.get_requests()
-        clean = self.check_requests(requests)
-        res = self.persist_requests(clean)
-        logging.info('Saved %s requests' % len(res))
+        self.history = HarvestHistory.get_history(self.adaptor)
+        self.high_water = self.history.high_water
+        self.boundary_ids = set(self.history.boundary_ids)
+        try:
+            # Seen requests are skipped before they are checked, since
+            # checking image requests is expensive
+            requests = self.skip_seen(self.get_requests())
+            self.persist_requests(self.check_requests(requests))
+        except DeadlineExceededError:
+            # Only raised in the main thread, i.e., when the job is run by a
+            # cron handler (see ``CronJobHandlerMixin``)
+            self.stats['interrupted'] = True
+        if self.stats.get('interrupted'):
+            logging.error('Harvest using %s interrupted at %s' % (
+                self.adaptor.name, self.high_water))
+            self.stats['time'] = time.time() - start
+            return self.stats
+        logging.info('Saved %s requests' % self.stats['saved'])
         HarvestHistory.record(self.adaptor)
+        self.stats['time'] = time.time() - start
+        return self.stats
 
     def get_requests(self):
         """ Instantiate the adaptor object and obtain requests """
         last_run = HarvestHistory.get_timestamp(self.adaptor)
         return self.adaptor.get_requests(last_run)
 
-    @staticmethod
-    def check_requests(requests):
-        """ Check each request, and compile a list of valid requests """
-        clean = []
-        for request in requests:
+    def check_requests(self, requests):
+        """ Check requests in chunks, and yield valid request entities
+
+        If ``stop_at`` has passed after a chunk, no more requests are
+        obtained from the adaptor, and the harvest is marked as interrupted.
+        """
+        for chunk in chunked(requests, self.chunk_size):
+            entities, errors = check_many(chunk)
+            for request, err in errors:
+                self.stats['rejected'] += 1
+                logging.error('Error processing request: %s' % err)
+            for e in entities:
+                yield e
+            if self.stop_at is not None and time.time() >= self.stop_at:
+                self.stats['interrupted'] = True
+                return
+
+    def skip_seen(self, requests):
+        """ Yield requests that were not harvested before
+
+        Requests are compared with the high-water mark of previous harvests,
+        not the mark that is updated as chunks of this harvest are stored.
+        """
+        high_water = self.high_water
+        boundary_ids = set(self.boundary_ids)
+        for r in requests:
+            self.stats['fetched'] += 1
+            if high_water is not None and (
+                    r.posted < high_water or
+                    r.posted == high_water and
+                    r.source_id in boundary_ids):
+                self.stats['skipped'] += 1
+                continue
+            yield r
+
+    def persist_requests(self, entities):
+        """ Store request entities in datastore in chunks """
+        pending = None
+        for chunk in chunked(entities, self.chunk_size):
+            # The previous chunk is committed before looking up duplicates,
+            # so that its fingerprints are found
+            if pending:
+                self.commit_chunk(*pending)
+            unique, fingerprints = RequestFingerprint.deduplicate(chunk)
+            self.stats['duplicates'] += len(chunk) - len(unique)
+            # Blobs and revisions are stored in the same batch, since
+            # ``put()`` would store them synchronously, one request at a time
+            batch = []
+            for e in unique:
+                batch.extend(e.pop_unsaved())
+            batch.extend(unique + fingerprints)
+            # The batch is flushed so the put starts right away
+            futures = ndb.put_multi_async(batch)
+            ndb.get_context().flush()
+            pending = chunk, batch, futures, len(unique)
+        if pending:
+            self.commit_chunk(*pending)
+
+    def commit_chunk(self, chunk, batch, futures, count):
+        """ Wait for a batch to be stored and update the high-water mark
+
+        ``chunk`` is the list of harvested entities, and ``batch`` is the list
+        of entities that were actually stored (``count`` unique requests,
+        their blobs, revisions, and fingerprints). Duplicates also count towards the high-water
+        mark, so they are not linked again by the next harvest.
+        """
+        ndb.Future.wait_all(futures)
+        if any(f.get_exception() for f in futures):
             try:
-                request.check()
-                clean.append(request.prepare())
-            except RequestError as err:
-                logging.exception('Error processing request: %s' % err)
-        return clean
+                ndb.put_multi(batch)
+            except Exception as err:
+                logging.exception('Error saving requests: %s' % err)
+                defer_chunk(batch)
+                self.stats['deferred'] += count
+            else:
+                self.stats['saved'] += count
+        else:
+            self.stats['saved'] += count
+        for e in chunk:
+            if self.high_water is None or e.posted > self.high_water:
+                self.high_water = e.posted
+                self.boundary_ids = set()
+            if e.posted == self.high_water and e.source_id is not None:
+                self.boundary_ids.add(e.source_id)
+        self.history.high_water = self.high_water
+        self.history.boundary_ids = sorted(self.boundary_ids)
+        self.history.put()
 
-    @staticmethod
-    def persist_requests(requests):
-        """ Store all requests in datastore """
-        if not requests:
-            return []
-        res = []
-        try:
-            res = ndb.put_multi(requests)
-        except Exception as err:
-            logging.exception('Error saving requests: %s' %  err)
-        return res
+
+class CronJobHandlerMixin(HarvestJob):
+    """ Mixin class for creating Flask route handlers for cron jobs """
+
+    def GET(self):
+        """ Harvest the requests using the adaptor """
+        self.run_job()
+        return self.ok()
 
     @staticmethod
     def ok():
         """ Return 200 OK response """
         return Response('OK', 200)
+
+
+class HarvestScheduler(object):
+    """ Harvests requests using multiple adaptors concurrently
+
+    Each adaptor's harvest job runs in a separate thread, so a slow remote
+    source does not hold up the others. Each job must finish by the adaptor's
+    ``deadline`` (counted from the start of the run). A job that is still
+    running at its deadline stops once the chunk in progress is stored (see
+    ``HarvestJob.stop_at``), and resumes from its high-water mark on the next
+    run. The scheduler reports it as timed out, without waiting for that
+    chunk.
+
+    By default, all adaptors in the ``registry`` are harvested. If ``app`` is
+    specified, jobs run within its application context, so adaptors can access
+    the application configuration.
+    """
+
+    def __init__(self, adaptors=None, app=None):
+        if adaptors is None:
+            adaptors = registry
+        self.adaptors = list(adaptors)
+        self.app = app
+
+    def run(self):
+        """ Run all harvest jobs and return a list of per-adaptor stats """
+        start = time.time()
+        jobs = []
+        for adaptor_class in self.adaptors:
+            job = HarvestJob()
+            job.adaptor_class = adaptor_class
+            job.stop_at = start + adaptor_class.deadline
+            job.stats = {'adaptor': adaptor_class.name}
+            thread = threading.Thread(target=self.run_job, args=(job,))
+            thread.daemon = True
+            thread.start()
+            jobs.append((job, thread))
+
+        report = []
+        for job, thread in jobs:
+            remaining = start + job.adaptor_class.deadline - time.time()
+            thread.join(max(remaining, 0))
+            if thread.is_alive() or job.stats.get('interrupted'):
+                logging.error('Harvest using %s timed out' % (
+                    job.stats['adaptor']))
+                job.stats.update(status='timeout', time=time.time() - start)
+            # Copy the stats, since a timed-out job may still update them
+            report.append(dict(job.stats))
+        return report
+
+    def run_job(self, job):
+        """ Run a single job, and record its status """
+        start = time.time()
+        try:
+            if self.app is None:
+                job.run_job()
+            else:
+                with self.app.app_context():
+                    job.run_job()
+        except Exception as err:
+            logging.exception('Harvest using %s failed: %s' % (
+                job.stats['adaptor'], err))
+            job.stats.update(status='error', time=time.time() - start)
+        else:
+            job.stats['status'] = (
+                'timeout' if job.stats.get('interrupted') else 'ok')
@@ -0,0 +1,323 @@
+""" Request hub API
+
+This module implements the RH API used by remote adaptors (see
+``rh.db.RemoteAdaptor``) to push requests to the hub.
+
+Remote adaptors authenticate using the API key they were issued, passed in
+the ``X-API-Key`` header (see ``rh.auth``). Requests are posted in batches to
+``/rh/api/requests:batch`` in one of two formats, selected by the
+``Content-Type`` header:
+
+``application/x-ndjson``
+    One JSON object per line. Binary content (images) is Base64-encoded.
+
+``application/vnd.outernet.requests``
+    Compact binary envelope, which starts with the ``ENVELOPE_MAGIC`` bytes,
+    followed by records. Each record consists of a 2-byte header length, the
+    header (a JSON object encoded as UTF-8), a 4-byte content length, and the
+    content (UTF-8-encoded text, or raw image data). Lengths are big-endian
+    unsigned integers. Content is not part of the header.
+
+Request objects have the following keys (``content`` is only used in the
+NDJSON format):
+
+- ``content``: request content
+- ``format``: content format (default: ``text/plain``)
+- ``timestamp``: posting time, as seconds since epoch, or an ISO 8601 UTC
+  timestamp (e.g., ``2014-04-01T12:00:00Z``)
+- ``world``: ``online`` or ``offline``
+- ``language``, ``content_language``, ``topic``: optional request metadata
+- ``source_id``: optional request identifier at the source. A request whose
+  source id was already stored is reported as a duplicate, and is not stored
+  again, so posting a batch again does not overwrite edits made since
+
+The batch is read and validated in a single streaming pass, and valid
+requests are stored in chunks of ``CHUNK_SIZE``. Requests are rate-limited
+per adaptor before they are validated, and requests over the limit are
+validated and stored later (see ``rh.ratelimit``). The response is a JSON
+object with the number of ``saved``, ``duplicate``, ``rejected``, and
+``queued`` requests, and ``results`` for each request in batch order. Each
+result has the ``index`` of the request in the batch, and ``status``, which
+is one of:
+
+- ``saved``: the request was stored under ``id``
+- ``duplicate``: the request (by source id) or its content was already
+  stored under ``id``
+- ``rejected``: the request is invalid (see ``error``)
+- ``queued``: the request is over the rate limit, and will be stored later
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import json
+import struct
+import datetime
+
+from flask import Response
+from google.appengine.ext import ndb
+from utils.routes import Route
+
+from .adaptors import chunked
+from .db import RequestFingerprint
+from .auth import authenticate
+from .ratelimit import admit, defer_backlog
+from .requests import Request
+from .exceptions import RequestError
+
+__all__ = ('BatchFormatError', 'read_ndjson', 'read_envelope',
+           'request_from_item', 'RequestBatch')
+
+NDJSON = 'application/x-ndjson'
+ENVELOPE = 'application/vnd.outernet.requests'
+ENVELOPE_MAGIC = b'ORQ1'
+
+MAX_ITEMS = 5000
+MAX_CONTENT_SIZE = 1024 * 1024  # 1MB
+CHUNK_SIZE = 200
+READ_SIZE = 64 * 1024
+
+WORLDS = {
+    'online': Request.ONLINE,
+    'offline': Request.OFFLINE,
+}
+
+TIMESTAMP_FORMATS = ('%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S.%fZ',
+                     '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f')
+
+
+class BatchFormatError(Exception):
+    """ Raised when batch cannot be read any further """
+    pass
+
+
+class ItemError(Exception):
+    """ Raised when a single item in a batch cannot be read """
+    pass
+
+
+def read_ndjson(stream):
+    """ Yield ``(item, content)`` pairs read from a NDJSON stream
+
+    ``content`` is always ``None``, as content is part of the item. An
+    ``ItemError`` instance is yielded instead of the pair for lines that
+    cannot be read.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        if len(line) > MAX_CONTENT_SIZE * 2:
+            yield ItemError('Request too large'), None
+            continue
+        try:
+            item = json.loads(line.decode('utf8'))
+        except ValueError:
+            yield ItemError('Invalid JSON'), None
+            continue
+        yield item, None
+
+
+def read_exactly(stream, size):
+    """ Read ``size`` bytes from stream """
+    parts = []
+    remaining = size
+    while remaining:
+        data = stream.read(min(remaining, READ_SIZE))
+        if not data:
+            raise BatchFormatError('Unexpected end of batch')
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+def read_envelope(stream):
+    """ Yield ``(item, content)`` pairs read from a binary envelope stream
+
+    ``content`` is a bytestring. An ``ItemError`` instance is yielded instead
+    of the item for records that cannot be read (their content is skipped).
+    ``BatchFormatError`` is raised if the envelope is malformed.
+    """
+    if stream.read(len(ENVELOPE_MAGIC)) != ENVELOPE_MAGIC:
+        raise BatchFormatError('Invalid envelope')
+    while True:
+        header = stream.read(2)
+        if not header:
+            return
+        if len(header) < 2:
+            raise BatchFormatError('Unexpected end of batch')
+        size, = struct.unpack(b'>H', header)
+        header = read_exactly(stream, size)
+        size, = struct.unpack(b'>I', read_exactly(stream, 4))
+        if size > MAX_CONTENT_SIZE:
+            # Skip the content without keeping it in memory
+            while size:
+                size -= len(read_exactly(stream, min(size, READ_SIZE)))
+            yield ItemError('Request too large'), None
+            continue
+        content = read_exactly(stream, size)
+        try:
+            item = json.loads(header.decode('utf8'))
+        except ValueError:
+            yield ItemError('Invalid JSON'), None
+            continue
+        yield item, content
+
+
+def parse_timestamp(value):
+    """ Return datetime from seconds since epoch or ISO 8601 UTC timestamp """
+    if isinstance(value, (int, long, float)):
+        try:
+            return datetime.datetime.utcfromtimestamp(value)
+        except ValueError:
+            raise ItemError('Invalid timestamp')
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            pass
+    raise ItemError('Invalid timestamp')
+
+
+def request_from_item(adaptor, item, content=None):
+    """ Return ``rh.requests.Request`` object for an item of the batch
+
+    If ``content`` is ``None``, content is taken from the item. Otherwise,
+    it is the raw content from the binary envelope.
+    """
+    if not isinstance(item, dict):
+        raise ItemError('Request must be an object')
+    content_format = item.get('format', Request.TEXT)
+    if content_format not in Request.FORMATS:
+        raise ItemError('Invalid content format')
+    encoded = content is None
+    if encoded:
+        content = item.get('content')
+        if not isinstance(content, basestring):
+            raise ItemError('Missing request content')
+    elif content_format == Request.TEXT:
+        try:
+            content = content.decode('utf8')
+        except UnicodeDecodeError:
+            raise ItemError('Text content must be UTF-8-encoded')
+    world = item.get('world')
+    if isinstance(world, basestring):
+        world = WORLDS.get(world, world)
+    return Request(
+        adaptor=adaptor,
+        content=content,
+        timestamp=parse_timestamp(item.get('timestamp')),
+        world=world,
+        content_format=content_format,
+        language=item.get('language'),
+        content_language=item.get('content_language'),
+        topic=item.get('topic'),
+        source_id=item.get('source_id'),
+        encoded=encoded,
+    )
+
+
+class RequestBatch(Route):
+    """ Store a batch of requests posted by a remote adaptor """
+    name = 'rh_api_requests_batch'
+    path = '/rh/api/requests:batch'
+    allow_overrides = False
+
+    readers = {
+        NDJSON: read_ndjson,
+        ENVELOPE: read_envelope,
+    }
+
+    def authenticate(self):
+        api_key = self.request.headers.get('X-API-Key')
+        adaptor = api_key and authenticate(api_key)
+        if not adaptor:
+            self.abort(403, 'Invalid API key')
+        return adaptor
+
+    def read_items(self, adaptor, items, results):
+        """ Read items, and yield ``(request, result)`` pairs for valid ones
+
+        Results of all items are appended to ``results``.
+        """
+        index = 0
+        try:
+            for item, content in items:
+                result = {'index': index}
+                results.append(result)
+                index += 1
+                if index > MAX_ITEMS:
+                    result.update(status='rejected',
+                                  error='Too many requests in batch')
+                    return
+                try:
+                    if isinstance(item, ItemError):
+                        raise item
+                    yield request_from_item(adaptor, item, content), result
+                except ItemError as err:
+                    result.update(status='rejected', error=unicode(err))
+        except BatchFormatError as err:
+            results.append({'index': index, 'status': 'rejected',
+                            'error': unicode(err)})
+
+    def limit_chunk(self, adaptor, chunk):
+        """ Defer requests over the rate limit, and return the rest """
+        requests, backlog, wait = admit(adaptor, [r for r, result in chunk])
+        if not backlog:
+            return chunk
+        defer_backlog(adaptor, backlog, wait)
+        queued = set(id(r) for r in backlog)
+        admitted = []
+        for request, result in chunk:
+            if id(request) in queued:
+                result['status'] = 'queued'
+            else:
+                admitted.append((request, result))
+        return admitted
+
+    def check_chunk(self, chunk):
+        """ Return ``(entity, result)`` pairs of valid requests in chunk """
+        checked = []
+        for request, result in chunk:
+            try:
+                request.check()
+                checked.append((request.prepare(), result))
+            except RequestError as err:
+                result.update(status='rejected', error=unicode(err))
+        return checked
+
+    def persist_chunk(self, chunk):
+        """ Store a chunk of request entities and update their results
+
+        Blobs and revisions of the requests are stored in the same batch, as
+        ``put()`` would store them synchronously, one request at a time.
+        """
+        entities = [e for e, result in chunk]
+        unique, fingerprints = RequestFingerprint.deduplicate(entities)
+        extra = [x for e in unique for x in e.pop_unsaved()]
+        ndb.put_multi(unique + fingerprints + extra)
+        unique = set(id(e) for e in unique)
+        for e, result in chunk:
+            # Duplicates have the key of the stored request
+            status = 'saved' if id(e) in unique else 'duplicate'
+            result.update(status=status, id=e.key.id())
+
+    def POST(self):
+        adaptor = self.authenticate()
+        content_type = self.request.mimetype
+        if content_type not in self.readers:
+            self.abort(415, 'Unsupported batch format')
+        items = self.readers[content_type](self.request.stream)
+        results = []
+        for chunk in chunked(self.read_items(adaptor, items, results),
+                             CHUNK_SIZE):
+            chunk = self.check_chunk(self.limit_chunk(adaptor, chunk))
+            if chunk:
+                self.persist_chunk(chunk)
+        stats = dict((status, 0) for status in ('saved', 'duplicate',
+                                                'rejected', 'queued'))
+        for result in results:
+            stats[result['status']] += 1
+        self.log.info('Batch from %s: %s' % (adaptor.name, stats))
+        stats['results'] = results
+        return Response(json.dumps(stats), 200, mimetype='application/json')
@@ -0,0 +1,152 @@
+""" API key authentication
+
+This module authenticates remote adaptors (see ``rh.db.RemoteAdaptor``) by
+the API key they send with RH API calls. Looking the key up in the datastore
+on every call would be too slow for the push API, so results of lookups are
+cached on two levels:
+
+- in instance memory, in a LRU cache of ``LOCAL_CACHE_SIZE`` entries that
+  expire after ``LOCAL_TTL`` seconds
+- in memcache, which maps keys to adaptor entity keys for ``TTL`` seconds
+
+Keys that do not belong to any adaptor are cached as well (for
+``NEGATIVE_TTL`` seconds), so repeated calls with a bad key do not reach the
+datastore either.
+
+Raw API keys are never used as cache keys or stored in caches. Caches are
+keyed on a prefix of the SHA-256 hexdigest of the key, and entries hold the
+full digest, which is compared to the digest of the presented key in
+constant time.
+
+Storing an adaptor drops the memcache entries of its keys, and instance
+entries on the instance that stored it. Other instances may keep accepting a
+key that was rotated without overlap for up to ``LOCAL_TTL`` seconds.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import time
+import datetime
+import threading
+import collections
+
+from google.appengine.ext import ndb
+from google.appengine.api import memcache
+
+from .db import RemoteAdaptor
+from .keys import hash_api_key, constant_time_compare
+from .locales import LRUCache
+
+__all__ = ('authenticate', 'forget_adaptor', 'get_stats')
+
+CACHE_PREFIX = 'auth:'
+# Number of hexdigest characters used in cache keys
+CACHE_KEY_LENGTH = 32
+TTL = 60 * 60  # 1 hour
+NEGATIVE_TTL = 60  # seconds
+LOCAL_TTL = 60  # seconds
+LOCAL_CACHE_SIZE = 1024
+# Memcache value of keys that do not belong to any adaptor
+NEGATIVE = '-'
+
+# Maps cache keys to ``(expires, entry)`` pairs, where ``entry`` is either
+# ``None`` for bad keys, or ``(digest, adaptor, key_expires)``
+_entries = LRUCache(LOCAL_CACHE_SIZE)
+
+# Statistics for this instance
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+
+
+def count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def cache_key(digest):
+    return digest[:CACHE_KEY_LENGTH]
+
+
+def make_entry(adaptor, digest):
+    """ Return cache entry for adaptor's key with given digest
+
+    ``None`` is returned if the adaptor does not have a valid key with such
+    digest.
+    """
+    for api_key, expires in adaptor.valid_keys:
+        if constant_time_compare(hash_api_key(api_key), digest):
+            return digest, adaptor, expires
+    return None
+
+
+def load_entry(api_key, digest):
+    """ Return cache entry for the key from memcache or datastore """
+    key = CACHE_PREFIX + cache_key(digest)
+    cached = memcache.get(key)
+    if cached == NEGATIVE:
+        count('memcache_hits')
+        return None
+    if cached is not None:
+        # The adaptor entity is cached by NDB
+        adaptor = ndb.Key(urlsafe=cached).get()
+        entry = adaptor and make_entry(adaptor, digest)
+        if entry:
+            count('memcache_hits')
+            return entry
+    count('misses')
+    adaptor = RemoteAdaptor.get_by_api_key(api_key)
+    entry = adaptor and make_entry(adaptor, digest)
+    if entry:
+        memcache.set(key, adaptor.key.urlsafe(), TTL)
+    else:
+        memcache.set(key, NEGATIVE, NEGATIVE_TTL)
+    return entry
+
+
+def authenticate(api_key):
+    """ Return adaptor that has given API key, or ``None``
+
+    Previous keys of adaptors (see ``rh.db.RemoteAdaptor.rotate_key``) are
+    accepted until they expire.
+    """
+    digest = hash_api_key(api_key)
+    key = cache_key(digest)
+    now = time.time()
+    cached = _entries.get(key)
+    if cached is None or cached[0] <= now:
+        entry = load_entry(api_key, digest)
+        _entries.set(key, (now + LOCAL_TTL, entry))
+    else:
+        count('hits')
+        entry = cached[1]
+    if entry is None:
+        return None
+    cached_digest, adaptor, expires = entry
+    # The digest prefix matched, but the rest of the digest may not
+    if not constant_time_compare(cached_digest, digest):
+        return None
+    if expires is not None and expires <= datetime.datetime.utcnow():
+        return None
+    return adaptor
+
+
+def forget_adaptor(adaptor):
+    """ Drop cached authentication of adaptor's keys
+
+    This is called when adaptor is stored, so that changed keys take effect.
+    """
+    api_keys = [adaptor.api_key, adaptor.previous_key,
+                getattr(adaptor, '_retired_key', None)]
+    keys = [cache_key(hash_api_key(k)) for k in api_keys if k]
+    for key in keys:
+        _entries.delete(key)
+    memcache.delete_multi(keys, key_prefix=CACHE_PREFIX)
+
+
+def get_stats():
+    """ Return authentication statistics for this instance """
+    stats = dict(_stats)
+    total = sum(stats.values())
+    stats['hit_rate'] = total and float(stats.get('hits', 0)) / total
+    return stats
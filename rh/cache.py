@@ -0,0 +1,122 @@
+""" Memcache-based caching
+
+This module implements a read-through cache for values that are expensive to
+produce, such as rendered template fragments. Request entities themselves are
+cached by NDB's built-in memcache integration (see ``rh.db.Request``), so
+they are not cached here.
+
+When a cached value is missing, only one request regenerates it. The request
+that manages to ``add()`` a lock key regenerates the value, while others wait
+for the value to appear for a short while, and only regenerate it themselves
+(without caching it) if it does not. This prevents a stampede of requests
+regenerating the same value when a popular key expires.
+
+Fragments of entities are keyed by entity version, so a fragment is
+invalidated as soon as a new version of the entity is stored.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import time
+import threading
+import collections
+
+from flask import g
+from jinja2 import Markup
+from google.appengine.api import memcache
+
+__all__ = ('get_or_set', 'fragment_key', 'cached_fragment', 'get_stats')
+
+CACHE_PREFIX = 'cache:'
+LOCK_SUFFIX = ':lock'
+TTL = 60 * 60  # 1 hour
+LOCK_TTL = 10  # seconds
+LOCK_WAIT = 0.05  # seconds
+LOCK_WAIT_ATTEMPTS = 10
+
+# Statistics for this instance
+_stats = collections.Counter()
+_stats_lock = threading.Lock()
+
+
+def count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def get_or_set(key, generate, ttl=TTL):
+    """ Return cached value, or generate and cache it if missing
+
+    ``generate`` is a callable that returns the value. Generated values must
+    not be ``None``.
+    """
+    key = CACHE_PREFIX + key
+    value = memcache.get(key)
+    if value is not None:
+        count('hits')
+        return value
+    count('misses')
+    lock_key = key + LOCK_SUFFIX
+    if memcache.add(lock_key, 1, LOCK_TTL):
+        try:
+            value = generate()
+            memcache.set(key, value, ttl)
+        finally:
+            memcache.delete(lock_key)
+        return value
+    # Another request is regenerating the value
+    count('waits')
+    for i in range(LOCK_WAIT_ATTEMPTS):
+        time.sleep(LOCK_WAIT)
+        value = memcache.get(key)
+        if value is not None:
+            return value
+    count('wait_timeouts')
+    return generate()
+
+
+def fragment_key(name, entity):
+    """ Return cache key for a fragment of given entity's current version """
+    return 'fragment:%s:%s:%s' % (name, entity.key.urlsafe(), entity.version)
+
+
+def cached_fragment(name, entity, caller):
+    """ Jinja2 helper for caching template fragments
+
+    The fragment is passed as body of a call block::
+
+        {% call cached_fragment('suggestions', req) %}
+        ...
+        {% endcall %}
+
+    Fragments may contain CSRF tokens, which are different for each response,
+    so the token found in a cached fragment is replaced with the current one.
+    """
+    token = getattr(g, 'csrf_token', None)
+
+    def render():
+        return unicode(caller()), token
+
+    html, cached_token = get_or_set(fragment_key(name, entity), render)
+    if token and cached_token and token != cached_token:
+        html = html.replace(cached_token, token)
+    return Markup(html)
+
+
+def get_stats():
+    """ Return cache statistics
+
+    ``fragments`` are statistics of this instance's read-through cache, and
+    ``memcache`` are the global memcache statistics (which also include NDB's
+    entity cache).
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats.get('hits', 0) + stats.get('misses', 0)
+    stats['hit_rate'] = lookups and float(stats.get('hits', 0)) / lookups
+    global_stats = memcache.get_stats() or {}
+    lookups = global_stats.get('hits', 0) + global_stats.get('misses', 0)
+    global_stats['hit_rate'] = lookups and (
+        float(global_stats.get('hits', 0)) / lookups)
+    return {'fragments': stats, 'memcache': global_stats}
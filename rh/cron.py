@@ -0,0 +1,26 @@
+""" Request hub cron jobs
+
+This module implements cron job handlers for harvesting requests.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import json
+
+from flask import Response
+from utils.routes import Route
+
+from .adaptors import HarvestScheduler
+
+
+class HarvestCronJob(Route):
+    """ Harvest requests using all registered adaptors """
+    name = 'rh_harvest_all'
+    path = '/rh/harvests/'
+
+    def GET(self):
+        report = HarvestScheduler(app=self.app).run()
+        for stats in report:
+            self.log.info('Harvest stats: %s' % stats)
+        return Response(json.dumps(report), 200, mimetype='application/json')
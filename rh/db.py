@@ -8,21 +8,44 @@ These models are used to persist data which is used by adaptors and the hub.
 
 from __future__ import unicode_literals, print_function
 
+import hashlib
 import datetime
+import functools
 
 from google.appengine.ext import ndb
 from google.appengine.api import images
+from google.appengine.datastore.datastore_query import Cursor
 from werkzeug.urls import url_quote_plus
-import babel
 
 from .keys import generate_api_key
+from .locales import LRUCache, get_language_name
 from .properties import LanguageProperty
+from .urlnorm import normalize_url
+from .textdiff import make_delta, apply_delta, delta_size
 from .exceptions import DuplicateSuggestionError
 
 ADAPTOR_KEY_PREFIX = 'ra'
-
-__all__ = ('RemoteAdaptor', 'Request', 'RequestConstants', 'Content',
-           'HarvestHistory', 'PlaylistItem', 'Playlist')
+KEY_ROTATION_OVERLAP = datetime.timedelta(days=7)
+# Default number of requests accepted from an adaptor per second, and in a
+# single burst (see ``rh.ratelimit``)
+RATE_LIMIT = 10.0
+RATE_BURST = 500
+REVISION_PAGE_SIZE = 20
+# Every n-th revision stores the full text instead of a delta
+REVISION_SNAPSHOT_INTERVAL = 10
+REVISION_CACHE_SIZE = 256
+# Largest content stored in a ``RequestBlob``, which leaves room for the key
+# and other properties within the 1MB entity size limit
+MAX_BLOB_SIZE = 1000 * 1000
+
+# Reconstructed text of recently used revisions, keyed by request key,
+# request creation time, and revision number
+_revision_texts = LRUCache(REVISION_CACHE_SIZE)
+
+__all__ = ('RemoteAdaptor', 'Request', 'RequestConstants', 'RequestBlob',
+           'RequestFingerprint', 'BacklogRequest', 'Revision',
+           'RevisionHistory', 'Content', 'HarvestHistory', 'PlaylistItem',
+           'Playlist')
 
 
 class RequestConstants(object):
@@ -93,63 +116,225 @@ class RemoteAdaptor(ndb.Model):
     contact = ndb.StringProperty(required=True)
     trusted = ndb.BooleanProperty(default=False, required=True)
     api_key = ndb.StringProperty(required=True)
+    # Key replaced by the last rotation, which remains valid until
+    # ``previous_key_expires``
+    previous_key = ndb.StringProperty()
+    previous_key_expires = ndb.DateTimeProperty(indexed=False)
+    # Request rate limit (see ``rh.ratelimit``)
+    rate = ndb.FloatProperty(default=RATE_LIMIT, indexed=False)
+    burst = ndb.IntegerProperty(default=RATE_BURST, indexed=False)
 
     def renew_key(self):
         self.api_key = generate_api_key('ra')
 
-    def _pre_put_hook(self):
+    def rotate_key(self, overlap=KEY_ROTATION_OVERLAP):
+        """ Replace the API key with a new one
+
+        The replaced key remains valid for ``overlap`` (a ``timedelta``), so
+        that the adaptor can switch to the new key without downtime. Only one
+        previous key is kept, so rotating again ends the overlap of the key
+        replaced by the earlier rotation.
+        """
+        # Remembered so that cached authentication of the key can be dropped
+        self._retired_key = self.api_key
+        if overlap:
+            self.previous_key = self.api_key
+            self.previous_key_expires = datetime.datetime.utcnow() + overlap
+        else:
+            self.previous_key = None
+            self.previous_key_expires = None
         self.renew_key()
 
+    @property
+    def valid_keys(self):
+        """ List of ``(api_key, expires)`` pairs of keys that can be used
+
+        ``expires`` is ``None`` for the current key.
+        """
+        keys = [(self.api_key, None)]
+        if self.previous_key and (
+                self.previous_key_expires > datetime.datetime.utcnow()):
+            keys.append((self.previous_key, self.previous_key_expires))
+        return keys
+
+    @classmethod
+    def get_by_api_key(cls, api_key):
+        """ Return adaptor that has given current or previous key, or ``None``
+
+        This method always queries the datastore. Use ``rh.auth.authenticate``
+        to authenticate requests.
+        """
+        return cls.query(ndb.OR(cls.api_key == api_key,
+                                cls.previous_key == api_key)).get()
+
+    def _pre_put_hook(self):
+        if not self.api_key:
+            self.renew_key()
+
+    def _post_put_hook(self, future):
+        # Imported here because ``rh.auth`` depends on this module
+        from .auth import forget_adaptor
+        forget_adaptor(self)
+
 
 class LocaleMixin(object):
     """ Mixin that provides shortcuts for showing language names """
 
     @property
     def content_language_name(self):
-        try:
-            return babel.Locale(self.content_language).get_language_name()
-        except babel.UnknownLocaleError:
-            return None
+        return get_language_name(self.content_language)
 
     @property
     def language_name(self):
-        try:
-            return babel.Locale(self.language).get_langauge_name()
-        except babel.UnknownLocaleError:
-            return None
+        return get_language_name(self.language)
 
 
 class Revision(LocaleMixin, ndb.Model):
-    """ Model used for repeated structured property in Request model
+    """ Model to persist request revisions
+
+    Revisions are stored as child entities of the request, keyed by revision
+    number (starting at 1, since 0 is not a valid id), so that the request
+    entity does not grow with each edit. The current revision is also stored
+    on the request itself.
 
-    This model persists the data related to revisions.
+    To save space, the text of a stored revision is usually kept as a
+    ``delta`` against the text of the previous revision (see
+    ``rh.textdiff``), and ``text_content`` is empty. Every
+    ``REVISION_SNAPSHOT_INTERVAL``-th revision stores the full text, so at
+    most that many revisions are needed to reconstruct any text. Revisions
+    returned by ``Request`` methods always have the full text.
 
     """
 
     timestamp = ndb.DateTimeProperty()
     text_content = ndb.TextProperty()
+    delta = ndb.JsonProperty()
     content_language = LanguageProperty()
     language = LanguageProperty()
     topic = ndb.StringProperty(choices=RequestConstants.TOPICS)
 
+    @staticmethod
+    def key_for(request_key, number):
+        """ Return key of revision ``number`` of given request """
+        return ndb.Key(Revision, number + 1, parent=request_key)
+
+
+class RevisionHistory(object):
+    """ Lazily loaded sequence of request revisions
+
+    Revisions are loaded in pages of ``page_size`` revisions as they are
+    accessed, so iterating over a long history takes a few datastore
+    round-trips, and indexing a single revision loads only its page.
+    """
+
+    def __init__(self, request, count, page_size=None):
+        self.request = request
+        self.count = count
+        self.page_size = page_size or REVISION_PAGE_SIZE
+        self.pages = {}
+
+    def __len__(self):
+        return self.count
+
+    def get_page(self, page):
+        if page not in self.pages:
+            start = page * self.page_size
+            stop = min(start + self.page_size, self.count)
+            self.pages[page] = self.request.get_revs(start, stop)
+        return self.pages[page]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('revision index out of range')
+        page, offset = divmod(index, self.page_size)
+        return self.get_page(page)[offset]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+
+class RequestBlob(ndb.Model):
+    """ Model for persisting binary request content (images)
+
+    Binary content is kept out of the request entity so that it is only loaded
+    when it is actually needed (e.g., when the image is rendered). Blobs are
+    keyed by SHA-1 hexdigest of their content, so identical payloads are only
+    stored once, and the key doubles as an ETag.
+
+    Like any other entity, a blob cannot be larger than 1MB, so content is
+    limited to ``MAX_BLOB_SIZE`` bytes.
+    """
+
+    content = ndb.BlobProperty(required=True)
+    content_format = ndb.StringProperty(indexed=False)
+    size = ndb.IntegerProperty(indexed=False)
+
+    @property
+    def etag(self):
+        return self.key.id()
+
+    @classmethod
+    def from_content(cls, content, content_format):
+        """ Return an unsaved blob entity for given content """
+        return cls(id=hashlib.sha1(content).hexdigest(),
+                   content=content,
+                   content_format=content_format,
+                   size=len(content))
+
 
 class Content(ndb.Model):
-    """ Model to persist content suggestions """
+    """ Model to persist content suggestions
+
+    New suggestions are accepted in ``PENDING`` status, and their URLs are
+    checked in the background (see ``cds.urlcheck``). Suggestions made before
+    URLs were checked in the background have no status.
+    """
+
+    # Reachability status
+    PENDING = 'pending_check'
+    REACHABLE = 'reachable'
+    UNREACHABLE = 'unreachable'
+    STATUSES = [PENDING, REACHABLE, UNREACHABLE]
 
     url = ndb.StringProperty()
     submitted = ndb.DateTimeProperty()
     votes = ndb.IntegerProperty()
+    status = ndb.StringProperty(choices=STATUSES)
+    checked = ndb.DateTimeProperty()
+
+    @property
+    def is_unreachable(self):
+        return self.status == self.UNREACHABLE
 
     @property
     def quoted_url(self):
         return url_quote_plus(self.url)
 
 
+def suggestion_order(content):
+    """ Sort key for content suggestions (most votes first, then oldest) """
+    return -(content.votes or 0), content.submitted or datetime.datetime.min
+
+
 class Request(LocaleMixin, RequestConstants, ndb.Model):
-    """ Model for persisting requests """
+    """ Model for persisting requests
+
+    Request entities are cached in memcache by NDB when they are fetched by
+    key, and the cached entity is replaced on ``put()``. Each ``put()`` also
+    increments ``version``, which is used to key cached template fragments
+    (see ``rh.cache``).
+    """
 
     DuplicateSuggestionError = DuplicateSuggestionError
 
+    _use_memcache = True
+    _memcache_timeout = 60 * 60  # 1 hour
+
     # Adaptor information
     adaptor_name = ndb.StringProperty(required=True)
     adaptor_source = ndb.StringProperty(required=True)
@@ -160,9 +345,21 @@ class Request(LocaleMixin, RequestConstants, ndb.Model):
                                        choices=RequestConstants.TYPES)
     content_format = ndb.StringProperty(required=True,
                                         choices=RequestConstants.FORMATS)
+    blob = ndb.KeyProperty(kind=RequestBlob)
+    # Smaller sizes of the image (see ``rh.imaging``), which may be the same
+    # blob as the image itself
+    preview = ndb.KeyProperty(kind=RequestBlob, indexed=False)
+    thumbnail = ndb.KeyProperty(kind=RequestBlob, indexed=False)
+    # Legacy storage for binary content (moved to RequestBlob by migration 005)
     binary_content = ndb.BlobProperty(indexed=False, compressed=True)
 
-    # Computed content properties (derived from revision)
+    # Identifier of the request at its source (e.g., Facebook post id)
+    source_id = ndb.StringProperty(indexed=False)
+
+    # Normalized content fingerprint (see ``RequestFingerprint``)
+    fingerprint = ndb.StringProperty(indexed=False)
+
+    # Computed content properties (derived from current revision)
     text_content = ndb.ComputedProperty(lambda s: s._rev_field('text_content'))
     content_language = ndb.ComputedProperty(
         lambda s: s._rev_field('content_language'))
@@ -181,29 +378,144 @@ class Request(LocaleMixin, RequestConstants, ndb.Model):
     recorded = ndb.DateTimeProperty(required=True, auto_now_add=True)
 
     # Workflow
+    # Whether the request has a suggestion that is not unreachable (updated
+    # on put, and used by content pool)
     has_suggestions = ndb.BooleanProperty(default=False)
     broadcast = ndb.BooleanProperty(default=False)
     current_revision = ndb.IntegerProperty()
+    revision = ndb.LocalStructuredProperty(Revision)
+    revision_count = ndb.IntegerProperty(default=0, indexed=False)
+    # Legacy storage for revisions (moved to Revision entities by migration
+    # 007)
     revisions = ndb.StructuredProperty(Revision, repeated=True)
 
     # Content suggestions
     content_suggestions = ndb.StructuredProperty(Content, repeated=True)
+    # Legacy storage for ids of applied vote events (replaced by
+    # ``rh.votes.AppliedVote`` entities, and cleared when votes are applied)
+    applied_votes = ndb.StringProperty(repeated=True, indexed=False)
+
+    # Top suggestion (derived from content suggestions, used by content pool)
+    top_url = ndb.ComputedProperty(lambda s: s._top_field('url'))
+    top_votes = ndb.ComputedProperty(lambda s: s._top_field('votes'))
+
+    # Incremented on each put
+    version = ndb.IntegerProperty(default=0, indexed=False)
+
+    def _rev_field(self, field_name):
+        return getattr(self.content, field_name, None)
+
+    def _prepare_for_put(self):
+        # Suggestions are normally kept in order by the methods that modify
+        # them, so this only takes linear time. Sorting must happen before
+        # computed properties (``top_url`` and ``top_votes``) are stored.
+        self.content_suggestions.sort(key=suggestion_order)
+        # Suggestions may have been modified directly, so memos are rebuilt
+        self._top_memo = None
+        self._url_index = None
+        # Requests whose suggestions are all unreachable have no top
+        # suggestion, and are kept out of the content pool
+        self.has_suggestions = self.top_suggestion is not None
+        super(Request, self)._prepare_for_put()
 
-    def _rev_field(self, field_name, rev=None):
-        try:
-            rev = self.revisions[rev or self.current_revision or 0]
-        except IndexError:
+    def _pre_put_hook(self):
+        self.version = (self.version or 0) + 1
+        unsaved = self.pop_unsaved()
+        if unsaved:
+            ndb.put_multi(unsaved)
+
+    def pop_unsaved(self):
+        """ Return blob and revision entities that are saved with the request
+
+        The entities are no longer saved by ``put()``, so the caller must
+        store them, e.g., in the same batch as the request. A request without
+        a key is assigned one, since revisions are keyed by the request key.
+        """
+        unsaved = getattr(self, '_unsaved_blobs', None) or []
+        revisions = getattr(self, '_unsaved_revisions', None)
+        if revisions:
+            if self.key is None or self.key.id() is None:
+                first, _ = Request.allocate_ids(size=1)
+                self.key = ndb.Key(Request, first)
+            unsaved.extend(self._encode_revisions(revisions))
+        self._unsaved_blobs = []
+        self._unsaved_revisions = {}
+        return unsaved
+
+    def set_binary_content(self, content, content_format=None):
+        """ Store binary content in a separate blob entity
+
+        The blob entity is saved along with the request. ``content_format``
+        defaults to the request content format.
+        """
+        blob = RequestBlob.from_content(content,
+                                        content_format or self.content_format)
+        self.blob = blob.key
+        self.preview = None
+        self.thumbnail = None
+        self._unsaved_blobs = [blob]
+
+    def set_derivative(self, name, content, content_format):
+        """ Store a smaller size of the image (``preview`` or ``thumbnail``)
+
+        Like the image itself, the derivative is saved along with the request.
+        """
+        blob = RequestBlob.from_content(content, content_format)
+        setattr(self, name, blob.key)
+        unsaved = getattr(self, '_unsaved_blobs', None) or []
+        if blob.key not in [b.key for b in unsaved]:
+            unsaved.append(blob)
+        self._unsaved_blobs = unsaved
+
+    def get_binary_content(self):
+        """ Return binary content, loading it from the blob entity """
+        if self.blob is None:
+            return self.binary_content
+        blob = self.blob.get()
+        return blob and blob.content
+
+    def _top_field(self, field_name):
+        top = self.top_suggestion
+        if top is None:
             return None
-        return getattr(rev, field_name)
+        return getattr(top, field_name)
+
+    def _add_revision(self, number, rev):
+        """ Add a revision entity that is saved along with the request """
+        if getattr(self, '_unsaved_revisions', None) is None:
+            self._unsaved_revisions = {}
+        self._unsaved_revisions[number] = rev
+
+    def move_revisions(self):
+        """ Move revisions from legacy ``revisions`` property to entities
+
+        The revision entities are saved along with the request.
+        """
+        for number, rev in enumerate(self.revisions):
+            self._add_revision(number, Revision(**rev.to_dict()))
+        self.revision_count = len(self.revisions)
+        if self.revisions:
+            self.revision = self._unsaved_revisions[self.current_revision or 0]
+        self.revisions = []
 
     def set_content(self, text_content=None, content_language=None,
                     language=None, topic=None):
-        """ Save an edit into revisions """
+        """ Save an edit into revisions
+
+        The new revision becomes the current revision. It is stored as a
+        separate entity when the request is saved. Revisions are numbered
+        after the stored revisions, so concurrent edits must load and save
+        the request in a transaction (revisions are in the request's entity
+        group).
+        """
 
         if not any([text_content, content_language, language, topic]):
             # Nothing to do
             return
 
+        if self.revisions:
+            self.move_revisions()
+
         rev = Revision(
             timestamp=datetime.datetime.utcnow(),
             text_content=text_content or self.text_content,
@@ -211,54 +523,262 @@ class Request(LocaleMixin, RequestConstants, ndb.Model):
             language=language or self.language,
             topic=topic or self.topic
         )
-        self.revisions.append(rev)
-        if self.current_revision is None:
-            self.current_revision = 0
-        else:
-            self.current_revision = len(self.revisions) - 1
+        number = self.revision_count or 0
+        self._add_revision(number, rev)
+        self.revision_count = number + 1
+        self.revision = rev
+        self.current_revision = number
+
+    def _get_url_index(self):
+        """ Return mapping of normalized URLs to content suggestions
+
+        The index is built on first use, and kept up to date by the methods
+        that modify suggestions.
+        """
+        index = getattr(self, '_url_index', None)
+        if index is None:
+            index = self._url_index = dict(
+                (normalize_url(c.url), c) for c in self.content_suggestions)
+        return index
+
+    def get_suggestion(self, url):
+        """ Return content suggestion matching the URL or ``None``
+
+        URLs are compared in normalized form (see ``rh.urlnorm``), so the
+        suggestion's URL may differ from ``url``.
+        """
+        return self._get_url_index().get(normalize_url(url))
 
     def suggest_url(self, url):
-        """ Add url to content suggestions """
-        if url in [c.url for c in self.content_suggestions]:
+        """ Add url to content suggestions
+
+        ``DuplicateSuggestionError`` is raised if a suggestion with the same
+        normalized URL exists.
+        """
+        index = self._get_url_index()
+        normalized = normalize_url(url)
+        if normalized in index:
             raise DuplicateSuggestionError('%s has already been '
                                            'suggested' % url)
-        c = Content(url=url, submitted=datetime.datetime.utcnow(), votes=0)
+        c = Content(url=url, submitted=datetime.datetime.utcnow(), votes=0,
+                    status=Content.PENDING)
+        # A new suggestion has no votes and is the newest one, so appending it
+        # keeps the suggestions in order
         self.content_suggestions.append(c)
+        index[normalized] = c
         self.has_suggestions = True
+        self._top_memo = None
+        return c
+
+    def _reorder_suggestion(self, c):
+        """ Move suggestion ``c`` into place after its votes changed
+
+        Suggestions are bubbled up or down, so this only takes time
+        proportional to the distance the suggestion is moved.
+        """
+        items = self.content_suggestions
+        key = suggestion_order
+        i = next(i for i, item in enumerate(items) if item is c)
+        while i > 0 and key(items[i - 1]) > key(items[i]):
+            items[i - 1], items[i] = items[i], items[i - 1]
+            i -= 1
+        while i < len(items) - 1 and key(items[i + 1]) < key(items[i]):
+            items[i + 1], items[i] = items[i], items[i + 1]
+            i += 1
+        self._top_memo = None
+
+    def set_votes(self, url, votes):
+        """ Set the number of votes of a content suggestion
+
+        Returns ``False`` if there is no suggestion with given URL.
+        """
+        c = self.get_suggestion(url)
+        if c is None:
+            return False
+        c.votes = votes
+        self._reorder_suggestion(c)
+        return True
+
+    def add_votes(self, url, votes=1):
+        """ Add votes to a content suggestion
+
+        Returns ``False`` if there is no suggestion with given URL.
+        """
+        c = self.get_suggestion(url)
+        if c is None:
+            return False
+        c.votes = (c.votes or 0) + votes
+        self._reorder_suggestion(c)
+        return True
+
+    def set_suggestion_status(self, url, status):
+        """ Set reachability status of a content suggestion
+
+        Returns ``False`` if there is no suggestion with given URL.
+        """
+        c = self.get_suggestion(url)
+        if c is None:
+            return False
+        c.status = status
+        c.checked = datetime.datetime.utcnow()
+        self._top_memo = None
+        return True
 
     @property
     def top_suggestion(self):
-        """ Return the highest-voted content suggestion """
-        # FIXME: memoize this
-        ordered = sorted(self.content_suggestions, key=lambda c: c.votes,
-                         reverse=True)
-        try:
-            return ordered[0]
-        except IndexError:
-            return None
+        """ Return the highest-voted content suggestion
+
+        Suggestions whose URLs are unreachable are not considered. The top
+        suggestion is memoized (wrapped in a tuple, since it may be ``None``)
+        until suggestions are modified.
+        """
+        memo = getattr(self, '_top_memo', None)
+        if memo is None:
+            memo = self._top_memo = (next(
+                (c for c in self.content_suggestions if not c.is_unreachable),
+                None),)
+        return memo[0]
 
     @property
     def sorted_suggestions(self):
-        return sorted(self.content_suggestions, key=lambda c: c.votes,
-                      reverse=True)
+        """ Return content suggestions ordered by votes
+
+        Suggestions are kept in this order, so they don't need to be sorted.
+        """
+        return self.content_suggestions
 
     @property
     def content(self):
-        try:
-            return self.revisions[self.current_revision]
-        except IndexError:
-            return None
+        """ Return the current revision """
+        if self.revisions:
+            try:
+                return self.revisions[self.current_revision or 0]
+            except IndexError:
+                return None
+        return self.revision
 
     @property
     def active_revisions(self):
-        return self.revisions[0:self.current_revision + 1]
+        """ Return revisions up to current as lazily loaded sequence """
+        if self.current_revision is None:
+            return []
+        return RevisionHistory(self, self.current_revision + 1)
+
+    def _revision_cache_key(self, number):
+        return self.key, self.recorded, number
+
+    def _encode_revisions(self, revisions):
+        """ Return entities to store for given unsaved revisions
+
+        Revisions are delta-encoded against the previous revision, unless
+        they are snapshots, or the delta is not smaller than the text. In a
+        transaction, their text is only cached once it commits, as a retried
+        transaction may store them under different numbers.
+        """
+        ctx = ndb.get_context()
+        entities = []
+        for number in sorted(revisions):
+            rev = revisions[number]
+            text = rev.text_content
+            entity = Revision(key=Revision.key_for(self.key, number),
+                              **rev.to_dict())
+            if number % REVISION_SNAPSHOT_INTERVAL and text is not None:
+                prev = revisions.get(number - 1) or self.get_rev(number - 1)
+                if prev is not None and prev.text_content is not None:
+                    delta = make_delta(prev.text_content, text)
+                    if delta_size(delta) < len(text):
+                        entity.text_content = None
+                        entity.delta = delta
+            entities.append(entity)
+            ctx.call_on_commit(functools.partial(
+                _revision_texts.set, self._revision_cache_key(number), text))
+        return entities
+
+    def _load_revisions(self, numbers, known):
+        """ Load revisions and reconstruct their text
+
+        ``known`` maps revision numbers to revisions that are in memory.
+        Besides the requested revisions, the revisions needed to reconstruct
+        their text are loaded, unless their text is found in ``known`` or
+        in the cache. Returns a dict that maps revision numbers to revisions.
+        """
+        def cached_text(number):
+            if number in known:
+                return known[number].text_content
+            return _revision_texts.get(self._revision_cache_key(number))
+
+        keys = [Revision.key_for(self.key, n) for n in numbers]
+        entities = dict(zip(numbers, ndb.get_multi(keys)))
+        bases = set()
+        for number, entity in entities.items():
+            if entity is None or entity.delta is None:
+                continue
+            base = number - 1
+            while (base not in entities and base not in bases and
+                   cached_text(base) is None):
+                bases.add(base)
+                if base % REVISION_SNAPSHOT_INTERVAL == 0:
+                    break
+                base -= 1
+        if bases:
+            bases = sorted(bases)
+            keys = [Revision.key_for(self.key, n) for n in bases]
+            entities.update(zip(bases, ndb.get_multi(keys)))
+
+        revisions = {}
+        for number in sorted(entities):
+            entity = entities[number]
+            if entity is None:
+                continue
+            # Entities may be shared through NDB's cache, so they are copied
+            rev = Revision(key=entity.key, **entity.to_dict())
+            if rev.delta is not None:
+                if number - 1 in revisions:
+                    base = revisions[number - 1].text_content
+                else:
+                    base = cached_text(number - 1)
+                rev.text_content = apply_delta(base, rev.delta)
+                rev.delta = None
+                _revision_texts.set(self._revision_cache_key(number),
+                                    rev.text_content)
+            revisions[number] = rev
+        return dict((n, revisions.get(n)) for n in numbers)
+
+    def get_revs(self, start, stop):
+        """ Return revisions from ``start`` up to (excluding) ``stop``
+
+        Revisions that are not in memory are loaded using a single batch get,
+        plus another one if revisions needed to reconstruct their text are
+        not cached.
+        """
+        if self.revisions:
+            return self.revisions[start:stop]
+        numbers = range(start, min(stop, self.revision_count or 0))
+        known = dict(getattr(self, '_unsaved_revisions', None) or {})
+        if self.current_revision is not None:
+            known[self.current_revision] = self.revision
+        missing = [n for n in numbers if n not in known]
+        if missing and self.key is not None and self.key.id() is not None:
+            known.update(self._load_revisions(missing, known))
+        return [known.get(n) for n in numbers]
 
     def get_rev(self, rev):
-        return self.revisions[rev]
+        """ Return revision number ``rev`` """
+        count = len(self.revisions) or self.revision_count or 0
+        if not 0 <= rev < count:
+            raise IndexError('revision index out of range')
+        return self.get_revs(rev, rev + 1)[0]
+
+    def set_revision(self, rev):
+        """ Make revision number ``rev`` the current revision """
+        if self.revisions:
+            self.move_revisions()
+        self.revision = self.get_rev(rev)
+        self.current_revision = rev
 
     def revert(self):
         """ Reverts to previous revision """
-        self.current_revision = max(0, self.current_revision - 1)
+        self.set_revision(max(0, self.current_revision - 1))
 
     @classmethod
     def fetch_cds_requests(cls):
@@ -276,22 +796,184 @@ class Request(LocaleMixin, RequestConstants, ndb.Model):
         ).order(-cls.posted).fetch()
 
     @classmethod
-    def fetch_content_pool(cls):
-        """ Fetches all top-voted content from unbroadcast requests """
-        # FIXME: Avoid calling top_suggestion twice
-        requests_with_content = []
-        for r in cls.fetch_cds_requests():
-            t = r.top_suggestion
-            if t:
-                requests_with_content.append(r)
-        return sorted(requests_with_content,
-                      key=lambda s: s.top_suggestion.votes, reverse=True)
+    def fetch_cds_page(cls, cursor=None, per_page=20):
+        """ Fetches a single page of requests for display in CDS
+
+        This is a paged version of ``fetch_cds_requests()``. It uses a
+        projection query, so only the properties needed by the request listing
+        are loaded, and image payloads and revision history are never
+        deserialized. Image requests are then loaded in full using a single
+        ``get_multi()`` call, since their thumbnails are shown in the listing,
+        and ``thumbnail`` cannot be projected.
+
+        The ``cursor`` argument is a websafe cursor string as returned by a
+        previous call to this method, or ``None`` for the first page.
+
+        Returns a tuple of result list, next page cursor and previous page
+        cursor. The next page cursor is ``None`` if there are no more pages.
+        The previous page cursor is ``None`` when on the first page, and an
+        empty string if the previous page is the first page.
+        """
+
+        projection = [cls.posted, cls.adaptor_source, cls.content_type,
+                      cls.text_content]
+        q = cls.query(cls.broadcast == False)
+        cursor = cursor and Cursor(urlsafe=cursor) or None
+
+        results, next_cursor, more = q.order(-cls.posted).fetch_page(
+            per_page, start_cursor=cursor, projection=projection)
+        next_cursor = more and next_cursor and next_cursor.urlsafe() or None
+        images = [r.key for r in results
+                  if r.content_type == cls.NONTRANSCRIBED]
+        if images:
+            loaded = dict((r.key, r) for r in ndb.get_multi(images)
+                          if r is not None)
+            results = [loaded.get(r.key, r) for r in results]
+
+        if not cursor:
+            return results, next_cursor, None
+
+        # Walk backwards from the current position to find previous page
+        prev, prev_cursor, more = q.order(cls.posted).fetch_page(
+            per_page, start_cursor=cursor.reversed(), projection=projection)
+        if not prev:
+            return results, next_cursor, None
+        if not more:
+            return results, next_cursor, ''
+        return results, next_cursor, prev_cursor.reversed().urlsafe()
+
+    @classmethod
+    def fetch_content_pool(cls, limit=100):
+        """ Fetches top-voted content from unbroadcast requests
+
+        The pool is ordered by the datastore using the denormalized
+        ``top_votes`` property, and only ``top_url`` and ``top_votes`` are
+        loaded for each request. Requests whose suggestions are all
+        unreachable are not included. A maximum of ``limit`` requests is returned.
+        """
+
+        return cls.query(
+            cls.broadcast == False,
+            cls.has_suggestions == True
+        ).order(-cls.top_votes).fetch(
+            limit, projection=[cls.top_url, cls.top_votes])
+
+
+class RequestFingerprint(ndb.Model):
+    """ Model to index requests by content fingerprint
+
+    Fingerprint entities are keyed by the fingerprint of the request content
+    (see ``rh.requests.Request.fingerprint_content()``), and point to the
+    first request that was stored with that content. Duplicates of a stored
+    request are therefore found using a single key lookup. Instead of being
+    stored again, a duplicate is linked to the original by incrementing the
+    fingerprint's ``duplicates`` count and adding its adaptor to ``sources``.
+    """
+
+    request = ndb.KeyProperty(kind='Request', required=True, indexed=False)
+    duplicates = ndb.IntegerProperty(default=0, indexed=False)
+    sources = ndb.StringProperty(repeated=True, indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+    @classmethod
+    def deduplicate(cls, requests):
+        """ Separate new request entities from duplicates
+
+        Requests that already have a key (e.g., a re-harvested item with a
+        deterministic key) are looked up using a single ``get_multi()`` call,
+        and requests that are already stored are duplicates, so that storing
+        them again does not overwrite edits made since. Fingerprints of the
+        remaining requests are looked up using another ``get_multi()`` call.
+        Requests without a fingerprint, and requests whose fingerprint was not
+        seen before are unique. Request entities that have no key are
+        assigned one, so that new fingerprints can point to them.
+
+        Duplicates are not stored, so their key is set to the key of the
+        stored request they duplicate.
+
+        Returns a tuple of unique requests and fingerprint entities (new and
+        updated ones) that must be stored along with them.
+        """
+
+        keyed = set(r.key for r in requests
+                    if r.key is not None and r.key.id() is not None)
+        stored = set(r.key for r in ndb.get_multi(keyed) if r is not None)
+
+        fingerprinted = [r for r in requests if r.fingerprint]
+        unkeyed = [r for r in fingerprinted if r.key is None]
+        if unkeyed:
+            first, _ = Request.allocate_ids(size=len(unkeyed))
+            for i, r in enumerate(unkeyed):
+                r.key = ndb.Key(Request, first + i)
+
+        keys = set(ndb.Key(cls, r.fingerprint) for r in fingerprinted
+                   if r.key not in stored)
+        found = dict((f.key.id(), f) for f in ndb.get_multi(keys)
+                     if f is not None)
+
+        unique = []
+        changed = {}
+        for r in requests:
+            if r.key in stored:
+                continue
+            if r.key is not None and r.key.id() is not None:
+                # Requests with the same key later in the batch are duplicates
+                stored.add(r.key)
+            if not r.fingerprint:
+                unique.append(r)
+                continue
+            f = found.get(r.fingerprint)
+            if f is None:
+                f = cls(id=r.fingerprint, request=r.key,
+                        sources=[r.adaptor_name])
+                found[r.fingerprint] = changed[r.fingerprint] = f
+            elif f.request != r.key:
+                f.duplicates += 1
+                if r.adaptor_name not in f.sources:
+                    f.sources.append(r.adaptor_name)
+                changed[r.fingerprint] = f
+                r.key = f.request
+                continue
+            unique.append(r)
+        return unique, list(changed.values())
+
+
+class BacklogRequest(ndb.Model):
+    """ Model to persist a request over the rate limit until it is stored
+
+    Backlog requests hold the unchecked request data (see
+    ``rh.ratelimit.defer_backlog()``), and are deleted once the request is
+    stored. Text content is stored UTF-8-encoded.
+    """
+
+    adaptor_name = ndb.StringProperty(indexed=False)
+    adaptor_source = ndb.StringProperty(indexed=False)
+    adaptor_trusted = ndb.BooleanProperty(indexed=False)
+    content = ndb.BlobProperty(compressed=True)
+    encoded = ndb.BooleanProperty(indexed=False)
+    posted = ndb.DateTimeProperty(indexed=False)
+    world = ndb.IntegerProperty(indexed=False)
+    content_format = ndb.StringProperty(indexed=False)
+    language = ndb.StringProperty(indexed=False)
+    content_language = ndb.StringProperty(indexed=False)
+    topic = ndb.StringProperty(indexed=False)
+    source_id = ndb.StringProperty(indexed=False)
+    sender = ndb.StringProperty(indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
 
 
 class HarvestHistory(ndb.Model):
-    """ Model to persist cron-based harvesting history """
+    """ Model to persist cron-based harvesting history
+
+    Besides the time of last completed harvest, the model stores the
+    high-water mark of harvested requests: the newest posting time among the
+    stored requests (source time, not the time of harvest), and source ids of
+    requests posted at exactly that time.
+    """
 
     timestamp = ndb.DateTimeProperty(auto_now=True)
+    high_water = ndb.DateTimeProperty(indexed=False)
+    boundary_ids = ndb.StringProperty(repeated=True, indexed=False)
 
     @classmethod
     def get_timestamp(cls, adaptor):
@@ -300,11 +982,17 @@ class HarvestHistory(ndb.Model):
         if not h:
             # If there's no timestamp, return the beginning of UNIX epoch
             return datetime.datetime.utcfromtimestamp(0)
-        return h.timestamp
+        return h.high_water or h.timestamp
+
+    @classmethod
+    def get_history(cls, adaptor):
+        """ Return history entity for an adaptor (saved or not) """
+        k = cls.get_key(adaptor)
+        return k.get() or cls(key=k)
 
     @classmethod
     def record(cls, adaptor):
-        h = cls(id=adaptor.name)
+        h = cls.get_history(adaptor)
         h.put()
         return h
 
@@ -0,0 +1,154 @@
+""" Image derivatives
+
+This module implements the ingest stage for image requests. Images are
+often posted as multi-megabyte phone photos, and showing them as they are
+would ship the full image to users on slow connections. The stage derives
+three sizes from each posted image:
+
+- ``master``: the stored image, capped at ``MASTER_SIZE`` pixels and
+  recompressed, which replaces the posted image if it is smaller, and is
+  resized further if it does not fit in a blob (``rh.db.MAX_BLOB_SIZE``)
+- ``preview``: image shown on request pages (``PREVIEW_SIZE`` pixels)
+- ``thumbnail``: image shown in lists (``THUMBNAIL_SIZE`` pixels)
+
+Sizes are maximum dimensions, and the aspect ratio is kept. Images are never
+enlarged, so a derivative of a small image may be the master itself.
+Derivatives are stored as ``rh.db.RequestBlob`` entities alongside the
+master, and are served like any other blob (see ``cds.webui.WebUIImage``).
+
+Images are resized using the GAE Images API, or PIL if the API is not
+available (e.g., in tools that run outside the App Engine). If neither is
+available, or the image cannot be resized, only the posted image is stored.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import logging
+import StringIO
+
+from google.appengine.api import images
+from google.appengine.runtime import apiproxy_errors
+
+from .db import RequestConstants, MAX_BLOB_SIZE
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+__all__ = ('ImagingError', 'derive_images', 'resize')
+
+MASTER_SIZE = 1600
+PREVIEW_SIZE = 640
+THUMBNAIL_SIZE = 160
+# Masters that do not fit in a blob are resized by this factor until they do,
+# but not below ``PREVIEW_SIZE``
+MASTER_STEP = 0.75
+
+# Derivatives as ``(name, size, JPEG quality)``, largest first
+DERIVATIVES = (
+    ('master', MASTER_SIZE, 85),
+    ('preview', PREVIEW_SIZE, 75),
+    ('thumbnail', THUMBNAIL_SIZE, 70),
+)
+
+JPG = RequestConstants.JPG
+PNG = RequestConstants.PNG
+
+# Derivatives of JPEG images are JPEG images, and PNG images otherwise (the
+# Images API cannot write GIF images)
+OUTPUT_FORMATS = {
+    images.JPEG: (JPG, images.JPEG, 'JPEG'),
+    images.PNG: (PNG, images.PNG, 'PNG'),
+}
+
+
+class ImagingError(Exception):
+    """ Raised when image cannot be resized """
+    pass
+
+
+def resize_pil(data, size, output, quality):
+    """ Resize image using PIL """
+    if PILImage is None:
+        raise ImagingError('Neither Images API nor PIL is available')
+    try:
+        img = PILImage.open(StringIO.StringIO(data))
+        img.thumbnail((size, size), PILImage.ANTIALIAS)
+        if output == 'JPEG' and img.mode != 'RGB':
+            img = img.convert('RGB')
+        buf = StringIO.StringIO()
+        img.save(buf, output, quality=quality, optimize=True)
+    except (IOError, ValueError) as err:
+        raise ImagingError('Cannot resize image: %s' % err)
+    return buf.getvalue()
+
+
+def resize(data, size, output_format, quality):
+    """ Return image data resized to fit within ``size`` pixels
+
+    ``output_format`` is one of the keys of ``OUTPUT_FORMATS``.
+    """
+    mimetype, encoding, pil_format = OUTPUT_FORMATS[output_format]
+    try:
+        return images.resize(data, size, size, output_encoding=encoding,
+                             quality=quality)
+    except images.Error as err:
+        raise ImagingError('Cannot resize image: %s' % err)
+    except (AssertionError, apiproxy_errors.Error):
+        # Images API is not available
+        return resize_pil(data, size, pil_format, quality)
+
+
+def fit_master(data, master, size, output_format, quality):
+    """ Return master that fits in a blob
+
+    ``master`` is a ``(data, content_format)`` pair of the master resized to
+    ``size`` pixels from ``data``. ``ImagingError`` is raised if the master
+    does not fit even at ``PREVIEW_SIZE`` pixels.
+    """
+    output_content_format = OUTPUT_FORMATS[output_format][0]
+    while len(master[0]) > MAX_BLOB_SIZE:
+        size = int(size * MASTER_STEP)
+        if size < PREVIEW_SIZE:
+            raise ImagingError('Image is too large to store')
+        master = (resize(data, size, output_format, quality),
+                  output_content_format)
+    return master
+
+
+def derive_images(data, content_format):
+    """ Return derivatives of image data
+
+    ``content_format`` is the request content format of the image. Returns a
+    dict that maps derivative names to ``(data, content_format)`` pairs, or
+    an empty dict if the image cannot be resized, or its master does not fit
+    in a blob.
+    """
+    output_format = images.JPEG if content_format == JPG else images.PNG
+    output_content_format = OUTPUT_FORMATS[output_format][0]
+    derivatives = {}
+    source = data, content_format
+    try:
+        img = images.Image(image_data=data)
+        largest = max(img.width, img.height)
+        for name, size, quality in DERIVATIVES:
+            if largest <= size and name != 'master':
+                derivatives[name] = derivatives['master']
+                continue
+            # The Images API may enlarge images, so images within the size
+            # are resized to their own size, which only recompresses them,
+            # and they are only replaced if that makes them smaller
+            derived = resize(source[0], min(size, largest), output_format,
+                             quality)
+            if largest > size or len(derived) < len(data):
+                source = derived, output_content_format
+            if name == 'master':
+                source = fit_master(data, source, min(size, largest),
+                                    output_format, quality)
+            derivatives[name] = source
+    except (images.Error, ImagingError) as err:
+        logging.warning('Image derivatives not created: %s' % err)
+        return {}
+    return derivatives
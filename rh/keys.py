@@ -1,8 +1,40 @@
 import os
+import hmac
 import hashlib
 
+# Deterministic request ids are offset by this amount, which places them well
+# above the range of ids automatically allocated by the datastore.
+REQUEST_ID_BASE = 1 << 62
+
+
 def generate_api_key(prefix):
     sha1 = hashlib.sha1()
     sha1.update(os.urandom(8))
     h = sha1.hexdigest()[:20]
     return '%s_%s' % (prefix, h)
+
+
+def generate_request_id(adaptor_name, source_id):
+    """ Return integer request id derived from adaptor name and source id """
+    sha1 = hashlib.sha1()
+    sha1.update(('%s:%s' % (adaptor_name, source_id)).encode('utf8'))
+    return REQUEST_ID_BASE + int(sha1.hexdigest()[:15], 16)
+
+
+def hash_api_key(api_key):
+    """ Return SHA-256 hexdigest of API key """
+    return hashlib.sha256(api_key.encode('utf8')).hexdigest()
+
+
+def _compare_digest(a, b):
+    """ Compare two strings in time that does not depend on their contents """
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+# ``hmac.compare_digest`` is only available in Python 2.7.7 and later
+constant_time_compare = getattr(hmac, 'compare_digest', _compare_digest)
@@ -0,0 +1,105 @@
+""" Locale registry
+
+This module implements a process-wide registry of Babel locales. It is used
+instead of calling Babel directly wherever locales are validated or language
+names are displayed.
+
+``babel.localedata.exists()`` checks the file system on every call, and
+``babel.Locale`` loads the locale data each time it is instantiated. The
+registry reads the list of valid locale identifiers once, and keeps the
+language names that were looked up in a LRU cache.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import threading
+import collections
+
+import babel
+from babel import localedata
+
+__all__ = ('LRUCache', 'get_identifiers', 'exists', 'get_language_name')
+
+# Maximum number of cached language names
+NAME_CACHE_SIZE = 1024
+
+_identifiers = None
+
+
+class LRUCache(object):
+    """ Thread-safe mapping that keeps at most ``size`` recently used items """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                return default
+            # Re-inserting the item marks it as most recently used
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            if len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+_names = LRUCache(NAME_CACHE_SIZE)
+
+
+def get_identifiers():
+    """ Return a frozenset of all valid locale identifiers
+
+    The set is built on first use.
+    """
+    global _identifiers
+    if _identifiers is None:
+        _identifiers = frozenset(localedata.locale_identifiers())
+    return _identifiers
+
+
+def exists(identifier):
+    """ Return ``True`` if identifier is a valid locale identifier """
+    return identifier in get_identifiers()
+
+
+def get_language_name(identifier, display_locale=None):
+    """ Return the name of the language for given locale identifier
+
+    The name is returned in the language of ``display_locale``, which defaults
+    to the locale itself. ``None`` is returned for unknown locales.
+    """
+    key = (identifier, display_locale)
+    name = _names.get(key, _names)
+    if name is not _names:
+        return name
+    if not exists(identifier) or not (
+            display_locale is None or exists(display_locale)):
+        name = None
+    else:
+        name = babel.Locale(identifier).get_language_name(display_locale)
+    _names.set(key, name)
+    return name
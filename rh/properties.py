@@ -7,17 +7,22 @@ properties are used in RH's datastore models.
 
 from __future__ import unicode_literals, print_function
 
-from babel import localedata
 from google.appengine.ext import ndb
 from google.appengine.ext import db
 
+from . import locales
+
 
 __all__ = ('LanguageProperty',)
 
 
 class LanguageProperty(ndb.StringProperty):
-    """ Property for storing Babel-compatible language codes """
+    """ Property for storing Babel-compatible language codes
+
+    Language codes are validated against the locale registry (see
+    ``rh.locales``).
+    """
 
     def _validate(self, val):
-        if not localedata.exists(val):
+        if not locales.exists(val):
             raise db.BadValueError('Not a valid locale')
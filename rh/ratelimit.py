@@ -0,0 +1,317 @@
+""" Request rate limiting
+
+This module implements rate limiting of requests pushed to the hub by
+adaptors (see ``ra.email.EmailHook`` and ``rh.api.RequestBatch``). Without
+it, a burst of requests from a single adaptor or sender is stored right away,
+which causes datastore contention and quota spikes.
+
+Each adaptor, and for email each sender address, has a token bucket, which
+is named after the adaptor (remote adaptors by their datastore id, since
+their names are not unique), holds up to ``burst`` tokens, and is refilled at ``rate`` tokens per second.
+Accepting a request takes one token. Buckets are shared by all instances
+through memcache, and are implemented using the generic cell rate algorithm:
+the bucket is a single counter, which holds the time (in milliseconds) at
+which the bucket will be full again. Taking tokens advances the time using
+an atomic ``incr()``, and tokens that could not be taken are given back with
+an atomic ``decr()``. The bucket is full when the counter is in the past, so
+a bucket that was evicted from memcache is simply full.
+
+Requests are limited before they are checked, so over-limit requests cost
+as little as possible. They are not dropped, but stored as backlog entities,
+and deferred to the ``request-backlog`` queue (see ``queue.yaml``). Once the
+bucket has had time to refill, the backlog is limited again, and admitted
+requests are checked and stored at the rate of the queue.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import math
+import time
+import hashlib
+import logging
+import collections
+
+from google.appengine.api import memcache
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
+
+from .db import RequestFingerprint, BacklogRequest, MAX_BLOB_SIZE
+from .requests import Request
+from .exceptions import RequestError, RequestDataError
+
+__all__ = ('TokenBucket', 'bucket_name', 'sender_bucket', 'admit',
+           'AdaptorLimits', 'defer_backlog', 'store_backlog')
+
+CACHE_PREFIX = 'ratelimit:'
+CAS_ATTEMPTS = 3
+BACKLOG_QUEUE = 'request-backlog'
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class TokenBucket(object):
+    """ Token bucket identified by ``name``
+
+    The bucket holds at most ``burst`` tokens, and is refilled at ``rate``
+    tokens per second.
+    """
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.key = CACHE_PREFIX + name
+        # Number of milliseconds it takes to refill a single token
+        self.cost = max(int(1000 / rate), 1)
+        self.capacity = burst * self.cost
+        # Number of seconds until tokens that could not be taken are refilled
+        self.wait = 0
+
+    def take(self, count=1):
+        """ Take up to ``count`` tokens, and return the number of tokens taken
+
+        The ``wait`` attribute is updated with the number of seconds until
+        the tokens that could not be taken will be available.
+        """
+        self.wait = 0
+        if not count:
+            return 0
+        now = now_ms()
+        cost = count * self.cost
+        full = memcache.incr(self.key, cost, initial_value=now)
+        if full is None:
+            # Limiting is not worth failing the requests if memcache is down
+            logging.error('Rate limit %s is not available' % self.name)
+            return count
+        if full - cost < now:
+            full = self.refill(now, full, cost)
+        excess = full - now - self.capacity
+        if excess <= 0:
+            return count
+        over = min(count, int(math.ceil(float(excess) / self.cost)))
+        memcache.decr(self.key, over * self.cost)
+        self.wait = float(excess) / 1000
+        return count - over
+
+    def refill(self, now, full, cost):
+        """ Move the counter of a bucket that was full to the current time
+
+        ``full`` is the counter after ``cost`` was added to it. Tokens only
+        refill up to ``burst``, so the time the bucket spent full is not
+        counted. Concurrent requests may also find the bucket full, so the
+        counter is moved using compare-and-set, and only if none of them did
+        it already.
+        """
+        idle = now - (full - cost)
+        client = memcache.Client()
+        for attempt in range(CAS_ATTEMPTS):
+            value = client.gets(self.key)
+            if value is None or value - cost >= now:
+                break
+            if client.cas(self.key, value + idle):
+                return value + idle
+        return full if value is None else value
+
+
+def bucket_name(adaptor):
+    """ Return name of the token bucket of an adaptor
+
+    Remote adaptors are identified by their datastore ids, since two of them
+    may have the same name, and other adaptors by their names.
+    """
+    name = getattr(adaptor, 'bucket_name', None)
+    if name:
+        return name
+    key = getattr(adaptor, 'key', None)
+    if isinstance(key, ndb.Key) and key.id() is not None:
+        return '%s:%s' % (key.kind(), key.id())
+    return adaptor.name
+
+
+def sender_bucket(adaptor, sender):
+    """ Return token bucket of a sender who posts requests through adaptor
+
+    Sender addresses are case-insensitive, and should be lowercased.
+    """
+    name = '%s:%s' % (bucket_name(adaptor),
+                      hashlib.sha1(sender.encode('utf8')).hexdigest())
+    return TokenBucket(name, adaptor.sender_rate, adaptor.sender_burst)
+
+
+def admit(adaptor, requests):
+    """ Split requests into admitted and over-limit requests
+
+    Requests are limited using the adaptor's bucket, and if the adaptor has a
+    ``sender_rate``, the bucket of the request's sender (requests without a
+    sender are only limited per adaptor). Returns ``(admitted, backlog,
+    wait)``, where ``admitted`` and ``backlog`` are lists of requests in the
+    original order, and ``wait`` is the number of seconds until the backlog
+    can be admitted.
+    """
+    requests = list(requests)
+    allowed = set(range(len(requests)))
+    wait = 0
+    if getattr(adaptor, 'sender_rate', None):
+        senders = collections.OrderedDict()
+        for i, r in enumerate(requests):
+            if r.sender:
+                senders.setdefault(r.sender.lower(), []).append(i)
+        for sender, indices in senders.items():
+            bucket = sender_bucket(adaptor, sender)
+            taken = bucket.take(len(indices))
+            allowed.difference_update(indices[taken:])
+            wait = max(wait, bucket.wait)
+    bucket = TokenBucket(bucket_name(adaptor), adaptor.rate, adaptor.burst)
+    indices = sorted(allowed)
+    taken = bucket.take(len(indices))
+    allowed.difference_update(indices[taken:])
+    wait = max(wait, bucket.wait)
+    admitted = [r for i, r in enumerate(requests) if i in allowed]
+    backlog = [r for i, r in enumerate(requests) if i not in allowed]
+    return admitted, backlog, wait
+
+
+class AdaptorLimits(object):
+    """ Rate limits of an adaptor, which are passed to backlog tasks
+
+    Adaptors themselves cannot always be pickled (or instantiated in a
+    task), so backlog tasks limit requests using a copy of their limits.
+    """
+
+    def __init__(self, name, rate, burst, sender_rate=None,
+                 sender_burst=None, bucket_name=None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.bucket_name = bucket_name
+
+    @classmethod
+    def of(cls, adaptor):
+        return cls(adaptor.name, adaptor.rate, adaptor.burst,
+                   getattr(adaptor, 'sender_rate', None),
+                   getattr(adaptor, 'sender_burst', None),
+                   bucket_name(adaptor))
+
+
+class BacklogSource(object):
+    """ Adaptor information of a backlog request """
+
+    def __init__(self, name, source, trusted):
+        self.name = name
+        self.source = source
+        self.trusted = trusted
+
+
+def to_backlog(request):
+    """ Return an unsaved backlog entity for a request
+
+    Backlog entities are limited to 1MB, so images that are larger than a
+    blob are checked right away, and the derived master is stored instead.
+    ``RequestError`` is raised if the request is invalid, or its content
+    does not fit.
+    """
+    content = request.raw_content
+    if isinstance(content, unicode):
+        content = content.encode('utf8')
+    encoded = request.encoded
+    content_format = request.content_format
+    if content and len(content) > MAX_BLOB_SIZE:
+        request.check()
+        if 'master' not in request.derivatives:
+            raise RequestDataError('Request is too large')
+        content, content_format = request.derivatives['master']
+        encoded = False
+    return BacklogRequest(
+        adaptor_name=request.adaptor_name,
+        adaptor_source=request.adaptor_source,
+        adaptor_trusted=request.adaptor_trusted,
+        content=content,
+        encoded=encoded,
+        posted=request.posted,
+        world=request.world,
+        content_format=content_format,
+        language=request.language,
+        content_language=request.content_language,
+        topic=request.topic,
+        source_id=request.source_id,
+        sender=request.sender,
+    )
+
+
+def from_backlog(entity):
+    """ Return a request object for a backlog entity """
+    content = entity.content
+    if content is not None and entity.content_format == Request.TEXT:
+        content = content.decode('utf8')
+    source = BacklogSource(entity.adaptor_name, entity.adaptor_source,
+                           entity.adaptor_trusted)
+    return Request(
+        adaptor=source,
+        content=content,
+        timestamp=entity.posted,
+        world=entity.world,
+        content_format=entity.content_format,
+        language=entity.language,
+        content_language=entity.content_language,
+        topic=entity.topic,
+        source_id=entity.source_id,
+        encoded=entity.encoded,
+        sender=entity.sender,
+    )
+
+
+def defer_backlog(adaptor, requests, wait=0):
+    """ Defer storing over-limit requests until ``wait`` seconds from now
+
+    Requests are stored as ``BacklogRequest`` entities, and only their keys
+    are passed to the task, since deferred payloads are limited to 1MB.
+    Requests that cannot be stored in the backlog are logged and dropped.
+    """
+    entities = []
+    for r in requests:
+        try:
+            entities.append(to_backlog(r))
+        except RequestError as err:
+            logging.error('Backlog request error: %s' % err)
+    if not entities:
+        return
+    keys = ndb.put_multi(entities)
+    deferred.defer(store_backlog, keys, AdaptorLimits.of(adaptor),
+                   _queue=BACKLOG_QUEUE, _countdown=int(math.ceil(wait)))
+
+
+def store_backlog(keys, limits):
+    """ Check and store deferred requests
+
+    Requests are limited again using the adaptor's ``limits``, since the
+    bucket may have been drained by newer requests in the meantime, and
+    requests that are still over the limit are deferred again. Invalid
+    requests are logged and dropped. Storing errors are not trapped, so the
+    task is retried until the requests are stored.
+    """
+    entities = [e for e in ndb.get_multi(keys) if e is not None]
+    requests = [from_backlog(e) for e in entities]
+    admitted, backlog, wait = admit(limits, requests)
+    done = set(id(r) for r in admitted)
+    clean = []
+    for r in admitted:
+        try:
+            r.check()
+            clean.append(r.prepare())
+        except RequestError as err:
+            logging.error('Backlog request error: %s' % err)
+    unique, fingerprints = RequestFingerprint.deduplicate(clean)
+    # Blobs and revisions are stored in the same batch as the requests
+    extra = [x for r in unique for x in r.pop_unsaved()]
+    ndb.put_multi(unique + fingerprints + extra)
+    ndb.delete_multi([e.key for e, r in zip(entities, requests)
+                      if id(r) in done])
+    logging.info('Stored %s backlog requests' % len(unique))
+    if backlog:
+        remaining = [e.key for e, r in zip(entities, requests)
+                     if id(r) not in done]
+        deferred.defer(store_backlog, remaining, limits,
+                       _queue=BACKLOG_QUEUE, _countdown=int(math.ceil(wait)))
@@ -6,26 +6,74 @@ This module contains the ``Request`` class which represents a single request.
 
 from __future__ import unicode_literals, print_function
 
+import sys
+import Queue
 import base64
+import binascii
 import StringIO
+import threading
 import datetime
+import hashlib
+import unicodedata
 import re
 
-from google.appengine.api.images import Image, NotImageError
+from google.appengine.api.images import Image, NotImageError, BadImageError
+from google.appengine.ext import ndb
 
-from .db import Request as RequestModel, RequestConstants
+from .db import Request as RequestModel, RequestConstants, MAX_BLOB_SIZE
+from .keys import generate_request_id
+from .sniff import looks_like_base64, sniff_image_format
+from .imaging import derive_images
 from .exceptions import *
 
-__all__ = ('Request',)
+__all__ = ('Request', 'check_many', 'decode_base64')
 
-# The following regexp will only match the standard Base64-encoded strings
-# using + and / for non-alphanumeric characters.
-BASE64_RE = re.compile(r'^([A-Za-z0-9+/]{4})*'  # normal base-64 blocks
-                       r'('
-                       r'[A-Za-z0-9+/]{4}'      # Non-padded block
-                       r'|[A-Za-z0-9+/]{3}='    # Padded block with 1 pad
-                       r'|[A-Za-z0-9+/]{2}=='   # Padded block with 2 pads
-                       r')$')
+# Image checks that need the image to be loaded using the Images API. Image
+# format is always checked, by sniffing the first few bytes of the image.
+# Set to ``True`` to reject images that the Images API cannot load
+VERIFY_IMAGES = False
+# Set to ``(width, height)`` to reject larger images
+MAX_IMAGE_DIMENSIONS = None
+
+# Number of threads used to check image requests concurrently
+CHECK_WORKERS = 8
+
+# Number of characters decoded at once by ``decode_base64()``
+BASE64_CHUNK_SIZE = 64 * 1024
+
+# Characters ignored when fingerprinting text content (punctuation, symbols)
+NONWORD_RE = re.compile(r'[^\w\s]+', re.UNICODE)
+WHITESPACE_RE = re.compile(r'\s+', re.UNICODE)
+
+
+def decode_base64(text, max_size=None, chunk_size=BASE64_CHUNK_SIZE):
+    """ Decode Base64-encoded text in chunks
+
+    Text is decoded ``chunk_size`` characters at a time into a single buffer,
+    so apart from the decoded data, only a single chunk is held in memory at
+    once. Whitespace (e.g., line breaks in MIME-encoded data) is ignored.
+    ``BinaryDecodeError`` is raised if the text cannot be decoded, or if
+    ``max_size`` is specified, and the decoded data could be larger than
+    ``max_size`` bytes, which is checked before decoding.
+    """
+    if max_size is not None:
+        # Upper bound, as whitespace is counted as well
+        size = len(text) // 4 * 3 - text.rstrip()[-2:].count('=')
+        if size > max_size:
+            raise BinaryDecodeError('Binary data too large')
+    data = bytearray()
+    carry = ''
+    for start in range(0, len(text), chunk_size):
+        chunk = carry + ''.join(text[start:start + chunk_size].split())
+        end = len(chunk) - len(chunk) % 4
+        carry = chunk[end:]
+        try:
+            data.extend(binascii.a2b_base64(chunk[:end]))
+        except (binascii.Error, UnicodeError):
+            raise BinaryDecodeError('Unable to decode binary data')
+    if carry:
+        raise BinaryDecodeError('Unable to decode binary data')
+    return bytes(data)
 
 
 class Request(RequestConstants):
@@ -46,20 +94,34 @@ class Request(RequestConstants):
 
     def __init__(self, adaptor, content, timestamp, world, content_format,
                  language=None, content_language=None, topic=None,
-                 location=None):
+                 location=None, source_id=None, encoded=True, sender=None):
 
         # Adaptor information
         self.adaptor_name = adaptor.name
         self.adaptor_source = adaptor.source
         self.adaptor_trusted = adaptor.trusted
 
+        # Identifier of the request at its source
+        self.source_id = source_id and unicode(source_id)
+
+        # Address of the person who posted the request, which is only used
+        # for rate limiting, and is not stored
+        self.sender = sender
+
+        # Normalized content fingerprint (calculated by ``check()``)
+        self.fingerprint = None
+
         # Timestamps
         self.posted = timestamp
         self.processed = datetime.datetime.now()
 
         # Request content information
         self.raw_content = content
+        # Whether binary content is Base64-encoded
+        self.encoded = encoded
         self.processed_content = None
+        # Sizes of image content (calculated by ``check()``)
+        self.derivatives = {}
         self.world = world
         self.content_format = content_format
         self.content_type = self.CONTENT_TYPES.get(self.content_format)
@@ -90,9 +152,9 @@ class Request(RequestConstants):
             raise RequestDataError('Missing request content')
         if self.content_format not in self.FORMATS:
             raise RequestDataError('Invalid content format')
-        if all([self.content_type == self.TRANSCRIBED,
-                len(self.raw_content) > 40,
-                BASE64_RE.match(self.raw_content)]):
+        if (self.content_type == self.TRANSCRIBED and
+                len(self.raw_content) > 40 and
+                looks_like_base64(self.raw_content)):
             raise RequestDataError('Binary data as text')
 
     def check_content_data(self):
@@ -100,11 +162,10 @@ class Request(RequestConstants):
         if self.content_format == self.TEXT:
             self.processed_content = unicode(self.raw_content)
         elif self.content_format in self.IMAGE:
-            # Check that image data can be safely decoded
             decoded = self.decode_binary()
-            img = self.image_from_string(decoded)
-            # Check if image is broken
-            fmt = img.format
+            fmt = sniff_image_format(decoded)
+            if fmt is None:
+                raise ImageDecodeError('Cannot load image from string')
             if fmt not in self.PIL_FORMATS:
                 raise ImageFormatError('Image format %s not supported' % fmt)
             fmt = self.PIL_FORMAT_MAPPINGS[fmt]
@@ -114,9 +175,20 @@ class Request(RequestConstants):
                 raise ImageFormatError('Image format %s does not match '
                                        'content format %s' % (
                                            fmt, self.content_format))
-
+            if VERIFY_IMAGES or MAX_IMAGE_DIMENSIONS:
+                self.verify_image(decoded)
             self.processed_content = decoded
 
+    def verify_image(self, data):
+        """ Load the image using the Images API and check its dimensions """
+        img = self.image_from_string(data)
+        if MAX_IMAGE_DIMENSIONS:
+            max_width, max_height = MAX_IMAGE_DIMENSIONS
+            if img.width > max_width or img.height > max_height:
+                raise ImageFormatError('Image dimensions %sx%s exceed '
+                                       '%sx%s' % (img.width, img.height,
+                                                  max_width, max_height))
+
     def check_request_meta(self):
         """ Check miscellanous request information """
         if not self.world in self.WORLDS:
@@ -129,8 +201,48 @@ class Request(RequestConstants):
         self.check_request_meta()
         self.check_content_format()
         self.check_content_data()
+        self.fingerprint = self.fingerprint_content()
+        self.derive_images()
         return self
 
+    def derive_images(self):
+        """ Derive image sizes that are stored instead of the posted image
+
+        The fingerprint is calculated from the posted image, so the same
+        image posted again is recognized as a duplicate. If the sizes cannot
+        be derived, the posted image is stored as is, and the request is
+        rejected if the image does not fit in a blob.
+        """
+        if self.content_type == self.NONTRANSCRIBED and self.processed_content:
+            self.derivatives = derive_images(self.processed_content,
+                                             self.content_format)
+            if (not self.derivatives and
+                    len(self.processed_content) > MAX_BLOB_SIZE):
+                raise RequestDataError('Image is too large')
+
+    def fingerprint_content(self):
+        """ Return fingerprint of processed content
+
+        Text is normalized before fingerprinting, so that requests that only
+        differ in case, punctuation, or whitespace have the same fingerprint.
+        Images are fingerprinted by SHA-1 hexdigest of the posted image data.
+        The stored image is usually the derived master, whose own digest is
+        used as the ``RequestBlob`` key, so the two digests can differ.
+        """
+        if not self.processed_content:
+            return None
+        if self.content_type == self.TRANSCRIBED:
+            text = self.normalize_text(self.processed_content)
+            return hashlib.sha1(text.encode('utf8')).hexdigest()
+        return hashlib.sha1(self.processed_content).hexdigest()
+
+    @staticmethod
+    def normalize_text(text):
+        """ Normalize text for fingerprinting """
+        text = unicodedata.normalize('NFKC', text).lower()
+        text = NONWORD_RE.sub(' ', text)
+        return WHITESPACE_RE.sub(' ', text).strip()
+
     def prepare(self):
         """ Return an unsaved entity """
         if not self.processed_content:
@@ -144,7 +256,13 @@ class Request(RequestConstants):
             world=self.world,
             posted=self.posted,
             processed=self.processed,
+            source_id=self.source_id,
+            fingerprint=self.fingerprint,
         )
+        if self.source_id is not None:
+            # Storing the same request again does not create a duplicate
+            r.key = ndb.Key(RequestModel, generate_request_id(
+                self.adaptor_name, self.source_id))
         if self.content_type == self.TRANSCRIBED:
             r.set_content(
                 text_content=self.processed_content,
@@ -153,7 +271,12 @@ class Request(RequestConstants):
                 topic=self.topic,
             )
         else:
-            r.binary_content = self.processed_content
+            if self.derivatives:
+                r.set_binary_content(*self.derivatives['master'])
+                for name in ('preview', 'thumbnail'):
+                    r.set_derivative(name, *self.derivatives[name])
+            else:
+                r.set_binary_content(self.processed_content)
             r.set_content(
                 text_content=None,
                 language=self.language,
@@ -168,7 +291,13 @@ class Request(RequestConstants):
         return r
 
     def decode_binary(self):
-        """ Decodes binary data """
+        """ Decodes binary data
+
+        Content that is not Base64-encoded (see the ``encoded`` argument) is
+        returned as is.
+        """
+        if not self.encoded:
+            return self.raw_content
         try:
             decoded = base64.b64decode(self.raw_content)
         except TypeError:
@@ -181,9 +310,77 @@ class Request(RequestConstants):
         try:
             img = Image(image_data=s)
             img.format  # Access the `format` attrib to trigger the exception
-        except NotImageError:
+        except (NotImageError, BadImageError):
             raise ImageDecodeError('Cannot load image from string')
         return img
 
 
+def run_concurrently(fn, items, workers):
+    """ Call ``fn`` for each item using at most ``workers`` threads
+
+    The first exception raised by ``fn`` is re-raised once all threads have
+    finished.
+    """
+    queue = Queue.Queue()
+    for item in items:
+        queue.put(item)
+    failures = []
+
+    def work():
+        while not failures:
+            try:
+                item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                fn(item)
+            except Exception:
+                failures.append(sys.exc_info())
+    threads = [threading.Thread(target=work)
+               for i in range(min(workers, len(items)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if failures:
+        exc_type, exc, tb = failures[0]
+        raise exc_type, exc, tb
+
+
+def check_many(requests, workers=CHECK_WORKERS):
+    """ Check requests, and return entities of valid ones and errors
+
+    Image requests are checked concurrently using up to ``workers`` threads,
+    so a batch of images that are loaded using the Images API (see
+    ``VERIFY_IMAGES``) is checked in about the time it takes to check the
+    slowest one. Returns ``(entities, errors)``, where ``entities`` is a list
+    of unsaved entities of valid requests, and ``errors`` is a list of
+    ``(request, error)`` pairs of invalid requests, both in the order of
+    ``requests``. Errors other than ``RequestError`` are not trapped.
+    """
+    requests = list(requests)
+    errors = [None] * len(requests)
 
+    def check(i):
+        try:
+            requests[i].check()
+        except RequestError as err:
+            errors[i] = err
+    images = [i for i, r in enumerate(requests)
+              if r.content_format in Request.IMAGE]
+    if len(images) > 1 and workers > 1:
+        run_concurrently(check, images, workers)
+    else:
+        for i in images:
+            check(i)
+    for i, r in enumerate(requests):
+        if r.content_format not in Request.IMAGE:
+            check(i)
+    entities = []
+    invalid = []
+    for r, err in zip(requests, errors):
+        if err is None:
+            entities.append(r.prepare())
+        else:
+            invalid.append((r, err))
+    return entities, invalid
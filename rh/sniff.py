@@ -0,0 +1,72 @@
+""" Content sniffing
+
+This module implements cheap checks used to validate request content (see
+``rh.requests.Request``) without scanning or decoding all of it:
+
+- text is classified as Base64-encoded data by looking at a sample of
+  ``BASE64_SAMPLE_SIZE`` characters at its start, and its padding
+- image format is detected from the magic bytes in the first
+  ``SNIFF_SIZE`` bytes of the image
+
+The cost of both checks does not depend on the size of the content.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import re
+
+from google.appengine.api import images
+
+__all__ = ('looks_like_base64', 'sniff_image_format')
+
+BASE64_SAMPLE_SIZE = 256
+SNIFF_SIZE = 16
+
+NON_BASE64_RE = re.compile(r'[^A-Za-z0-9+/]')
+
+# Magic bytes of image formats, as ``(magic, format)`` pairs, where format is
+# one of the Images API format constants (WebP is checked separately)
+IMAGE_MAGIC = (
+    (b'\x89PNG\r\n\x1a\n', images.PNG),
+    (b'\xff\xd8\xff', images.JPEG),
+    (b'GIF87a', images.GIF),
+    (b'GIF89a', images.GIF),
+    (b'II*\x00', images.TIFF),
+    (b'MM\x00*', images.TIFF),
+    (b'\x00\x00\x01\x00', images.ICO),
+    (b'BM', images.BMP),
+)
+
+
+def looks_like_base64(text, sample_size=BASE64_SAMPLE_SIZE):
+    """ Return whether text looks like standard Base64-encoded data
+
+    The text must consist of whole 4-character blocks, with at most 2 padding
+    characters at the end. Only the first ``sample_size`` characters and the
+    last block are checked for characters that are not part of the Base64
+    alphabet, so text that only starts like Base64 data is classified as
+    Base64 as well.
+    """
+    if not text or len(text) % 4:
+        return False
+    last = text[-4:]
+    data = last.rstrip('=')
+    if len(last) - len(data) > 2:
+        return False
+    if len(text) <= sample_size:
+        sample = text[:len(text) - 4] + data
+    else:
+        sample = text[:sample_size]
+    return not (NON_BASE64_RE.search(sample) or NON_BASE64_RE.search(data))
+
+
+def sniff_image_format(data):
+    """ Return Images API format of image data, or ``None`` if unknown """
+    head = data[:SNIFF_SIZE]
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return images.WEBP
+    for magic, fmt in IMAGE_MAGIC:
+        if head.startswith(magic):
+            return fmt
+    return None
@@ -0,0 +1,95 @@
+""" Text deltas
+
+This module implements compact deltas between two versions of a text. They
+are used to store request revisions (see ``rh.db.Revision``), which usually
+differ from the previous revision in a few words.
+
+Texts are compared word by word, and the delta is a list of operations that
+turn the old text into the new one when applied in order:
+
+- positive integer ``n``: copy next ``n`` characters of the old text
+- negative integer ``-n``: skip next ``n`` characters of the old text
+- string: insert the string
+
+The delta is JSON-serializable, and applying it reproduces the new text
+exactly.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import re
+import json
+import difflib
+
+__all__ = ('make_delta', 'apply_delta', 'delta_size')
+
+TOKEN_RE = re.compile(r'\w+|\W', re.UNICODE)
+
+
+def tokenize(text):
+    """ Split text into words and single non-word characters
+
+    Joining the tokens gives back the original text.
+    """
+    return TOKEN_RE.findall(text)
+
+
+def append_op(delta, op):
+    """ Append operation to delta, merging it with the last one if possible """
+    if delta:
+        last = delta[-1]
+        if isinstance(op, int) and isinstance(last, int) and (
+                (op > 0) == (last > 0)):
+            delta[-1] = last + op
+            return
+        if not isinstance(op, int) and not isinstance(last, int):
+            delta[-1] = last + op
+            return
+    delta.append(op)
+
+
+def make_delta(old, new):
+    """ Return delta that turns ``old`` text into ``new`` text """
+    old_tokens = tokenize(old)
+    new_tokens = tokenize(new)
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens,
+                                      autojunk=False)
+    delta = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        old_length = sum(len(t) for t in old_tokens[i1:i2])
+        if tag == 'equal':
+            append_op(delta, old_length)
+            continue
+        if old_length:
+            append_op(delta, -old_length)
+        if j2 > j1:
+            append_op(delta, ''.join(new_tokens[j1:j2]))
+    return delta
+
+
+def apply_delta(old, delta):
+    """ Return text produced by applying ``delta`` to ``old`` text
+
+    Raises ``ValueError`` if the delta was not made for the ``old`` text.
+    """
+    parts = []
+    pos = 0
+    for op in delta:
+        if isinstance(op, int):
+            end = pos + abs(op)
+            if end > len(old):
+                raise ValueError('Delta does not match the base text')
+            if op > 0:
+                parts.append(old[pos:end])
+            pos = end
+        else:
+            parts.append(op)
+    if pos != len(old):
+        raise ValueError('Delta does not match the base text')
+    return ''.join(parts)
+
+
+def delta_size(delta):
+    """ Return size of serialized delta """
+    return len(json.dumps(delta, separators=(',', ':')))
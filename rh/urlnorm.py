@@ -0,0 +1,66 @@
+""" URL normalization
+
+This module implements normalization of content suggestion URLs. Normalized
+URLs are used to detect suggestions that point to the same page even though
+their URLs differ, and to look up suggestions by URL.
+
+Normalization lowercases the scheme and host, removes default ports, trailing
+slashes, fragments, and tracking parameters (such as the ``utm_*`` parameters
+added by analytics tools), and sorts the remaining query parameters. Other
+parts of the URL are left as they are. Normalized URLs are only used as keys,
+and are never shown to users or opened.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import urlparse
+
+__all__ = ('normalize_url',)
+
+DEFAULT_PORTS = {
+    'http': '80',
+    'https': '443',
+}
+
+TRACKING_PREFIXES = ('utm_',)
+TRACKING_PARAMS = frozenset([
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', '_ga',
+])
+
+
+def is_tracking_param(param):
+    name = param.split('=', 1)[0].lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def normalize_netloc(scheme, netloc):
+    """ Lowercase the host and remove default port, keeping user info """
+    userinfo, sep, host = netloc.rpartition('@')
+    host = host.lower()
+    hostname, colon, port = host.rpartition(':')
+    # Colons in IPv6 addresses are within brackets
+    if colon and not port.endswith(']') and DEFAULT_PORTS.get(scheme) == port:
+        host = hostname
+    return userinfo + sep + host
+
+
+def normalize_url(url):
+    """ Return normalized form of the URL
+
+    URLs that point to the same page, such as::
+
+        http://Example.com:80/page/?utm_source=fb&b=2&a=1#top
+        http://example.com/page?a=1&b=2
+
+    have the same normalized form.
+    """
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url.strip())
+    scheme = scheme.lower()
+    netloc = normalize_netloc(scheme, netloc)
+    path = path.rstrip('/')
+    if netloc and not path:
+        path = '/'
+    params = sorted(p for p in query.split('&')
+                    if p and not is_tracking_param(p))
+    return urlparse.urlunsplit((scheme, netloc, path, '&'.join(params), ''))
@@ -0,0 +1,366 @@
+""" Sharded vote counters
+
+This module implements sharded counters for content suggestion votes.
+
+Voting used to increment the ``votes`` property of the content suggestion
+directly, which meant that each vote rewrote the whole request entity, and
+concurrent votes on a popular request would either lose updates or fail
+because of datastore's per-entity-group write limit. Instead, each vote now
+increments one of ``SHARD_COUNT`` randomly chosen ``VoteShard`` entities for
+the (request, URL) pair. Shards are root entities, so they can be written to
+in parallel. The total is cached in memcache for ``CACHE_TIMEOUT``, so a total
+that was cached while a vote was being recorded (and missed that vote) is
+only shown for a short while.
+
+Votes that a suggestion had before its counter was first used are kept in
+a separate seed shard, which is created from ``Content.votes`` in a
+transaction before the first vote is counted (and by migration 004). Seeding
+happens at most once per counter, so legacy votes are never lost or counted
+twice, whether or not the migration has run.
+
+Totals are periodically written back into ``Content.votes`` by ``flush()``
+(see ``css.cron``), so the request's vote counts lag behind the shards by at
+most one flush interval. Flushed totals are always summed from the shards,
+never taken from memcache, and each request is updated in a transaction, so
+concurrent changes to the request are not overwritten.
+
+As an alternative to sharded counters, votes can be recorded as append-only
+``VoteEvent`` entities (the ``DEFERRED`` mode). Recording a vote is then a
+single small write, and ``fold_events()`` periodically applies batches of
+events to the requests. The two modes are mutually exclusive, because
+``flush()`` overwrites vote counts with counter totals, which do not include
+votes recorded as events.
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import uuid
+import random
+import functools
+import hashlib
+import datetime
+
+from google.appengine.api import memcache
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+__all__ = ('VoteShard', 'VoteFlushHistory', 'VoteCounter', 'VoteEvent',
+           'AppliedVote', 'flush', 'fold_events', 'SHARDED', 'DEFERRED')
+
+# Voting modes
+SHARDED = 'sharded'
+DEFERRED = 'deferred'
+
+SHARD_COUNT = 20
+INCREMENT_ATTEMPTS = 5
+CACHE_PREFIX = 'votes:'
+CACHE_TIMEOUT = 5 * 60  # 5 minutes
+FLUSH_PAGE_SIZE = 500
+# Shards updated this long before the last flush are flushed again, since
+# the query that finds updated shards is eventually consistent
+FLUSH_OVERLAP = datetime.timedelta(minutes=5)
+FOLD_BATCH_SIZE = 500
+
+
+class VoteShard(ndb.Model):
+    """ Model to persist a single shard of a vote counter """
+
+    request = ndb.KeyProperty(kind='Request', required=True)
+    url = ndb.StringProperty(required=True, indexed=False)
+    count = ndb.IntegerProperty(default=0, indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class VoteEvent(ndb.Model):
+    """ Model to persist a single vote that has not been applied yet """
+
+    request = ndb.KeyProperty(kind='Request', required=True, indexed=False)
+    url = ndb.StringProperty(required=True, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+    @classmethod
+    def record(cls, request_key, url):
+        """ Store a vote for given request and URL """
+        e = cls(id=uuid.uuid4().hex, request=request_key, url=url)
+        e.put()
+        return e
+
+
+class AppliedVote(ndb.Model):
+    """ Model to persist a marker of a vote event that has been applied
+
+    Markers are keyed by event id, and are children of the request the vote
+    was applied to, so they are stored in the same transaction as the request.
+    """
+
+    @staticmethod
+    def key_for(request_key, event_id):
+        return ndb.Key(AppliedVote, event_id, parent=request_key)
+
+
+class VoteFlushHistory(ndb.Model):
+    """ Model to persist the time vote counters were last flushed """
+
+    timestamp = ndb.DateTimeProperty()
+
+    @classmethod
+    def get_timestamp(cls):
+        h = cls.get_key().get()
+        if not h:
+            return datetime.datetime.utcfromtimestamp(0)
+        return h.timestamp
+
+    @classmethod
+    def record(cls, timestamp):
+        h = cls(key=cls.get_key(), timestamp=timestamp)
+        h.put()
+        return h
+
+    @staticmethod
+    def get_key():
+        return ndb.Key('VoteFlushHistory', 'votes')
+
+
+class VoteCounter(object):
+    """ Sharded vote counter for a single content suggestion
+
+    The counter is identified by the request key and the suggested URL.
+    """
+
+    shard_count = SHARD_COUNT
+
+    def __init__(self, request_key, url):
+        self.request_key = request_key
+        self.url = url
+        self.name = '%s-%s' % (request_key.id(),
+                               hashlib.sha1(url.encode('utf8')).hexdigest())
+
+    @property
+    def cache_key(self):
+        return CACHE_PREFIX + self.name
+
+    def get_shard_keys(self):
+        """ Return keys of all shards for this counter """
+        return [ndb.Key(VoteShard, '%s-%s' % (self.name, i))
+                for i in range(self.shard_count)]
+
+    def get_seed_key(self):
+        """ Return key of the shard that holds votes cast before sharding """
+        return ndb.Key(VoteShard, '%s-seed' % self.name)
+
+    def seed(self):
+        """ Create the seed shard unless it already exists
+
+        The seed shard holds the votes of the content suggestion at the time
+        the counter is first used. Once it exists, ``Content.votes`` is only
+        ever written by ``flush()``, and it is never read again.
+        """
+        key = self.get_seed_key()
+        if key.get() is not None:
+            return
+        try:
+            created = self._create_seed()
+        except datastore_errors.TransactionFailedError:
+            # Concurrent first votes all try to seed the counter, and the
+            # transaction only fails for good if none of them succeeded
+            if key.get(use_cache=False, use_memcache=False) is None:
+                raise
+            created = False
+        if created:
+            # A total cached before seeding does not include the seed
+            memcache.delete(self.cache_key)
+
+    @ndb.transactional(xg=True)
+    def _create_seed(self):
+        key = self.get_seed_key()
+        if key.get() is not None:
+            return False
+        r = self.request_key.get()
+        c = r and r.get_suggestion(self.url)
+        VoteShard(key=key, request=self.request_key, url=self.url,
+                  count=c and c.votes or 0).put()
+        return True
+
+    def get_count(self):
+        """ Return the total number of votes
+
+        The total is read from memcache if possible. Otherwise all shards are
+        fetched and summed up, and the total is cached.
+        """
+        total = memcache.get(self.cache_key)
+        if total is None:
+            total = self.get_total()
+            memcache.add(self.cache_key, total, CACHE_TIMEOUT)
+        return total
+
+    def get_total(self):
+        """ Return the total number of votes summed from the shards
+
+        Shards are fetched by key from the datastore, bypassing caches, so
+        the total includes all committed votes.
+        """
+        keys = self.get_shard_keys() + [self.get_seed_key()]
+        shards = ndb.get_multi(keys, use_cache=False, use_memcache=False)
+        return sum(s.count for s in shards if s is not None)
+
+    def increment(self):
+        """ Add a vote to a randomly selected shard
+
+        If the shard is contended, the vote is retried on another randomly
+        selected shard, up to ``INCREMENT_ATTEMPTS`` times. The counter is
+        seeded before the first vote is counted.
+        """
+        self.seed()
+        keys = self.get_shard_keys()
+        for attempt in range(INCREMENT_ATTEMPTS):
+            try:
+                self._increment_shard(random.choice(keys))
+                break
+            except datastore_errors.TransactionFailedError:
+                if attempt == INCREMENT_ATTEMPTS - 1:
+                    raise
+        # If the total is not cached, incr() is a no-op, and the total will be
+        # computed from the shards on next read.
+        memcache.incr(self.cache_key)
+
+    @ndb.transactional
+    def _increment_shard(self, key):
+        shard = key.get()
+        if shard is None:
+            shard = VoteShard(key=key, request=self.request_key, url=self.url)
+        shard.count += 1
+        shard.put()
+
+
+def flush(page_size=FLUSH_PAGE_SIZE):
+    """ Write vote counter totals back into content suggestions
+
+    Only counters whose shards were updated since last flush (less
+    ``FLUSH_OVERLAP``) are processed. Updated shards are queried in pages of
+    ``page_size``, and the requests of each page are saved before the next
+    page is fetched. Totals are summed from the shards (see
+    ``VoteCounter.get_total()``), and the cached totals are refreshed. Each
+    request is updated in its own transaction, and the transactions run
+    concurrently. Returns the number of updated requests.
+    """
+
+    started = datetime.datetime.utcnow()
+    since = VoteFlushHistory.get_timestamp()
+    if since > datetime.datetime.utcfromtimestamp(0) + FLUSH_OVERLAP:
+        since -= FLUSH_OVERLAP
+    q = VoteShard.query(VoteShard.updated >= since)
+
+    flushed = set()
+    updated = set()
+    cursor = None
+    more = True
+    while more:
+        shards, cursor, more = q.fetch_page(page_size, start_cursor=cursor)
+
+        # Collect distinct counters grouped by request
+        counters = {}
+        for s in shards:
+            if (s.request, s.url) not in flushed:
+                counters.setdefault(s.request, {})[s.url] = None
+        for request_key, urls in counters.items():
+            for url in urls:
+                counter = VoteCounter(request_key, url)
+                urls[url] = total = counter.get_total()
+                memcache.set(counter.cache_key, total, CACHE_TIMEOUT)
+                flushed.add((request_key, url))
+
+        futures = [(request_key, ndb.transaction_async(
+            functools.partial(_apply_totals, request_key, totals)))
+            for request_key, totals in counters.items()]
+        updated.update(request_key for request_key, f in futures
+                       if f.get_result())
+    VoteFlushHistory.record(started)
+    return len(updated)
+
+
+@ndb.tasklet
+def _apply_totals(request_key, totals):
+    """ Set vote totals of a request, and return whether it exists
+
+    Must be called in a transaction.
+    """
+    r = yield request_key.get_async()
+    if r is None:
+        raise ndb.Return(False)
+    for url, total in totals.items():
+        r.set_votes(url, total)
+    yield r.put_async()
+    raise ndb.Return(True)
+
+
+def fold_events(batch_size=FOLD_BATCH_SIZE):
+    """ Apply a batch of vote events to content suggestions
+
+    The oldest ``batch_size`` events are applied to their requests, and are
+    then deleted. Each request is updated in its own transaction, and the
+    transactions run concurrently.
+
+    Processing is at-least-once: if the events cannot be deleted after the
+    requests are saved, they will be processed again. To prevent counting
+    them twice, an ``AppliedVote`` marker is stored for each applied event in
+    the same transaction as the request, and events that have a marker are
+    skipped. Markers are deleted once their events are deleted.
+
+    Events for requests or URLs that do not exist are discarded. Returns the
+    number of processed events.
+    """
+
+    # Events are fetched by key, since an eventually consistent query may
+    # still return events that were already deleted
+    keys = VoteEvent.query().order(VoteEvent.created).fetch(batch_size,
+                                                            keys_only=True)
+    events = [e for e in ndb.get_multi(keys) if e is not None]
+    if not events:
+        return 0
+
+    by_request = {}
+    for e in events:
+        by_request.setdefault(e.request, []).append(e)
+
+    futures = [ndb.transaction_async(
+        functools.partial(_apply_events, request_key, request_events))
+        for request_key, request_events in by_request.items()]
+    markers = []
+    for f in futures:
+        markers.extend(f.get_result())
+    ndb.delete_multi([e.key for e in events])
+    ndb.delete_multi(markers)
+    return len(events)
+
+
+@ndb.tasklet
+def _apply_events(request_key, events):
+    """ Apply vote events to a request, and return keys of their markers
+
+    Must be called in a transaction.
+    """
+    marker_keys = [AppliedVote.key_for(request_key, e.key.id())
+                   for e in events]
+    r, markers = yield (request_key.get_async(),
+                        ndb.get_multi_async(marker_keys))
+    if r is None:
+        raise ndb.Return([])
+    applied = set(m.key.id() for m in markers if m is not None)
+    # Event ids kept on the request before markers were introduced
+    applied.update(r.applied_votes)
+    votes = {}
+    new_markers = []
+    for e, key in zip(events, marker_keys):
+        c = r.get_suggestion(e.url)
+        if key.id() in applied or c is None:
+            continue
+        votes[c.url] = votes.get(c.url, 0) + 1
+        new_markers.append(AppliedVote(key=key))
+    if not votes and not r.applied_votes:
+        raise ndb.Return(marker_keys)
+    for url, count in votes.items():
+        r.add_votes(url, count)
+    r.applied_votes = []
+    yield ndb.put_multi_async([r] + new_markers)
+    raise ndb.Return(marker_keys)
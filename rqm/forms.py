@@ -7,22 +7,15 @@ This module implements classes for Request Query Manager forms.
 
 from __future__ import unicode_literals, print_function
 
-from operator import itemgetter
-import locale
-
-from babel import localedata, Locale
 from utils.forms import Form
 from utils.schemabuilder import DEFAULT_VALIDATORS
 import formencode
 
 from rh.db import RequestConstants
+from rh.locales import get_identifiers
 
-locale.setlocale(locale.LC_ALL, '')
+from .languages import get_languages
 
-LOCALES = localedata.locale_identifiers()
-LANGUAGES = [(l, Locale(l).get_language_name()) for l in LOCALES
-             if Locale(l).get_language_name() is not None]
-LANGUAGES.sort(key=itemgetter(1), cmp=locale.strcoll)
 TOPICS = RequestConstants.TOPICS
 
 
@@ -32,9 +25,12 @@ class Enumerated(formencode.validators.FancyValidator):
     messages = {'invalid': '%(val)s is not a valid option'}
     choices = []
 
+    def get_choices(self):
+        return self.choices
+
     def _validate_other(self, value, state):
         value = unicode(value)
-        if value not in self.choices:
+        if value not in self.get_choices():
             raise formencode.Invalid(self.message('invalid', state, val=value),
                                      value, state)
 
@@ -45,7 +41,9 @@ class Enumerated(formencode.validators.FancyValidator):
 class Locale(Enumerated):
     """ Locale validator """
     messages = {'invalid': '%(val)s is not a recognized locale'}
-    choices = LOCALES
+
+    def get_choices(self):
+        return get_identifiers()
 
 
 class Topic(Enumerated):
@@ -63,10 +61,13 @@ validators.update({
 
 class ProofForm(Form):
 
-    extras = {
-        'languages': LANGUAGES,
-        'topics': [(t, t) for t in TOPICS]
-    }
     validators = validators
     template_name = 'rqm/_proof_form.html'
 
+    def get_extras(self):
+        # The language list is only loaded when the form is first rendered
+        return {
+            'languages': get_languages(),
+            'topics': [(t, t) for t in TOPICS]
+        }
+
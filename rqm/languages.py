@@ -0,0 +1,70 @@
+""" RQM language table
+
+This module provides the list of languages offered in RQM forms. Building the
+list requires loading locale data for every known locale, so it is not done
+at import time. Instead, the list is obtained on first use, and kept in
+instance memory for the lifetime of the instance. It is obtained from (in
+order of preference):
+
+- the ``rqm._languages`` module, generated at build time by
+  ``tools/genlangs.py``
+- memcache, where it is stored by the first instance that built it
+- locale data, using ``build_languages()``
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+from operator import itemgetter
+import locale
+
+import babel
+from google.appengine.api import memcache
+
+from rh.locales import get_identifiers, get_language_name
+
+__all__ = ('get_languages', 'build_languages')
+
+CACHE_KEY = 'rqm:languages:%s' % babel.__version__
+
+# Language names are sorted using the system locale's collation
+locale.setlocale(locale.LC_ALL, '')
+
+_languages = None
+
+
+def build_languages():
+    """ Return a list of (identifier, language name) pairs from locale data
+
+    The list is sorted by language name using the current locale's collation.
+    Locales without a language name are omitted.
+    """
+    languages = []
+    for identifier in sorted(get_identifiers()):
+        name = get_language_name(identifier)
+        if name is not None:
+            languages.append((identifier, name))
+    languages.sort(key=itemgetter(1), cmp=locale.strcoll)
+    return languages
+
+
+def load_languages():
+    """ Return the list of languages without using instance memory """
+    try:
+        from ._languages import LANGUAGES
+        return LANGUAGES
+    except ImportError:
+        pass
+    languages = memcache.get(CACHE_KEY)
+    if languages is None:
+        languages = build_languages()
+        memcache.set(CACHE_KEY, languages)
+    return languages
+
+
+def get_languages():
+    """ Return a list of (identifier, language name) pairs """
+    global _languages
+    if _languages is None:
+        _languages = load_languages()
+    return _languages
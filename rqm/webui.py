@@ -25,12 +25,25 @@ class WebUIProof(FormRoute):
             revision = int(revision)
         except ValueError:
             self.abort(400, 'Invalid revision number')
-        if 0 > revision > self.req.current_revision:
+        try:
+            self.update_request(lambda r: r.set_revision(revision))
+        except IndexError:
             self.abort(400, 'Revision number out of bounds')
-        self.req.current_revision = revision
-        self.req.put()
         return self.redirect()
 
+    @ndb.transactional
+    def update_request(self, update):
+        """ Apply ``update`` to the stored request, and save it
+
+        Revision numbers are taken from the stored request, so the request is
+        loaded again and saved in a transaction, and concurrent edits do not
+        write the same revision. Revisions are children of the request, so
+        they are saved in the same transaction.
+        """
+        self.req = self.req.key.get()
+        update(self.req)
+        self.req.put()
+
     def get_form_defaults(self):
         try:
             return self.req.content.to_dict()
@@ -56,6 +69,5 @@ class WebUIProof(FormRoute):
         content = self.form.valid_data.copy()
         content.pop('_csrf_token')
         print(content)
-        self.req.set_content(**content)
-        self.req.put()
+        self.update_request(lambda r: r.set_content(**content))
         return super(WebUIProof, self).form_valid()
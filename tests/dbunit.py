@@ -19,6 +19,7 @@ class DatastoreTestCase(unittest.TestCase):
         self.testbed.init_memcache_stub()  # required by ndb
         self.testbed.init_blobstore_stub()
         self.testbed.init_files_stub()  # required by blobstore
+        ndb.get_context().clear_cache()  # do not leak entities between tests
 
     def tearDown(self):
         self.testbed.deactivate()
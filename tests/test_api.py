@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+import json
+import struct
+
+from mock import patch
+from flask import Flask
+from google.appengine.ext import ndb
+
+from rh.api import RequestBatch, ENVELOPE, ENVELOPE_MAGIC, NDJSON
+from rh.db import Request, RemoteAdaptor, RequestFingerprint
+
+from tests.dbunit import DatastoreTestCase
+from tests.test_models import RequestFactoryMixin
+from tests.test_request import TEST_IMAGE_BIN, TEST_IMAGE_B64
+
+URL = '/rh/api/requests:batch'
+
+
+def item(content='Need news about the World Cup', **kwargs):
+    d = {'content': content, 'timestamp': '2014-04-01T12:00:00Z',
+         'world': 'offline'}
+    d.update(kwargs)
+    return d
+
+
+def ndjson(*items):
+    return '\n'.join(json.dumps(i) for i in items) + '\n'
+
+
+def record(header, content):
+    header = json.dumps(header).encode('utf8')
+    return (struct.pack(b'>H', len(header)) + header +
+            struct.pack(b'>I', len(content)) + content)
+
+
+class RequestBatchTestCase(RequestFactoryMixin, DatastoreTestCase):
+    """ Tests related to the batch request API """
+
+    def setUp(self):
+        super(RequestBatchTestCase, self).setUp()
+        app = Flask(__name__)
+        RequestBatch.register(app)
+        self.client = app.test_client()
+        self.adaptor = RemoteAdaptor(name='sms-gateway', source='sms',
+                                     contact='foo@example.com', trusted=True)
+        self.adaptor.put()
+
+    def post(self, data, content_type=NDJSON, api_key=None):
+        headers = {'X-API-Key': api_key or self.adaptor.api_key}
+        res = self.client.post(URL, data=data, content_type=content_type,
+                               headers=headers)
+        if res.status_code == 200:
+            return json.loads(res.data)
+        return res
+
+    def test_requires_api_key(self):
+        res = self.client.post(URL, data=ndjson(item()), content_type=NDJSON)
+        self.assertEqual(res.status_code, 403)
+        res = self.post(ndjson(item()), api_key='ra_bogus')
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(Request.query().count(), 0)
+
+    def test_unsupported_format(self):
+        res = self.post('foo', content_type='text/plain')
+        self.assertEqual(res.status_code, 415)
+
+    def test_ndjson(self):
+        """ Should store valid requests and report results in order """
+        data = ndjson(item(), item(world='nowhere'),
+                      item('Need weather', timestamp=1396353600,
+                           world='online'))
+        data += '{not json\n'
+        res = self.post(data)
+        self.assertEqual((res['saved'], res['duplicate'], res['rejected']),
+                         (2, 0, 2))
+        statuses = [(r['index'], r['status']) for r in res['results']]
+        self.assertEqual(statuses, [(0, 'saved'), (1, 'rejected'),
+                                    (2, 'saved'), (3, 'rejected')])
+        self.assertEqual(res['results'][1]['error'], 'Invalid world')
+        self.assertEqual(res['results'][3]['error'], 'Invalid JSON')
+        r = ndb.Key(Request, res['results'][0]['id']).get()
+        self.assertEqual(r.text_content, 'Need news about the World Cup')
+        self.assertEqual(r.adaptor_name, 'sms-gateway')
+        self.assertEqual(r.adaptor_trusted, True)
+        self.assertEqual(r.posted.hour, 12)
+
+    def test_ndjson_image(self):
+        res = self.post(ndjson(item(TEST_IMAGE_B64, format=Request.PNG)))
+        r = ndb.Key(Request, res['results'][0]['id']).get()
+        self.assertEqual(r.get_binary_content(), TEST_IMAGE_BIN)
+
+    def test_single_batch_put(self):
+        """ Should store requests with their blobs and revisions at once """
+        data = ndjson(item(), item(TEST_IMAGE_B64, format=Request.PNG))
+        with patch.object(ndb, 'put_multi', wraps=ndb.put_multi) as put:
+            res = self.post(data)
+        self.assertEqual(put.call_count, 1)
+        text, image = ndb.get_multi([ndb.Key(Request, r['id'])
+                                     for r in res['results']])
+        self.assertEqual(text.content.text_content,
+                         'Need news about the World Cup')
+        self.assertEqual(image.get_binary_content(), TEST_IMAGE_BIN)
+
+    def test_envelope(self):
+        """ Should read raw content from binary envelope """
+        header = item(content=None)
+        data = (ENVELOPE_MAGIC +
+                record(header, u'Need news à la carte'.encode('utf8')) +
+                record(dict(header, format=Request.PNG), TEST_IMAGE_BIN))
+        res = self.post(data, content_type=ENVELOPE)
+        self.assertEqual(res['saved'], 2)
+        text, image = ndb.get_multi([ndb.Key(Request, r['id'])
+                                     for r in res['results']])
+        self.assertEqual(text.text_content, u'Need news à la carte')
+        self.assertEqual(image.get_binary_content(), TEST_IMAGE_BIN)
+
+    def test_truncated_envelope(self):
+        """ Should store records read before the envelope is broken """
+        data = ENVELOPE_MAGIC + record(item(content=None), b'Need news')
+        res = self.post(data + data[4:-2], content_type=ENVELOPE)
+        self.assertEqual(res['saved'], 1)
+        self.assertEqual(res['results'][1],
+                         {'index': 1, 'status': 'rejected',
+                          'error': 'Unexpected end of batch'})
+
+    def test_invalid_envelope(self):
+        res = self.post(b'foo', content_type=ENVELOPE)
+        self.assertEqual(res['results'], [{'index': 0, 'status': 'rejected',
+                                           'error': 'Invalid envelope'}])
+
+    @patch('rh.api.MAX_CONTENT_SIZE', 4)
+    def test_envelope_content_too_large(self):
+        header = item(content=None)
+        data = (ENVELOPE_MAGIC + record(header, b'Need news') +
+                record(header, b'News'))
+        res = self.post(data, content_type=ENVELOPE)
+        self.assertEqual([r['status'] for r in res['results']],
+                         ['rejected', 'saved'])
+
+    def test_duplicates(self):
+        """ Should link duplicates to the stored request """
+        res = self.post(ndjson(item(), item('need news about the world cup!')))
+        self.assertEqual(res['results'][1]['status'], 'duplicate')
+        self.assertEqual(res['results'][1]['id'], res['results'][0]['id'])
+        self.assertEqual(Request.query().count(), 1)
+
+    def test_repost(self):
+        """ Should not store requests with source ids again """
+        data = ndjson(item(source_id='sms-1'), item('Need weather',
+                                                    source_id='sms-2'))
+        first = self.post(data)
+        second = self.post(data)
+        self.assertEqual(second['duplicate'], 2)
+        self.assertEqual([r['id'] for r in first['results']],
+                         [r['id'] for r in second['results']])
+        self.assertEqual(Request.query().count(), 2)
+
+    def test_repost_keeps_edits(self):
+        """ Should not overwrite requests edited since they were posted """
+        data = ndjson(item(source_id='sms-1'))
+        first = self.post(data)
+        r = ndb.Key(Request, first['results'][0]['id']).get()
+        r.set_content(text_content='Need news about the World Cup final')
+        r.suggest_url('http://example.com/')
+        r.put()
+        second = self.post(data)
+        self.assertEqual(second['results'][0]['status'], 'duplicate')
+        r = r.key.get()
+        self.assertEqual(r.text_content, 'Need news about the World Cup final')
+        self.assertEqual(r.revision_count, 2)
+        self.assertEqual(len(r.content_suggestions), 1)
+
+    @patch('rh.api.CHUNK_SIZE', 2)
+    def test_chunks(self):
+        """ Should store requests in chunks """
+        items = [item('Need news %s' % i) for i in range(5)]
+        dedup = RequestFingerprint.deduplicate
+        with patch.object(RequestFingerprint, 'deduplicate',
+                          side_effect=dedup) as deduplicate:
+            res = self.post(ndjson(*items))
+            self.assertEqual(deduplicate.call_count, 3)
+        self.assertEqual(res['saved'], 5)
+
+    @patch('rh.api.MAX_ITEMS', 2)
+    def test_too_many_items(self):
+        items = [item('Need news %s' % i) for i in range(4)]
+        res = self.post(ndjson(*items))
+        self.assertEqual(res['saved'], 2)
+        self.assertEqual(res['results'][2]['error'],
+                         'Too many requests in batch')
+        self.assertEqual(len(res['results']), 3)
+
+
+    @patch('rh.api.defer_backlog')
+    def test_rate_limit(self, defer_backlog):
+        """ Should queue requests over the adaptor's rate limit """
+        self.adaptor.burst = 2
+        self.adaptor.put()
+        items = [item('Need news %s' % i) for i in range(3)]
+        res = self.post(ndjson(*items))
+        self.assertEqual((res['saved'], res['queued']), (2, 1))
+        self.assertEqual(res['results'][2], {'index': 2, 'status': 'queued'})
+        backlog = defer_backlog.call_args[0][1]
+        self.assertEqual([r.raw_content for r in backlog], ['Need news 2'])
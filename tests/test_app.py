@@ -0,0 +1,112 @@
+import os
+import sys
+import subprocess
+from unittest import TestCase
+
+from mock import Mock
+from flask import Flask
+from utils import import_object
+from utils.routes import Route, METHODS, POST_ALIASES
+
+from app.lazy import LazyView, register_lazy
+from app.profiler import ImportProfiler
+from app.urls import ROUTES
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SCRIPT = """
+import sys
+import app.main
+print(','.join(sorted(sys.modules)))
+"""
+
+
+class LazyRoutesTestCase(TestCase):
+    """ Tests related to lazily loaded routes """
+
+    def test_routes_match_route_classes(self):
+        """ Route list should match paths, names and methods of routes """
+        for spec in ROUTES:
+            route = import_object(spec['route'])
+            methods = set(m in POST_ALIASES and 'POST' or m
+                          for m in METHODS if hasattr(route, m))
+            self.assertEqual(spec['path'], route.path)
+            self.assertEqual(spec['endpoint'], route.get_route_name())
+            self.assertEqual(set(spec['methods']), methods, spec['route'])
+
+    def test_all_routes_listed(self):
+        """ Route list should include all routes of listed modules """
+        listed = set(spec['route'] for spec in ROUTES)
+        for name in set(r.rsplit('.', 1)[0] for r in listed):
+            __import__(name)
+            for attr, obj in vars(sys.modules[name]).items():
+                if isinstance(obj, type) and issubclass(obj, Route) and \
+                        obj.path and obj.__module__ == name:
+                    self.assertTrue('%s.%s' % (name, attr) in listed,
+                                    '%s.%s is not listed' % (name, attr))
+
+    def test_loads_on_first_call(self):
+        """ Should import the route class and call its view only once """
+        app = Flask(__name__)
+        register_lazy(app, [{'route': 'app.pages.Homepage', 'path': '/',
+                             'endpoint': 'homepage', 'methods': ['GET']}])
+        view = app.view_functions['homepage']
+        self.assertTrue(isinstance(view, LazyView))
+        self.assertEqual(view.view, None)
+        with app.test_request_context('/'):
+            view.load()
+            loaded = view.view
+            view.load()
+        self.assertTrue(callable(loaded))
+        self.assertEqual(view.view, loaded)
+
+    def test_url_for_unloaded_routes(self):
+        """ Should build URLs for routes that were not loaded yet """
+        from app.main import app
+        with app.test_request_context('/'):
+            from flask import url_for
+            self.assertEqual(url_for('rqm_webui_proof', request_id=1),
+                             '/requests/1/proof')
+
+    def test_startup_imports(self):
+        """ Should not import route modules or their libraries at startup """
+        out = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT],
+                                      cwd=PROJECT_DIR)
+        modules = set(out.strip().split(','))
+        for module in ['facebook', 'babel', 'rh.db', 'cds.webui',
+                       'ra.email', 'rqm.languages']:
+            self.assertFalse(module in modules,
+                             '%s imported at startup' % module)
+
+
+class ImportProfilerTestCase(TestCase):
+    """ Tests related to the startup profiler """
+
+    def test_records_imports(self):
+        """ Should record newly imported modules """
+        sys.modules.pop('wave', None)
+        p = ImportProfiler()
+        p.start()
+        try:
+            import wave
+        finally:
+            p.stop()
+        self.assertEqual([c.name for c in p.root.children], ['wave'])
+        self.assertTrue('wave' in p.format(threshold=0))
+
+    def test_skips_loaded_modules(self):
+        """ Should not record imports of already loaded modules """
+        p = ImportProfiler()
+        p.start()
+        try:
+            import os
+        finally:
+            p.stop()
+        self.assertEqual(p.root.children, [])
+
+    def test_resolve_relative(self):
+        g = {'__name__': 'rqm.forms', '__package__': 'rqm'}
+        self.assertEqual(ImportProfiler.resolve('languages', g, 1),
+                         'rqm.languages')
+        self.assertEqual(ImportProfiler.resolve('', g, 1), 'rqm')
+        self.assertEqual(ImportProfiler.resolve('rh.db', g, 0), 'rh.db')
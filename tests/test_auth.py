@@ -0,0 +1,121 @@
+import datetime
+
+from mock import patch
+from google.appengine.api import memcache
+
+from rh import auth
+from rh.auth import authenticate
+from rh.db import RemoteAdaptor
+from rh.keys import hash_api_key
+
+from tests.dbunit import DatastoreTestCase
+
+
+class AuthenticateTestCase(DatastoreTestCase):
+    """ Tests related to API key authentication """
+
+    def setUp(self):
+        super(AuthenticateTestCase, self).setUp()
+        auth._entries.clear()
+        auth._stats.clear()
+        self.adaptor = RemoteAdaptor(name='sms-gateway', source='sms',
+                                     contact='foo@example.com')
+        self.adaptor.put()
+
+    def test_authenticate(self):
+        found = authenticate(self.adaptor.api_key)
+        self.assertEqual(found.key, self.adaptor.key)
+        self.assertEqual(authenticate('ra_bogus'), None)
+
+    def test_warm_path(self):
+        """ Should not use memcache or datastore for keys cached locally """
+        authenticate(self.adaptor.api_key)
+        with patch.object(RemoteAdaptor, 'query') as query:
+            with patch.object(memcache, 'get') as get:
+                found = authenticate(self.adaptor.api_key)
+                self.assertFalse(get.called)
+            self.assertFalse(query.called)
+        self.assertEqual(found.key, self.adaptor.key)
+        self.assertEqual(auth._stats['hits'], 1)
+
+    def test_memcache(self):
+        """ Should not query the datastore for keys cached in memcache """
+        authenticate(self.adaptor.api_key)
+        auth._entries.clear()
+        with patch.object(RemoteAdaptor, 'query') as query:
+            found = authenticate(self.adaptor.api_key)
+            self.assertFalse(query.called)
+        self.assertEqual(found.key, self.adaptor.key)
+        self.assertEqual(auth._stats['memcache_hits'], 1)
+
+    def test_raw_key_not_cached(self):
+        authenticate(self.adaptor.api_key)
+        key = auth.CACHE_PREFIX + hash_api_key(self.adaptor.api_key)[:32]
+        self.assertEqual(memcache.get(key), self.adaptor.key.urlsafe())
+        self.assertEqual(memcache.get(self.adaptor.api_key), None)
+
+    def test_negative_cache(self):
+        """ Should not query the datastore again for bad keys """
+        authenticate('ra_bogus')
+        with patch.object(RemoteAdaptor, 'query') as query:
+            self.assertEqual(authenticate('ra_bogus'), None)
+            auth._entries.clear()
+            self.assertEqual(authenticate('ra_bogus'), None)
+            self.assertFalse(query.called)
+
+    def test_new_adaptor_forgets_negative(self):
+        """ Should accept key that was cached as bad once it is stored """
+        adaptor = RemoteAdaptor(name='foo', source='bar', contact='baz',
+                                api_key='ra_new')
+        self.assertEqual(authenticate('ra_new'), None)
+        adaptor.put()
+        self.assertEqual(authenticate('ra_new').key, adaptor.key)
+
+    def test_digest_mismatch(self):
+        """ Should not accept key whose digest only shares cache key prefix """
+        authenticate(self.adaptor.api_key)
+        with patch('rh.auth.cache_key', lambda digest: 'same'):
+            authenticate(self.adaptor.api_key)
+            self.assertEqual(authenticate('ra_bogus'), None)
+
+    def test_put_keeps_key(self):
+        authenticate(self.adaptor.api_key)
+        self.adaptor.contact = 'bar@example.com'
+        self.adaptor.put()
+        self.assertEqual(authenticate(self.adaptor.api_key).key,
+                         self.adaptor.key)
+
+    def test_rotation_overlap(self):
+        """ Should accept both keys during overlap, and only new one after """
+        old_key = self.adaptor.api_key
+        authenticate(old_key)
+        self.adaptor.rotate_key(datetime.timedelta(minutes=5))
+        self.adaptor.put()
+        self.assertEqual(authenticate(old_key).key, self.adaptor.key)
+        self.assertEqual(authenticate(self.adaptor.api_key).key,
+                         self.adaptor.key)
+        later = datetime.datetime.utcnow() + datetime.timedelta(minutes=6)
+        with patch('rh.auth.datetime.datetime') as dt:
+            dt.utcnow.return_value = later
+            self.assertEqual(authenticate(old_key), None)
+            self.assertEqual(authenticate(self.adaptor.api_key).key,
+                             self.adaptor.key)
+
+    def test_rotation_without_overlap(self):
+        old_key = self.adaptor.api_key
+        authenticate(old_key)
+        self.adaptor.rotate_key(None)
+        self.adaptor.put()
+        self.assertEqual(authenticate(old_key), None)
+
+    @patch('rh.auth.LOCAL_TTL', 0)
+    def test_local_expiry(self):
+        """ Should revalidate locally cached entries after they expire """
+        old_key = self.adaptor.api_key
+        authenticate(old_key)
+        # Rotated on another instance
+        adaptor = self.adaptor.key.get(use_cache=False)
+        adaptor.rotate_key(None)
+        adaptor.put()
+        self.assertEqual(authenticate(old_key), None)
+
@@ -0,0 +1,102 @@
+import threading
+
+from mock import Mock, patch
+from flask import Flask, g, render_template_string
+from google.appengine.api import memcache
+
+from rh import cache
+from rh.cache import get_or_set, fragment_key, cached_fragment, get_stats
+
+from tests.dbunit import DatastoreTestCase
+from tests.test_models import RequestFactoryMixin
+
+
+class CacheTestCase(RequestFactoryMixin, DatastoreTestCase):
+    """ Tests related to read-through cache """
+
+    def setUp(self):
+        super(CacheTestCase, self).setUp()
+        cache._stats.clear()
+
+    def test_read_through(self):
+        """ Should only generate missing values """
+        generate = Mock(return_value='foo')
+        self.assertEqual(get_or_set('key', generate), 'foo')
+        self.assertEqual(get_or_set('key', generate), 'foo')
+        generate.assert_called_once_with()
+        self.assertEqual(cache._stats['hits'], 1)
+        self.assertEqual(cache._stats['misses'], 1)
+
+    def test_lock_released(self):
+        """ Should release the lock if generating fails """
+        generate = Mock(side_effect=ValueError)
+        with self.assertRaises(ValueError):
+            get_or_set('key', generate)
+        self.assertEqual(memcache.get('cache:key:lock'), None)
+
+    @patch('rh.cache.LOCK_WAIT', 0.01)
+    def test_waits_for_regeneration(self):
+        """ Should wait for value generated by another request """
+        memcache.add('cache:key:lock', 1)
+        generate = Mock(return_value='bar')
+
+        def set_value():
+            memcache.set('cache:key', 'foo')
+        t = threading.Timer(0.02, set_value)
+        t.start()
+        self.assertEqual(get_or_set('key', generate), 'foo')
+        self.assertFalse(generate.called)
+        self.assertEqual(cache._stats['waits'], 1)
+
+    @patch('rh.cache.LOCK_WAIT', 0)
+    def test_lock_wait_timeout(self):
+        """ Should generate the value without caching it if wait times out """
+        memcache.add('cache:key:lock', 1)
+        self.assertEqual(get_or_set('key', lambda: 'bar'), 'bar')
+        self.assertEqual(memcache.get('cache:key'), None)
+
+    def test_stampede(self):
+        """ Should only generate once when requested concurrently """
+        calls = []
+
+        def generate():
+            calls.append(1)
+            threading.Event().wait(0.05)
+            return 'foo'
+        threads = [threading.Thread(target=get_or_set, args=('key', generate))
+                   for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_fragment_key_version(self):
+        """ Should use a new key when a new version is stored """
+        r = self.request()
+        r.put()
+        k1 = fragment_key('foo', r)
+        r.put()
+        self.assertNotEqual(k1, fragment_key('foo', r))
+
+    def test_cached_fragment(self):
+        """ Should cache fragments and replace CSRF tokens """
+        r = self.request()
+        r.put()
+        app = Flask(__name__)
+        app.jinja_env.globals['cached_fragment'] = cached_fragment
+        tpl = ("{% call cached_fragment('foo', req) %}"
+               "{{ counter() }} {{ g.csrf_token }}{% endcall %}")
+        counter = iter(range(10)).next
+        with app.test_request_context('/'):
+            g.csrf_token = 'token1'
+            first = render_template_string(tpl, req=r, counter=counter)
+            g.csrf_token = 'token2'
+            second = render_template_string(tpl, req=r, counter=counter)
+        self.assertEqual(first, '0 token1')
+        self.assertEqual(second, '0 token2')
+
+    def test_stats(self):
+        get_or_set('key', lambda: 'foo')
+        get_or_set('key', lambda: 'foo')
+        self.assertEqual(get_stats()['fragments']['hit_rate'], 0.5)
@@ -1,9 +1,18 @@
+import time
+import datetime
+
 from mock import patch, Mock
+from google.appengine.ext import ndb
+from google.appengine.runtime import DeadlineExceededError
 
-from rh.adaptors import CronJobHandlerMixin
+from rh.adaptors import (CronJobHandlerMixin, Adaptor, AdaptorRegistry,
+                         HarvestJob, HarvestScheduler, defer_chunk)
 from rh.exceptions import RequestDataError
+from rh.db import Request, RequestBlob, RequestFingerprint, Revision
+from rh.requests import Request as RequestObject
 
 from tests.dbunit import DatastoreTestCase
+from tests.test_models import RequestFactoryMixin
 
 
 class CronHandlerTestCase(DatastoreTestCase):
@@ -43,7 +52,7 @@ class CronHandlerTestCase(DatastoreTestCase):
         CronJobHandlerMixin.adaptor_class = self.Adaptor
         c = CronJobHandlerMixin()
         c.run_job()
-        self.logging.exception.assert_called_once_with(
+        self.logging.error.assert_called_once_with(
             'Error processing request: foo')
 
     def test_logs_on_missing_class(self):
@@ -52,9 +61,10 @@ class CronHandlerTestCase(DatastoreTestCase):
         c.run_job()
         self.logging.error.assert_called_once()
 
-    @patch('rh.adaptors.ndb.put_multi')
+    @patch('rh.adaptors.ndb.put_multi_async')
     def test_put_good_requests(self, pm):
         """ Should put() only good requests """
+        pm.side_effect = self.futures
         requests = [self.bad_request, self.good_request, self.good_request]
         self.adaptor.get_requests.return_value = requests
         CronJobHandlerMixin.adaptor_class = self.Adaptor
@@ -65,6 +75,115 @@ class CronHandlerTestCase(DatastoreTestCase):
             self.good_request.prepare.return_value
         ])
 
+    @patch('rh.adaptors.ndb.put_multi_async')
+    def test_put_in_chunks(self, pm):
+        """ Should put() requests in chunks """
+        pm.side_effect = self.futures
+        self.adaptor.get_requests.return_value = iter([self.good_request] * 5)
+        CronJobHandlerMixin.adaptor_class = self.Adaptor
+        c = CronJobHandlerMixin()
+        c.chunk_size = 2
+        stats = c.run_job()
+        self.assertEqual([len(a[0][0]) for a in pm.call_args_list], [2, 2, 1])
+        self.assertEqual(stats['fetched'], 5)
+        self.assertEqual(stats['saved'], 5)
+
+    @patch('rh.adaptors.deferred')
+    @patch('rh.adaptors.ndb.put_multi')
+    @patch('rh.adaptors.ndb.put_multi_async')
+    def test_retry_failed_chunk(self, pma, pm, deferred):
+        """ Should retry a failed chunk on its own """
+        pma.side_effect = lambda chunk, **kw: self.futures(chunk, Exception())
+        self.adaptor.get_requests.return_value = [self.good_request] * 3
+        CronJobHandlerMixin.adaptor_class = self.Adaptor
+        c = CronJobHandlerMixin()
+        c.chunk_size = 2
+        stats = c.run_job()
+        self.assertEqual(pm.call_count, 2)
+        self.assertFalse(deferred.defer.called)
+        self.assertEqual(stats['saved'], 3)
+
+    @patch('rh.adaptors.pickle', Mock(dumps=Mock(return_value='')))
+    @patch('rh.adaptors.deferred')
+    @patch('rh.adaptors.ndb.put_multi')
+    @patch('rh.adaptors.ndb.put_multi_async')
+    def test_defer_failed_chunk(self, pma, pm, deferred):
+        """ Should defer a chunk that fails again """
+        pma.side_effect = lambda chunk, **kw: self.futures(chunk, Exception())
+        pm.side_effect = Exception()
+        self.adaptor.get_requests.return_value = [self.good_request] * 3
+        CronJobHandlerMixin.adaptor_class = self.Adaptor
+        c = CronJobHandlerMixin()
+        c.chunk_size = 2
+        stats = c.run_job()
+        self.assertEqual(deferred.defer.call_count, 2)
+        self.assertEqual(stats['deferred'], 3)
+        self.assertEqual(stats['saved'], 0)
+
+    @patch('rh.adaptors.ndb.put_multi_async')
+    def test_high_water_mark(self, pm):
+        """ Should save newest posting time and boundary ids after chunks """
+        pm.side_effect = self.futures
+        requests = []
+        for day, source_id in [(1, 'a'), (3, 'b'), (2, 'c'), (3, 'd')]:
+            r = Mock()
+            r.prepare.return_value.posted = datetime.datetime(2014, 4, day)
+            r.prepare.return_value.source_id = source_id
+            r.prepare.return_value.pop_unsaved.return_value = []
+            requests.append(r)
+        self.adaptor.get_requests.return_value = requests
+        CronJobHandlerMixin.adaptor_class = self.Adaptor
+        c = CronJobHandlerMixin()
+        c.chunk_size = 1
+        c.run_job()
+        history = self.HarvestHistory.get_history.return_value
+        self.assertEqual(history.put.call_count, 4)
+        self.assertEqual(history.high_water, datetime.datetime(2014, 4, 3))
+        self.assertEqual(history.boundary_ids, ['b', 'd'])
+
+    @patch('rh.adaptors.ndb.put_multi_async')
+    def test_skip_seen(self, pm):
+        """ Should skip requests harvested before """
+        pm.side_effect = self.futures
+        history = self.HarvestHistory.get_history.return_value
+        history.high_water = datetime.datetime(2014, 4, 2)
+        history.boundary_ids = ['b']
+        requests = []
+        for day, source_id in [(1, 'a'), (2, 'b'), (2, 'c'), (3, 'd')]:
+            r = Mock()
+            r.posted = datetime.datetime(2014, 4, day)
+            r.source_id = source_id
+            r.prepare.return_value.posted = r.posted
+            r.prepare.return_value.source_id = source_id
+            r.prepare.return_value.pop_unsaved.return_value = []
+            requests.append(r)
+        self.adaptor.get_requests.return_value = requests
+        CronJobHandlerMixin.adaptor_class = self.Adaptor
+        c = CronJobHandlerMixin()
+        stats = c.run_job()
+        pm.assert_called_once_with([requests[2].prepare.return_value,
+                                    requests[3].prepare.return_value])
+        self.assertEqual(stats['skipped'], 2)
+        self.assertEqual(stats['fetched'], 4)
+        # Seen requests are not checked
+        self.assertFalse(requests[0].check.called)
+        self.assertFalse(requests[1].check.called)
+
+    @patch('rh.adaptors.ndb.put_multi_async')
+    def test_deadline_exceeded(self, pm):
+        """ Should stop without recording a completed harvest """
+        def requests():
+            yield self.good_request
+            raise DeadlineExceededError()
+        pm.side_effect = self.futures
+        self.adaptor.get_requests.return_value = requests()
+        CronJobHandlerMixin.adaptor_class = self.Adaptor
+        c = CronJobHandlerMixin()
+        c.chunk_size = 1
+        stats = c.run_job()
+        self.assertTrue(stats['interrupted'])
+        self.assertFalse(self.HarvestHistory.record.called)
+
     def test_logs_number_of_puts(self):
         """ Should log number of successful puts """
         requests = [self.bad_request, self.good_request, self.good_request]
@@ -74,6 +193,79 @@ class CronHandlerTestCase(DatastoreTestCase):
         c.run_job()
         self.logging.info.called_once_with('Saved 2 requests')
 
+    def test_stores_entities(self):
+        """ Should store prepared entities in the datastore """
+        requests = []
+        for i in range(5):
+            r = Mock()
+            r.prepare.return_value = RequestFactoryMixin.request()
+            requests.append(r)
+        self.adaptor.get_requests.return_value = iter(requests)
+        CronJobHandlerMixin.adaptor_class = self.Adaptor
+        c = CronJobHandlerMixin()
+        c.chunk_size = 2
+        c.run_job()
+        self.assertEqual(Request.query().count(), 5)
+
+    def test_stores_blobs_and_revisions_in_batch(self):
+        """ Should store blobs and revisions in the batch of their requests """
+        r = Mock()
+        e = r.prepare.return_value = RequestFactoryMixin.request()
+        e.set_binary_content('foo', 'image/png')
+        e.set_content(text_content='Need news')
+        self.adaptor.get_requests.return_value = [r]
+        CronJobHandlerMixin.adaptor_class = self.Adaptor
+        c = CronJobHandlerMixin()
+        with patch('rh.db.ndb.put_multi') as pm:
+            c.run_job()
+        self.assertFalse(pm.called)
+        self.assertEqual(RequestBlob.query().count(), 1)
+        self.assertEqual(Revision.query(ancestor=e.key).count(), 1)
+
+    @patch('rh.adaptors.deferred')
+    def test_defer_chunk_size(self, deferred):
+        """ Should split deferred chunks to stay within payload limit """
+        blobs = [RequestBlob.from_content(str(i) * 1000, 'image/png')
+                 for i in range(5)]
+        self.assertEqual(defer_chunk(blobs, max_size=2500), 3)
+        self.assertEqual([len(a[0][1]) for a in deferred.defer.call_args_list],
+                         [2, 2, 1])
+
+    def test_links_duplicates(self):
+        """ Should not store requests whose content was already stored """
+        self.RequestFingerprint.deduplicate.side_effect = \
+            RequestFingerprint.deduplicate
+        requests = []
+        for fingerprint in ['foo', 'foo', 'bar', 'foo']:
+            r = Mock()
+            e = r.prepare.return_value = RequestFactoryMixin.request()
+            e.fingerprint = fingerprint
+            requests.append(r)
+        self.adaptor.get_requests.return_value = iter(requests)
+        CronJobHandlerMixin.adaptor_class = self.Adaptor
+        c = CronJobHandlerMixin()
+        c.chunk_size = 2
+        stats = c.run_job()
+        self.assertEqual(Request.query().count(), 2)
+        self.assertEqual(stats['saved'], 2)
+        self.assertEqual(stats['duplicates'], 2)
+        f = RequestFingerprint.get_by_id('foo')
+        self.assertEqual(f.duplicates, 2)
+        self.assertEqual(f.request, requests[0].prepare.return_value.key)
+
+    @staticmethod
+    def futures(entities, exception=None, **kwargs):
+        """ Return completed futures for a put_multi_async() call """
+        futures = []
+        for e in entities:
+            f = ndb.Future()
+            if exception:
+                f.set_exception(exception)
+            else:
+                f.set_result(None)
+            futures.append(f)
+        return futures
+
     @patch('rh.adaptors.Response')
     def test_ok_method(self, Resp):
         """ Should return response object with content of 'OK' and 200 code """
@@ -98,6 +290,12 @@ class CronHandlerTestCase(DatastoreTestCase):
 
         # Create request, adaptor object, and adaptor class mocks
         self.good_request = Mock(name='good_request')
+        entity = self.good_request.prepare.return_value
+        entity.posted = datetime.datetime(2014, 4, 1)
+        entity.source_id = None
+        entity.pop_unsaved.return_value = []
+        self.good_request.posted = entity.posted
+        self.good_request.source_id = None
         self.bad_request = Mock(name='bad_request')
         self.bad_request.check.side_effect = se
         mock_adaptor = Mock(name='adaptor')
@@ -109,6 +307,14 @@ class CronHandlerTestCase(DatastoreTestCase):
         # Patch the harvest history model
         self.hh_patcher = patch('rh.adaptors.HarvestHistory')
         self.HarvestHistory = self.hh_patcher.start()
+        history = self.HarvestHistory.get_history.return_value
+        history.high_water = None
+        history.boundary_ids = []
+
+        # Patch the fingerprint model (all requests are unique by default)
+        self.fp_patcher = patch('rh.adaptors.RequestFingerprint')
+        self.RequestFingerprint = self.fp_patcher.start()
+        self.RequestFingerprint.deduplicate.side_effect = lambda c: (c, [])
 
         # Patch the logger
         self.logging_patcher = patch('rh.adaptors.logging')
@@ -118,6 +324,120 @@ class CronHandlerTestCase(DatastoreTestCase):
 
     def tearDown(self):
         self.hh_patcher.stop()
+        self.fp_patcher.stop()
         self.logging_patcher.stop()
         super(CronHandlerTestCase, self).tearDown()
 
+
+
+class ReharvestTestCase(DatastoreTestCase):
+    """ Test harvesting items that were already stored """
+
+    def test_keeps_edits(self):
+        """ Should not overwrite a stored request when it is harvested again """
+        def get_requests(self, last_run):
+            return [RequestObject(
+                adaptor=self, content='Need news',
+                timestamp=datetime.datetime(2014, 4, 1),
+                world=RequestObject.ONLINE,
+                content_format=RequestObject.TEXT, source_id='p1')]
+        job = HarvestJob()
+        job.adaptor_class = type(str('foo'), (Adaptor,), {
+            'name': 'foo', 'source': 'foo', 'get_requests': get_requests})
+        job.run_job()
+        r = Request.query().get()
+        r.suggest_url('http://example.com/')
+        r.set_content(text_content='Need news about weather')
+        r.put()
+        # Harvest the item again, as if the high-water mark was lost
+        ndb.Key('HarvestHistory', 'foo').delete()
+        stats = job.run_job()
+        self.assertEqual(stats['saved'], 0)
+        r = r.key.get()
+        self.assertEqual(r.revision_count, 2)
+        self.assertEqual(r.version, 2)
+        self.assertEqual(r.text_content, 'Need news about weather')
+        self.assertEqual(len(r.content_suggestions), 1)
+
+
+class HarvestSchedulerTestCase(DatastoreTestCase):
+    """ Test concurrent harvesting using multiple adaptors """
+
+    def adaptor_class(self, name, delay=0, deadline=5, error=None):
+        """ Build an adaptor class that takes ``delay`` seconds to harvest """
+        def get_requests(self, last_run):
+            time.sleep(delay)
+            if error:
+                raise error
+            return []
+        return type(str(name), (Adaptor,), {
+            'name': name,
+            'source': name,
+            'deadline': deadline,
+            'get_requests': get_requests,
+        })
+
+    def test_registry(self):
+        """ Should register adaptor classes by name """
+        registry = AdaptorRegistry()
+        a = registry.register(self.adaptor_class('foo'))
+        self.assertEqual(registry.get('foo'), a)
+        self.assertEqual(list(registry), [a])
+
+    def test_harvests_all_adaptors(self):
+        """ Should run a harvest for each adaptor and report stats """
+        s = HarvestScheduler([self.adaptor_class('foo'),
+                              self.adaptor_class('bar')])
+        report = s.run()
+        self.assertEqual([r['adaptor'] for r in report], ['foo', 'bar'])
+        self.assertEqual([r['status'] for r in report], ['ok', 'ok'])
+        self.assertEqual(report[0]['saved'], 0)
+        self.assertTrue('time' in report[0])
+
+    def test_runs_concurrently(self):
+        """ Should run harvests in parallel """
+        adaptors = [self.adaptor_class('a%s' % i, delay=0.2)
+                    for i in range(5)]
+        start = time.time()
+        HarvestScheduler(adaptors).run()
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_deadline(self):
+        """ Should not wait for a slow adaptor beyond its deadline """
+        s = HarvestScheduler([self.adaptor_class('slow', 1, deadline=0.1),
+                              self.adaptor_class('fast')])
+        start = time.time()
+        report = s.run()
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual([r['status'] for r in report], ['timeout', 'ok'])
+
+    @patch('rh.adaptors.logging')
+    def test_stops_at_deadline(self, logging):
+        """ Should stop a job between chunks once its deadline has passed """
+        def get_requests(self, last_run):
+            for i in range(20):
+                time.sleep(0.02)
+                yield RequestObject(
+                    adaptor=self, content='Need news %s' % i,
+                    timestamp=datetime.datetime(2014, 4, 1, 0, i),
+                    world=RequestObject.ONLINE,
+                    content_format=RequestObject.TEXT, source_id='p%s' % i)
+        job = HarvestJob()
+        job.adaptor_class = type(str('slow'), (Adaptor,), {
+            'name': 'slow', 'source': 'slow', 'get_requests': get_requests})
+        job.chunk_size = 2
+        job.stop_at = time.time() + 0.1
+        stats = job.run_job()
+        self.assertTrue(stats['interrupted'])
+        self.assertTrue(stats['fetched'] < 20)
+        # Chunks fetched before the deadline are stored
+        self.assertEqual(stats['saved'], stats['fetched'])
+        self.assertEqual(Request.query().count(), stats['saved'])
+
+    @patch('rh.adaptors.logging')
+    def test_error(self, logging):
+        """ Should report failed harvests without affecting others """
+        s = HarvestScheduler([self.adaptor_class('bad', error=ValueError()),
+                              self.adaptor_class('good')])
+        report = s.run()
+        self.assertEqual([r['status'] for r in report], ['error', 'ok'])
@@ -0,0 +1,135 @@
+import json
+import base64
+
+from mock import patch
+from flask import Flask
+from google.appengine.ext import ndb
+
+from ra.email import OuternetEmailAdaptor, EmailHook
+from rh.db import Request as RequestModel
+from rh.requests import Request
+
+from tests.dbunit import DatastoreTestCase
+from tests.test_request import TEST_IMAGE_BIN, TEST_IMAGE_B64
+
+
+def attachment(name, content=TEST_IMAGE_B64, mimetype='image/png',
+               encoded=True):
+    return {'name': name, 'type': mimetype, 'content': content,
+            'base64': encoded}
+
+
+def event(text='Need news', attachments=(), images=(), message_id='<1@x>'):
+    return {'ts': 1396353600, 'msg': {
+        'text': text,
+        'from_email': 'foo@example.com',
+        'headers': {'Message-Id': message_id},
+        'attachments': dict((a['name'], a) for a in attachments),
+        'images': dict((a['name'], a) for a in images),
+    }}
+
+
+class EmailAdaptorTestCase(DatastoreTestCase):
+    """ Tests related to requests from email messages """
+
+    def setUp(self):
+        super(EmailAdaptorTestCase, self).setUp()
+        self.app = Flask(__name__)
+        self.app.config.update(EML_API_ID='id', EML_API_KEY='key',
+                               EML_API_SIGNATURE='sig')
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+        super(EmailAdaptorTestCase, self).tearDown()
+
+    def get_requests(self, *events):
+        adaptor = OuternetEmailAdaptor(json.dumps(events))
+        return list(adaptor.get_requests())
+
+    def test_text(self):
+        requests = self.get_requests(event())
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0].raw_content, 'Need news')
+        self.assertEqual(requests[0].source_id, '<1@x>')
+        self.assertEqual(requests[0].sender, 'foo@example.com')
+
+    def test_attachments(self):
+        """ Should turn image attachments and inline images into requests """
+        requests = self.get_requests(event(
+            attachments=[attachment('b.png'),
+                         attachment('doc.pdf', mimetype='application/pdf')],
+            images=[attachment('a.png')]))
+        self.assertEqual([r.content_format for r in requests],
+                         [Request.TEXT, Request.PNG, Request.PNG])
+        self.assertEqual([r.source_id for r in requests[1:]],
+                         ['<1@x>:0:a.png', '<1@x>:1:b.png'])
+        image = requests[1].check()
+        self.assertEqual(image.content_type, Request.NONTRANSCRIBED)
+        self.assertEqual(image.processed_content, TEST_IMAGE_BIN)
+
+    def test_attachment_only(self):
+        """ Should not create text requests for empty message body """
+        requests = self.get_requests(event(text=' \n',
+                                           attachments=[attachment('a.png')]))
+        self.assertEqual([r.content_format for r in requests], [Request.PNG])
+
+    def test_mime_encoded(self):
+        """ Should decode attachments with line breaks """
+        encoded = base64.encodestring(TEST_IMAGE_BIN)
+        requests = self.get_requests(event(
+            attachments=[attachment('a.png', encoded)]))
+        self.assertEqual(requests[1].raw_content, TEST_IMAGE_BIN)
+
+    @patch('ra.email.MAX_ATTACHMENT_SIZE', 100)
+    def test_attachment_too_large(self):
+        """ Should skip attachments larger than the size limit """
+        requests = self.get_requests(event(attachments=[
+            attachment('a.png', base64.b64encode('x' * 99)),
+            attachment('b.png', base64.b64encode('x' * 102))]))
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[1].raw_content, 'x' * 99)
+
+    def test_same_attachment_names(self):
+        """ Attachments with the same name should have different ids """
+        requests = self.get_requests(event(
+            attachments=[attachment('image.png')],
+            images=[attachment('image.png')]))
+        self.assertEqual([r.source_id for r in requests[1:]],
+                         ['<1@x>:0:image.png', '<1@x>:1:image.png'])
+
+    def test_invalid_attachments(self):
+        requests = self.get_requests(event(attachments=[
+            attachment('a.png', 'abc'),
+            attachment('b.png', 'not base64', encoded=False)]))
+        self.assertEqual(len(requests), 1)
+
+    @patch('ra.email.MAX_ATTACHMENTS', 1)
+    def test_attachment_count(self):
+        requests = self.get_requests(event(
+            attachments=[attachment('a.png'), attachment('b.png')]))
+        self.assertEqual(len(requests), 2)
+
+    @patch('ra.email.CHUNK_BYTES', 2 * len(TEST_IMAGE_BIN))
+    def test_chunks(self):
+        """ Should limit chunks by size of content """
+        requests = self.get_requests(event(attachments=[
+            attachment('%s.png' % i) for i in range(5)]))
+        chunks = list(EmailHook.chunk_requests(requests))
+        self.assertEqual([len(c) for c in chunks], [3, 2, 1])
+
+    def test_store(self):
+        """ Should store text and image requests """
+        adaptor = OuternetEmailAdaptor(json.dumps([event(
+            attachments=[attachment('a.png')])]))
+        hook = EmailHook.__new__(EmailHook)
+        with patch.object(EmailHook, 'log', create=True):
+            with patch.object(ndb, 'put_multi', wraps=ndb.put_multi) as put:
+                for chunk in hook.chunk_requests(adaptor.get_requests()):
+                    hook.store_chunk(adaptor, chunk)
+        self.assertEqual(put.call_count, 1)
+        self.assertEqual(RequestModel.query().count(), 2)
+        image = RequestModel.query(
+            RequestModel.content_type == Request.NONTRANSCRIBED).get()
+        self.assertEqual(image.get_binary_content(), TEST_IMAGE_BIN)
@@ -0,0 +1,139 @@
+from mock import Mock, patch
+from google.appengine.api import images
+
+from rh import imaging
+from rh.imaging import derive_images, resize, ImagingError
+from rh.db import Request as RequestModel, RequestBlob
+from rh.requests import Request
+from rh.exceptions import RequestDataError
+
+from tests.dbunit import DatastoreTestCase
+from tests.test_request import RequestTestMixin, TEST_IMAGE_B64
+
+
+def fake_resize(data, width, height, output_encoding, quality):
+    return 'resized %s to %s' % (data[:10], width)
+
+
+def sized_resize(data, width, height, output_encoding, quality):
+    return 'x' * width
+
+
+def image_size(width, height):
+    img = Mock()
+    img.width = width
+    img.height = height
+    return Mock(return_value=img)
+
+
+@patch.object(images, 'resize', fake_resize)
+class DeriveImagesTestCase(DatastoreTestCase):
+    """ Tests related to image derivatives """
+
+    @patch.object(images, 'Image', image_size(3264, 2448))
+    def test_large_image(self):
+        """ Should cap the master, and derive smaller sizes from it """
+        d = derive_images('photo data', Request.JPG)
+        self.assertEqual(d['master'], ('resized photo data to 1600',
+                                       Request.JPG))
+        self.assertEqual(d['preview'], ('resized resized ph to 640',
+                                        Request.JPG))
+        self.assertEqual(d['thumbnail'], ('resized resized re to 160',
+                                          Request.JPG))
+
+    @patch.object(images, 'Image', image_size(300, 200))
+    def test_small_image(self):
+        """ Should not enlarge images, and keep posted image if smaller """
+        data = 'x' * 10
+        d = derive_images(data, Request.GIF)
+        self.assertEqual(d['master'], (data, Request.GIF))
+        self.assertEqual(d['preview'], d['master'])
+        self.assertEqual(d['thumbnail'][0], 'resized xxxxxxxxxx to 160')
+        self.assertEqual(d['thumbnail'][1], Request.PNG)
+
+    @patch.object(images, 'Image', image_size(300, 200))
+    def test_recompressed(self):
+        """ Should replace images within the size if recompressing helps """
+        data = 'x' * 1000
+        self.assertEqual(derive_images(data, Request.PNG)['master'],
+                         ('resized xxxxxxxxxx to 300', Request.PNG))
+
+    @patch.object(images, 'Image', image_size(3264, 2448))
+    @patch('rh.imaging.MAX_BLOB_SIZE', 1000)
+    def test_master_fits_blob(self):
+        """ Should resize the master further until it fits in a blob """
+        with patch.object(images, 'resize', sized_resize):
+            d = derive_images('photo data', Request.JPG)
+        self.assertEqual(len(d['master'][0]), 900)
+        self.assertEqual(len(d['preview'][0]), 640)
+
+    @patch.object(images, 'Image', image_size(3264, 2448))
+    @patch('rh.imaging.MAX_BLOB_SIZE', 500)
+    def test_master_too_large(self):
+        """ Should not derive sizes if the master cannot fit in a blob """
+        with patch.object(images, 'resize', sized_resize):
+            self.assertEqual(derive_images('photo data', Request.JPG), {})
+
+    @patch.object(images, 'Image', image_size(3264, 2448))
+    def test_resize_error(self):
+        with patch('rh.imaging.resize', side_effect=ImagingError):
+            self.assertEqual(derive_images('photo data', Request.JPG), {})
+
+
+class ResizeTestCase(DatastoreTestCase):
+    """ Tests related to resizing using Images API or PIL """
+
+    def test_pil_fallback(self):
+        """ Should use PIL if Images API is not available """
+        with patch.object(images, 'resize', side_effect=AssertionError):
+            with patch('rh.imaging.resize_pil') as resize_pil:
+                resize('data', 160, images.JPEG, 70)
+                resize_pil.assert_called_once_with('data', 160, 'JPEG', 70)
+
+    @patch('rh.imaging.PILImage', None)
+    def test_unavailable(self):
+        with patch.object(images, 'resize', side_effect=AssertionError):
+            with self.assertRaises(ImagingError):
+                resize('data', 160, images.PNG, 70)
+
+    def test_bad_image(self):
+        with patch.object(images, 'resize', side_effect=images.BadImageError):
+            with self.assertRaises(ImagingError):
+                resize('data', 160, images.PNG, 70)
+
+
+class StoreDerivativesTestCase(RequestTestMixin, DatastoreTestCase):
+    """ Tests related to storing image derivatives """
+
+    @patch('rh.requests.derive_images')
+    def test_store(self, derive):
+        derive.return_value = {
+            'master': ('master', Request.PNG),
+            'preview': ('master', Request.PNG),
+            'thumbnail': ('thumb', Request.PNG),
+        }
+        r = self.request(content=TEST_IMAGE_B64, content_format=Request.PNG)
+        r.check()
+        e = r.prepare()
+        e.put()
+        self.assertEqual(e.get_binary_content(), 'master')
+        self.assertEqual(e.preview, e.blob)
+        self.assertEqual(e.thumbnail.get().content, 'thumb')
+        self.assertEqual(RequestBlob.query().count(), 2)
+
+    def test_not_derived(self):
+        """ Should store the posted image if it cannot be resized """
+        r = self.request(content=TEST_IMAGE_B64, content_format=Request.PNG)
+        with patch('rh.requests.derive_images', return_value={}):
+            r.check()
+        e = r.prepare()
+        self.assertEqual(e.blob.id(), r.fingerprint)
+        self.assertEqual(e.thumbnail, None)
+
+    @patch('rh.requests.MAX_BLOB_SIZE', 100)
+    def test_not_derived_too_large(self):
+        """ Should reject images that cannot be stored as posted """
+        r = self.request(content=TEST_IMAGE_B64, content_format=Request.PNG)
+        with patch('rh.requests.derive_images', return_value={}):
+            with self.assertRaises(RequestDataError):
+                r.check()
@@ -2,7 +2,8 @@ from unittest import TestCase
 
 from mock import patch
 
-from rh.keys import generate_api_key
+from rh.keys import (generate_api_key, generate_request_id, REQUEST_ID_BASE,
+                     hash_api_key, constant_time_compare, _compare_digest)
 
 
 class KeygenTestCase(TestCase):
@@ -20,3 +21,35 @@ class KeygenTestCase(TestCase):
             s = generate_api_key('pfx')
             self.assertEqual(s, 'pfx_86f7e437faa5a7fce15d')
 
+
+
+class RequestIdTestCase(TestCase):
+    """ Tests related to request id generation """
+
+    def test_deterministic(self):
+        """ Should generate the same id for the same source item """
+        self.assertEqual(generate_request_id('foo', '123'),
+                         generate_request_id('foo', '123'))
+
+    def test_unique_per_adaptor(self):
+        """ Should generate different ids for different adaptors """
+        self.assertNotEqual(generate_request_id('foo', '123'),
+                            generate_request_id('bar', '123'))
+
+    def test_range(self):
+        """ Should generate ids above allocated id range """
+        self.assertTrue(generate_request_id('foo', '123') >= REQUEST_ID_BASE)
+
+
+class KeyHashTestCase(TestCase):
+    """ Tests related to API key hashing """
+
+    def test_hash(self):
+        self.assertEqual(len(hash_api_key('ra_foo')), 64)
+        self.assertNotEqual(hash_api_key('ra_foo'), hash_api_key('ra_bar'))
+
+    def test_compare(self):
+        for compare in (constant_time_compare, _compare_digest):
+            self.assertTrue(compare('abc', 'abc'))
+            self.assertFalse(compare('abc', 'abd'))
+            self.assertFalse(compare('abc', 'ab'))
@@ -0,0 +1,50 @@
+from mock import patch
+from google.appengine.api import memcache
+
+from rqm import languages
+from rqm.languages import build_languages, get_languages, CACHE_KEY
+
+from tests.dbunit import DatastoreTestCase
+
+
+class LanguagesTestCase(DatastoreTestCase):
+    """ Tests related to RQM language table """
+
+    def setUp(self):
+        super(LanguagesTestCase, self).setUp()
+        self.patcher = patch.object(languages, '_languages', None)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        super(LanguagesTestCase, self).tearDown()
+
+    def test_build(self):
+        """ Should build a list of languages sorted by name """
+        langs = build_languages()
+        self.assertTrue(('en', 'English') in langs)
+        names = [n for l, n in langs]
+        self.assertTrue(names.index('Deutsch') < names.index('English'))
+
+    @patch('rqm.languages.build_languages')
+    def test_cached_in_memcache(self, build):
+        """ Should store built language list in memcache """
+        build.return_value = [('en', 'English')]
+        self.assertEqual(get_languages(), [('en', 'English')])
+        self.assertEqual(memcache.get(CACHE_KEY), [('en', 'English')])
+
+    @patch('rqm.languages.build_languages')
+    def test_uses_memcache(self, build):
+        """ Should not build the list if it is in memcache """
+        memcache.set(CACHE_KEY, [('fr', 'French')])
+        self.assertEqual(get_languages(), [('fr', 'French')])
+        self.assertFalse(build.called)
+
+    @patch('rqm.languages.build_languages')
+    def test_cached_in_memory(self, build):
+        """ Should only load the list once per instance """
+        build.return_value = [('en', 'English')]
+        get_languages()
+        memcache.flush_all()
+        get_languages()
+        build.assert_called_once_with()
@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+from mock import patch
+
+from rh import locales
+from rh.locales import LRUCache, exists, get_language_name
+
+
+class LRUCacheTestCase(TestCase):
+    """ Tests related to LRU cache used by the locale registry """
+
+    def test_get(self):
+        c = LRUCache(2)
+        c.set('a', 1)
+        self.assertEqual(c.get('a'), 1)
+        self.assertEqual(c.get('b', 2), 2)
+
+    def test_evicts_least_recently_used(self):
+        """ Should evict least recently used item when full """
+        c = LRUCache(2)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')
+        c.set('c', 3)
+        self.assertTrue('a' in c)
+        self.assertFalse('b' in c)
+        self.assertEqual(len(c), 2)
+
+
+class LocaleRegistryTestCase(TestCase):
+    """ Tests related to the locale registry """
+
+    def setUp(self):
+        locales._names.clear()
+
+    def test_exists(self):
+        self.assertTrue(exists('en'))
+        self.assertTrue(exists('pt_BR'))
+        self.assertFalse(exists('not a locale'))
+        self.assertFalse(exists(None))
+
+    def test_identifiers_loaded_once(self):
+        """ Should only list locale data once """
+        with patch.object(locales, '_identifiers', None):
+            with patch('babel.localedata.locale_identifiers') as li:
+                li.return_value = ['en']
+                exists('en')
+                exists('fr')
+                li.assert_called_once_with()
+
+    def test_language_name(self):
+        """ Should return language name in the language itself by default """
+        self.assertEqual(get_language_name('fr'), u'fran\xe7ais')
+        self.assertEqual(get_language_name('fr', 'en'), 'French')
+
+    def test_unknown_language_name(self):
+        self.assertEqual(get_language_name('not a locale'), None)
+        self.assertEqual(get_language_name(None), None)
+
+    def test_language_name_cached(self):
+        """ Should not load locale data for cached names """
+        get_language_name('de')
+        with patch('babel.Locale') as Locale:
+            self.assertEqual(get_language_name('de'), 'Deutsch')
+            self.assertFalse(Locale.called)
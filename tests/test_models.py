@@ -1,9 +1,12 @@
+import json
+import random
 import datetime
 
 from mock import patch, Mock
 from google.appengine.ext import ndb
 
 from rh.db import *
+from rh import db
 
 from tests.dbunit import DatastoreTestCase
 
@@ -14,6 +17,7 @@ class RequestFactoryMixin(object):
     def tearDown(self):
         for k in Request.query().fetch(keys_only=True):
             k.delete()
+        super(RequestFactoryMixin, self).tearDown()
 
     @staticmethod
     def request(adaptor_name='foo', adaptor_source='bar',
@@ -59,6 +63,38 @@ class RemoteAdaptorTestCase(DatastoreTestCase):
             ra.put()
             self.assertEqual(ra.api_key, 'ra_86f7e437faa5a7fce15d')
 
+    def test_key_kept_on_put(self):
+        """ Storing existing entities should not change their keys """
+        ra = RemoteAdaptor(name='foo', source='bar', contact='baz')
+        ra.put()
+        key = ra.api_key
+        ra.contact = 'qux'
+        ra.put()
+        self.assertEqual(ra.api_key, key)
+
+    def test_rotate_key(self):
+        """ Previous key should remain valid for the overlap period """
+        ra = RemoteAdaptor(name='foo', source='bar', contact='baz')
+        ra.put()
+        old_key = ra.api_key
+        ra.rotate_key(datetime.timedelta(hours=1))
+        ra.put()
+        self.assertNotEqual(ra.api_key, old_key)
+        self.assertEqual([k for k, expires in ra.valid_keys],
+                         [ra.api_key, old_key])
+        self.assertEqual(RemoteAdaptor.get_by_api_key(old_key).key, ra.key)
+        ra.previous_key_expires = datetime.datetime.utcnow()
+        self.assertEqual(ra.valid_keys, [(ra.api_key, None)])
+
+    def test_rotate_key_without_overlap(self):
+        ra = RemoteAdaptor(name='foo', source='bar', contact='baz')
+        ra.put()
+        old_key = ra.api_key
+        ra.rotate_key(None)
+        ra.put()
+        self.assertEqual(ra.previous_key, None)
+        self.assertEqual(RemoteAdaptor.get_by_api_key(old_key), None)
+
 
 class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
     """ Tests methods for fetching requests """
@@ -87,12 +123,53 @@ class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
         self.assertEqual(r[2].posted.day, 2)
         self.assertEqual(r[3].posted.day, 1)
 
+    def test_cds_page(self):
+        """ Should fetch requests one page at a time """
+        d = [self.request(posted=datetime.datetime(2014, 4, i + 1))
+             for i in range(5)]
+        ndb.put_multi(d)
+        r, next_cursor, prev_cursor = Request.fetch_cds_page(per_page=2)
+        self.assertEqual([e.posted.day for e in r], [5, 4])
+        self.assertEqual(prev_cursor, None)
+        r, next_cursor, prev_cursor = Request.fetch_cds_page(next_cursor, 2)
+        self.assertEqual([e.posted.day for e in r], [3, 2])
+        self.assertEqual(prev_cursor, '')
+        r, next_cursor, prev_cursor = Request.fetch_cds_page(next_cursor, 2)
+        self.assertEqual([e.posted.day for e in r], [1])
+        self.assertEqual(next_cursor, None)
+        r, next_cursor, prev_cursor = Request.fetch_cds_page(prev_cursor, 2)
+        self.assertEqual([e.posted.day for e in r], [3, 2])
+
+    def test_cds_page_projection(self):
+        """ Should only load properties used by the request list """
+        r = self.set_content(self.request())
+        r.put()
+        page = Request.fetch_cds_page()[0]
+        self.assertEqual(page[0].text_content, 'We need content')
+        self.assertNotIn('revisions', page[0]._projection)
+        self.assertNotIn('binary_content', page[0]._projection)
+
+    def test_cds_page_thumbnails(self):
+        """ Should load image requests in full so thumbnails can be shown """
+        image = self.request(content_type=Request.NONTRANSCRIBED,
+                             content_format=Request.PNG,
+                             posted=datetime.datetime(2014, 4, 2))
+        image.set_binary_content(b'image')
+        image.set_derivative('thumbnail', b'thumb', Request.PNG)
+        text = self.set_content(self.request())
+        ndb.put_multi([image, text])
+        page = Request.fetch_cds_page()[0]
+        self.assertEqual(page[0].key, image.key)
+        self.assertEqual(page[0].thumbnail, image.thumbnail)
+        self.assertEqual(page[1].text_content, 'We need content')
+        self.assertTrue(page[1]._projection)
+
     def test_create_revision(self):
         """ Should add a new revision """
         r = self.request()
         self.set_content(r)
         self.assertEqual(r.current_revision, 0)
-        self.assertEqual(r.revisions[0].text_content, 'We need content')
+        self.assertEqual(r.get_rev(0).text_content, 'We need content')
 
     def test_add_new_revision(self):
         """ Should update current revision and append revision data """
@@ -100,8 +177,8 @@ class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
         self.set_content(r)
         r.set_content(text_content='foo')
         self.assertEqual(r.current_revision, 1)
-        self.assertEqual(r.revisions[1].text_content, 'foo')
-        self.assertEqual(r.revisions[1].text_content, r.text_content)
+        self.assertEqual(r.get_rev(1).text_content, 'foo')
+        self.assertEqual(r.get_rev(1).text_content, r.text_content)
 
     def test_content_properties(self):
         """ Content properties should be computed from revisions """
@@ -117,15 +194,15 @@ class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
         self.set_content(r)
         r.set_content(language='pt_BR')
         # These should be reused
-        self.assertEqual(r.revisions[1].text_content,
-                         r.revisions[0].text_content)
-        self.assertEqual(r.revisions[1].content_language,
-                         r.revisions[0].content_language)
-        self.assertEqual(r.revisions[1].topic,
-                         r.revisions[0].topic)
+        self.assertEqual(r.get_rev(1).text_content,
+                         r.get_rev(0).text_content)
+        self.assertEqual(r.get_rev(1).content_language,
+                         r.get_rev(0).content_language)
+        self.assertEqual(r.get_rev(1).topic,
+                         r.get_rev(0).topic)
         # These shoould be updated
-        self.assertNotEqual(r.revisions[1].language,
-                            r.revisions[0].language)
+        self.assertNotEqual(r.get_rev(1).language,
+                            r.get_rev(0).language)
 
     def test_passing_no_arguments(self):
         """ Setting content with no arguments should be a no-op """
@@ -133,16 +210,16 @@ class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
         self.set_content(r)
         r.set_content()
         self.assertEqual(r.current_revision, 0)
-        self.assertEqual(len(r.revisions), 1)
+        self.assertEqual(r.revision_count, 1)
 
     def test_get_current_revision(self):
         """ The ``content`` prop should return the current revision """
         r = self.request()
         self.set_content(r)
         r.set_content(text_content='foo')
-        self.assertEqual(r.content, r.revisions[1])
+        self.assertEqual(r.content, r.get_rev(1))
         r.current_revision = 0
-        self.assertEqual(r.content, r.revisions[0])
+        self.assertEqual(r.content, r.get_rev(0))
 
     def test_revert(self):
         """ Should revert to previous revision until there are no more """
@@ -154,7 +231,7 @@ class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
         self.assertEqual(r.current_revision, 1)
         r.revert()
         self.assertEqual(r.current_revision, 0)
-        self.assertEqual(len(r.revisions), 3)
+        self.assertEqual(r.revision_count, 3)
         self.assertEqual(r.text_content, 'We need content')
         self.assertEqual(r.language, 'fr')
 
@@ -165,10 +242,10 @@ class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
         r.set_content(text_content='foo')
         r.set_content(text_content='bar')
         self.assertEquals(len(r.active_revisions), 3)
-        self.assertEquals(r.active_revisions[2], r.revisions[2])
+        self.assertEquals(r.active_revisions[2], r.get_rev(2))
         r.revert()
         self.assertEquals(len(r.active_revisions), 2)
-        self.assertEquals(r.active_revisions[1], r.revisions[1])
+        self.assertEquals(r.active_revisions[1], r.get_rev(1))
 
     def test_add_content(self):
         r = self.request()
@@ -183,6 +260,38 @@ class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
         with self.assertRaises(r.DuplicateSuggestionError) as err:
             r.suggest_url(url='http://example.com/')
 
+    def test_near_duplicate_suggestion_raises(self):
+        """ Should raise an exception if normalized URLs are the same """
+        r = self.request()
+        r.suggest_url(url='http://example.com/page?id=1')
+        with self.assertRaises(r.DuplicateSuggestionError):
+            r.suggest_url(url='HTTP://Example.com/page/?utm_source=fb&id=1')
+        self.assertEqual(len(r.content_suggestions), 1)
+
+    def test_get_suggestion(self):
+        """ Should find suggestions by normalized URL """
+        r = self.request()
+        c = r.suggest_url(url='http://example.com/page')
+        self.assertIs(r.get_suggestion('http://EXAMPLE.com/page/'), c)
+        self.assertIsNone(r.get_suggestion('http://example.com/other'))
+
+    def test_url_index_loaded(self):
+        """ Should build URL index for loaded requests """
+        r = self.request()
+        r.suggest_url(url='http://example.com/')
+        r.put()
+        r = r.key.get()
+        self.assertEqual(r.get_suggestion('http://example.com').url,
+                         'http://example.com/')
+        with self.assertRaises(r.DuplicateSuggestionError):
+            r.suggest_url(url='http://example.com')
+
+    def test_votes_by_normalized_url(self):
+        r = self.request()
+        r.suggest_url(url='http://example.com/')
+        self.assertTrue(r.add_votes('http://example.com#top', 2))
+        self.assertEqual(r.content_suggestions[0].votes, 2)
+
     def test_suggestion_sets_has_suggestion(self):
         """ Should set has_suggestion flag when new URL is suggested """
         r = self.request()
@@ -195,11 +304,11 @@ class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
         r = self.request()
         r.suggest_url(url='http://example.com/')
         r.suggest_url(url='http://test.com/')
-        r.content_suggestions[0].votes = 1
-        r.content_suggestions[1].votes = 2
-        self.assertEqual(r.top_suggestion, r.content_suggestions[1])
-        r.content_suggestions[0].votes = 3
-        self.assertEqual(r.top_suggestion, r.content_suggestions[0])
+        r.set_votes('http://example.com/', 1)
+        r.set_votes('http://test.com/', 2)
+        self.assertEqual(r.top_suggestion.url, 'http://test.com/')
+        r.add_votes('http://example.com/', 2)
+        self.assertEqual(r.top_suggestion.url, 'http://example.com/')
 
     def test_suggestion_pool(self):
         """ Should return top-voted content from the unbroadcast requests """
@@ -214,17 +323,46 @@ class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
         r3.content_suggestions[2].votes = 2
         ndb.put_multi([r1, r2, r3])
         pool = Request.fetch_content_pool()
-        self.assertEqual(pool, [r1, r2])
+        self.assertEqual([r.key for r in pool], [r1.key, r2.key])
 
     def test_sorted_suggestions(self):
         """ Should return sorted content suggestions """
         r = self.request()
         r.suggest_url('http://foo.com')
         r.suggest_url('http://bar.com')
-        r.content_suggestions[0].votes = 1
-        r.content_suggestions[1].votes = 2
-        self.assertEqual(r.sorted_suggestions[0], r.content_suggestions[1])
-        self.assertEqual(r.sorted_suggestions[1], r.content_suggestions[0])
+        r.suggest_url('http://baz.com')
+        r.set_votes('http://foo.com', 1)
+        r.set_votes('http://bar.com', 2)
+        self.assertEqual([c.url for c in r.sorted_suggestions],
+                         ['http://bar.com', 'http://foo.com', 'http://baz.com'])
+        r.set_votes('http://bar.com', 0)
+        self.assertEqual([c.url for c in r.sorted_suggestions],
+                         ['http://foo.com', 'http://bar.com', 'http://baz.com'])
+
+    def test_ties_in_submission_order(self):
+        """ Suggestions with the same votes should be ordered oldest first """
+        r = self.request()
+        for url in ['http://foo.com', 'http://bar.com', 'http://baz.com']:
+            r.suggest_url(url)
+        r.add_votes('http://baz.com')
+        r.add_votes('http://foo.com')
+        self.assertEqual([c.url for c in r.sorted_suggestions],
+                         ['http://foo.com', 'http://baz.com', 'http://bar.com'])
+
+    def test_unknown_suggestion_votes(self):
+        r = self.request()
+        self.assertFalse(r.add_votes('http://foo.com'))
+        self.assertFalse(r.set_votes('http://foo.com', 2))
+
+    def test_order_restored_on_put(self):
+        """ Should store suggestions in order even if modified directly """
+        r = self.request()
+        r.suggest_url('http://foo.com/')
+        r.suggest_url('http://bar.com/')
+        r.content_suggestions[1].votes = 3
+        r.put()
+        self.assertEqual(r.key.get().content_suggestions[0].url,
+                         'http://bar.com/')
 
     def test_pool_sorted_by_votes(self):
         """ Sorted suggestions should be sorted """
@@ -239,7 +377,326 @@ class RequestTestCase(RequestFactoryMixin, DatastoreTestCase):
         r3.content_suggestions[2].votes = 4
         ndb.put_multi([r1, r2, r3])
         pool = Request.fetch_content_pool()
-        self.assertEqual(pool, [r2, r1])
+        self.assertEqual([r.key for r in pool], [r2.key, r1.key])
+
+    def test_pool_top_suggestion(self):
+        """ Pool entries should carry denormalized top suggestion """
+        r = self.request()
+        r.suggest_url('http://foo.com/')
+        r.suggest_url('http://bar.com/')
+        r.content_suggestions[1].votes = 3
+        r.put()
+        pool = Request.fetch_content_pool()
+        self.assertEqual(pool[0].top_url, 'http://bar.com/')
+        self.assertEqual(pool[0].top_votes, 3)
+
+    def test_pool_unreachable(self):
+        """ Requests without reachable suggestions should not be pooled """
+        r1 = self.request()
+        r1.suggest_url('http://a.com/')
+        r1.suggest_url('http://b.com/').votes = 3
+        r2 = self.request()
+        r2.suggest_url('http://c.com/')
+        r2.suggest_url('http://d.com/')
+        for url in ['http://c.com/', 'http://d.com/']:
+            r2.set_suggestion_status(url, Content.UNREACHABLE)
+        ndb.put_multi([r1, r2])
+        pool = Request.fetch_content_pool()
+        self.assertEqual([(r.top_url, r.top_votes) for r in pool],
+                         [('http://b.com/', 3)])
+        r2.set_suggestion_status('http://d.com/', Content.REACHABLE)
+        r2.put()
+        self.assertEqual(len(Request.fetch_content_pool()), 2)
+
+    def test_pool_limit(self):
+        """ Should return at most given number of requests """
+        d = [self.request() for i in range(3)]
+        for r in d:
+            r.suggest_url('http://foo.com/')
+        ndb.put_multi(d)
+        self.assertEqual(len(Request.fetch_content_pool(2)), 2)
+
+
+class RequestBlobTestCase(RequestFactoryMixin, DatastoreTestCase):
+    """ Tests related to storing binary content out of request entities """
+
+    def image_request(self, content=b'image data'):
+        r = self.request(content_type=RequestConstants.NONTRANSCRIBED,
+                         content_format=RequestConstants.PNG)
+        r.set_binary_content(content)
+        return r
+
+    def test_blob_saved_with_request(self):
+        """ Should store binary content as a blob when request is saved """
+        r = self.image_request()
+        self.assertEqual(r.blob.get(), None)
+        r.put()
+        blob = r.blob.get()
+        self.assertEqual(blob.content, b'image data')
+        self.assertEqual(blob.content_format, RequestConstants.PNG)
+        self.assertEqual(blob.size, 10)
+
+    def test_blob_key_is_content_hash(self):
+        """ Should use SHA-1 hexdigest of content as blob key """
+        r = self.image_request()
+        self.assertEqual(r.blob.id(),
+                         'd68146c2e5fe437a9f2c7a8affb88271cff46182')
+
+    def test_get_binary_content(self):
+        """ Should load binary content from blob """
+        r = self.image_request()
+        r.put()
+        r = r.key.get()
+        self.assertEqual(r.get_binary_content(), b'image data')
+
+    def test_get_legacy_binary_content(self):
+        """ Should fall back to binary content stored in request """
+        r = self.request(content_type=RequestConstants.NONTRANSCRIBED,
+                         content_format=RequestConstants.PNG)
+        r.binary_content = b'image data'
+        self.assertEqual(r.get_binary_content(), b'image data')
+
+
+class RevisionTestCase(RequestFactoryMixin, DatastoreTestCase):
+    """ Tests related to storing revisions out of request entities """
+
+    def setUp(self):
+        super(RevisionTestCase, self).setUp()
+        db._revision_texts.clear()
+
+    def proofread_request(self, edits):
+        """ Return saved request with given number of small edits """
+        words = ['word%s' % i for i in range(50)]
+        r = self.request()
+        r.set_content(text_content=' '.join(words), content_language='en',
+                      language='en', topic=RequestConstants.TOPICS[0])
+        texts = [r.text_content]
+        for i in range(edits):
+            words[i % len(words)] = 'edit%s' % i
+            r.set_content(text_content=' '.join(words))
+            texts.append(r.text_content)
+        r.put()
+        return r, texts
+
+    def stored(self, r):
+        return Revision.query(ancestor=r.key).fetch()
+
+    def edited_request(self, edits=3):
+        r = self.request()
+        self.set_content(r)
+        for i in range(edits):
+            r.set_content(text_content='edit %s' % i)
+        r.put()
+        return r
+
+    def test_revisions_saved_with_request(self):
+        """ Should store revisions as child entities of the request """
+        r = self.edited_request()
+        revs = Revision.query(ancestor=r.key).fetch()
+        self.assertEqual(len(revs), 4)
+        self.assertEqual(revs[0].key, Revision.key_for(r.key, 0))
+        self.assertEqual(revs[0].text_content, 'We need content')
+        self.assertEqual(r.key.get().revisions, [])
+
+    def test_unkeyed_request(self):
+        """ Should allocate request key to key the revisions """
+        r = self.edited_request(0)
+        self.assertNotEqual(r.key.id(), None)
+        self.assertEqual(Revision.key_for(r.key, 0).get().text_content,
+                         'We need content')
+
+    def test_current_revision_denormalized(self):
+        """ Should load current revision without loading the history """
+        r = self.edited_request()
+        r = r.key.get()
+        with patch('rh.db.ndb.get_multi') as get_multi:
+            self.assertEqual(r.content.text_content, 'edit 2')
+            self.assertEqual(r.text_content, 'edit 2')
+            self.assertEqual(r.get_rev(3).text_content, 'edit 2')
+            self.assertFalse(get_multi.called)
+
+    def test_get_rev(self):
+        r = self.edited_request()
+        r = r.key.get()
+        self.assertEqual(r.get_rev(0).text_content, 'We need content')
+        self.assertEqual(r.get_rev(1).text_content, 'edit 0')
+        with self.assertRaises(IndexError):
+            r.get_rev(4)
+
+    def test_set_revision(self):
+        """ Should update denormalized revision when reverting """
+        r = self.edited_request()
+        r = r.key.get()
+        r.set_revision(1)
+        r.put()
+        r = r.key.get()
+        self.assertEqual(r.current_revision, 1)
+        self.assertEqual(r.text_content, 'edit 0')
+
+    @patch('rh.db.REVISION_PAGE_SIZE', 2)
+    def test_active_revisions_paged(self):
+        """ Should load active revisions page by page """
+        r = self.edited_request(4)
+        r = r.key.get()
+        r.set_revision(3)
+        with patch('rh.db.ndb.get_multi', wraps=ndb.get_multi) as get_multi:
+            revs = r.active_revisions
+            self.assertEqual(len(revs), 4)
+            self.assertEqual(revs[1].text_content, 'edit 0')
+            self.assertEqual(get_multi.call_count, 1)
+            self.assertEqual([rev.text_content for rev in revs],
+                             ['We need content', 'edit 0', 'edit 1', 'edit 2'])
+            self.assertEqual(get_multi.call_count, 2)
+
+    @patch('rh.db.REVISION_SNAPSHOT_INTERVAL', 3)
+    def test_delta_encoded(self):
+        """ Should store deltas, with a full snapshot every few revisions """
+        r, texts = self.proofread_request(6)
+        stored = self.stored(r)
+        self.assertEqual([rev.delta is None for rev in stored],
+                         [True, False, False, True, False, False, True])
+        self.assertEqual(stored[0].text_content, texts[0])
+        self.assertEqual(stored[1].text_content, None)
+        self.assertLess(len(json.dumps(stored[1].delta)), len(texts[1]) / 4)
+
+    def test_large_change_not_delta_encoded(self):
+        """ Should store full text if delta would not be smaller """
+        r = self.edited_request(1)
+        self.assertEqual(self.stored(r)[1].delta, None)
+        self.assertEqual(self.stored(r)[1].text_content, 'edit 0')
+
+    @patch('rh.db.REVISION_SNAPSHOT_INTERVAL', 4)
+    def test_reconstruct(self):
+        """ Should reconstruct revisions without cached texts """
+        r, texts = self.proofread_request(9)
+        db._revision_texts.clear()
+        r = r.key.get()
+        self.assertEqual(r.get_rev(6).text_content, texts[6])
+        self.assertEqual([rev.text_content for rev in r.active_revisions],
+                         texts)
+
+    @patch('rh.db.REVISION_SNAPSHOT_INTERVAL', 4)
+    def test_reconstruct_from_cache(self):
+        """ Should use cached texts instead of loading previous revisions """
+        r, texts = self.proofread_request(9)
+        r = r.key.get()
+        with patch('rh.db.ndb.get_multi', wraps=ndb.get_multi) as get_multi:
+            self.assertEqual(r.get_rev(6).text_content, texts[6])
+            self.assertEqual(get_multi.call_count, 1)
+        db._revision_texts.clear()
+        with patch('rh.db.ndb.get_multi', wraps=ndb.get_multi) as get_multi:
+            self.assertEqual(r.get_rev(6).text_content, texts[6])
+            self.assertEqual(get_multi.call_count, 2)
+
+    @patch('rh.db.REVISION_SNAPSHOT_INTERVAL', 5)
+    def test_fuzz(self):
+        """ Reconstructed revisions should always match what was written """
+        rnd = random.Random(42)
+        alphabet = u'abc de\n.,\u00e9\u0436\u4e2d'
+        r, texts = self.proofread_request(0)
+        for i in range(60):
+            action = rnd.random()
+            if action < 0.1 and r.current_revision > 0:
+                r.revert()
+            elif action < 0.3:
+                r.put()
+                if rnd.random() < 0.5:
+                    db._revision_texts.clear()
+                r = r.key.get()
+            else:
+                text = r.text_content
+                start = rnd.randint(0, len(text))
+                end = min(len(text), start + rnd.randint(0, 6))
+                insert = u''.join(rnd.choice(alphabet)
+                                  for j in range(rnd.randint(0, 6)))
+                text = text[:start] + insert + text[end:]
+                r.set_content(text_content=text or u'x')
+                texts.append(r.text_content)
+        r.put()
+        db._revision_texts.clear()
+        r = r.key.get()
+        self.assertEqual([r.get_rev(n).text_content
+                          for n in range(r.revision_count)], texts)
+
+    def test_move_legacy_revisions(self):
+        """ Should move revisions stored in request to entities """
+        r = self.request()
+        r.revisions = [Revision(text_content='foo'),
+                       Revision(text_content='bar')]
+        r.current_revision = 1
+        r.put()
+        r = r.key.get()
+        self.assertEqual(r.get_rev(0).text_content, 'foo')
+        self.assertEqual(r.text_content, 'bar')
+        r.set_content(text_content='baz')
+        r.put()
+        r = r.key.get()
+        self.assertEqual(r.revisions, [])
+        self.assertEqual(r.revision_count, 3)
+        self.assertEqual(r.get_rev(1).text_content, 'bar')
+        self.assertEqual(r.text_content, 'baz')
+
+
+class RequestFingerprintTestCase(RequestFactoryMixin, DatastoreTestCase):
+    """ Tests related to RequestFingerprint model """
+
+    def fingerprinted(self, fingerprint, adaptor_name='foo'):
+        r = self.request(adaptor_name=adaptor_name)
+        r.fingerprint = fingerprint
+        return r
+
+    def store(self, requests):
+        unique, fingerprints = RequestFingerprint.deduplicate(requests)
+        ndb.put_multi(unique + fingerprints)
+        return unique
+
+    def test_new_requests(self):
+        """ Should keep requests with new fingerprints and link them """
+        r1, r2 = self.fingerprinted('a'), self.fingerprinted('b')
+        self.assertEqual(self.store([r1, r2]), [r1, r2])
+        self.assertEqual(RequestFingerprint.get_by_id('a').request, r1.key)
+        self.assertEqual(RequestFingerprint.get_by_id('b').request, r2.key)
+
+    def test_duplicates(self):
+        """ Should drop duplicates within a batch and across batches """
+        r1 = self.fingerprinted('a')
+        self.store([r1, self.fingerprinted('a', 'bar')])
+        self.assertEqual(self.store([self.fingerprinted('a', 'baz')]), [])
+        f = RequestFingerprint.get_by_id('a')
+        self.assertEqual(f.request, r1.key)
+        self.assertEqual(f.duplicates, 2)
+        self.assertEqual(f.sources, ['foo', 'bar', 'baz'])
+        self.assertEqual(Request.query().count(), 1)
+
+    def test_same_key(self):
+        """ Should not store a request again under the same key """
+        r1 = self.fingerprinted('a')
+        r1.key = ndb.Key(Request, 123)
+        r1.suggest_url('http://example.com/')
+        self.store([r1])
+        r2 = self.fingerprinted('a')
+        r2.key = ndb.Key(Request, 123)
+        self.assertEqual(self.store([r2]), [])
+        self.assertEqual(RequestFingerprint.get_by_id('a').duplicates, 0)
+        self.assertEqual(len(r1.key.get().content_suggestions), 1)
+
+    def test_same_key_in_batch(self):
+        """ Should only keep the first request with a key in a batch """
+        r1, r2 = self.fingerprinted('a'), self.fingerprinted('b')
+        r1.key = r2.key = ndb.Key(Request, 123)
+        self.assertEqual(self.store([r1, r2]), [r1])
+
+    def test_duplicate_key(self):
+        """ Should set key of duplicates to key of stored request """
+        r1 = self.fingerprinted('a')
+        self.store([r1])
+        r2 = self.fingerprinted('a')
+        self.store([r2])
+        self.assertEqual(r2.key, r1.key)
+
+    def test_no_fingerprint(self):
+        """ Should keep requests without fingerprints """
+        self.assertEqual(len(self.store([self.request(), self.request()])), 2)
 
 
 class ContentTestCase(RequestFactoryMixin, DatastoreTestCase):
@@ -293,6 +750,27 @@ class HarvestHistoryTestCase(DatastoreTestCase):
         self.assertEqual(t, datetime.datetime.utcfromtimestamp(0))
 
 
+    def test_get_timestamp_high_water(self):
+        """ Should return the newest harvested posting time """
+        a = self.adaptor('foo')
+        h = HarvestHistory.get_history(a)
+        h.high_water = datetime.datetime(2014, 4, 2)
+        h.put()
+        t = HarvestHistory.get_timestamp(a)
+        self.assertEqual(t, datetime.datetime(2014, 4, 2))
+
+    def test_record_keeps_high_water(self):
+        """ Completed harvest should keep the high-water mark """
+        a = self.adaptor('foo')
+        h = HarvestHistory.get_history(a)
+        h.high_water = datetime.datetime(2014, 4, 2)
+        h.boundary_ids = ['1']
+        h.put()
+        h = HarvestHistory.record(a)
+        self.assertEqual(h.high_water, datetime.datetime(2014, 4, 2))
+        self.assertEqual(h.boundary_ids, ['1'])
+
+
 class PlaylistTestcase(RequestFactoryMixin, DatastoreTestCase):
     """ Tests related to Playlist model """
 
@@ -0,0 +1,203 @@
+import datetime
+
+from mock import Mock, patch
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from rh.adaptors import Adaptor
+from rh.db import Request as RequestModel, BacklogRequest, RemoteAdaptor
+from rh.requests import Request
+from rh.ratelimit import (TokenBucket, AdaptorLimits, admit, defer_backlog,
+                          store_backlog)
+
+from tests.dbunit import DatastoreTestCase
+from tests.test_request import TEST_IMAGE_BIN
+
+
+class LimitedAdaptor(Adaptor):
+    name = 'limited'
+    source = 'test'
+    rate = 1.0
+    burst = 3
+    sender_rate = 0.5
+    sender_burst = 2
+
+
+def request(content='Need news', sender=None):
+    return Request(adaptor=LimitedAdaptor, content=content,
+                   timestamp=datetime.datetime(2014, 4, 1), world=Request.ONLINE,
+                   content_format=Request.TEXT, sender=sender)
+
+
+@patch('rh.ratelimit.now_ms')
+class TokenBucketTestCase(DatastoreTestCase):
+    """ Tests related to memcache-based token buckets """
+
+    def test_burst(self, now_ms):
+        """ Should take tokens until the bucket is empty """
+        now_ms.return_value = 1000000
+        bucket = TokenBucket('foo', 1.0, 3)
+        self.assertEqual(bucket.take(2), 2)
+        self.assertEqual(bucket.take(2), 1)
+        self.assertEqual(bucket.wait, 1)
+        self.assertEqual(bucket.take(), 0)
+
+    def test_refill(self, now_ms):
+        """ Should refill at the rate of the bucket """
+        now_ms.return_value = 1000000
+        bucket = TokenBucket('foo', 2.0, 3)
+        self.assertEqual(bucket.take(5), 3)
+        now_ms.return_value += 1000
+        self.assertEqual(bucket.take(5), 2)
+        self.assertEqual(bucket.take(5), 0)
+
+    def test_refill_up_to_burst(self, now_ms):
+        """ Should not refill above burst while the bucket is idle """
+        now_ms.return_value = 1000000
+        bucket = TokenBucket('foo', 1.0, 3)
+        bucket.take()
+        now_ms.return_value += 60 * 1000
+        self.assertEqual(bucket.take(10), 3)
+        self.assertEqual(bucket.take(), 0)
+
+    def test_shared(self, now_ms):
+        """ Should share the bucket with other instances """
+        now_ms.return_value = 1000000
+        TokenBucket('foo', 1.0, 3).take(3)
+        self.assertEqual(TokenBucket('foo', 1.0, 3).take(), 0)
+        self.assertEqual(TokenBucket('bar', 1.0, 3).take(), 1)
+
+    def test_memcache_unavailable(self, now_ms):
+        now_ms.return_value = 1000000
+        with patch.object(memcache, 'incr', return_value=None):
+            self.assertEqual(TokenBucket('foo', 1.0, 3).take(10), 10)
+
+
+@patch('rh.ratelimit.now_ms', Mock(return_value=1000000))
+class AdmitTestCase(DatastoreTestCase):
+    """ Tests related to rate limiting of requests """
+
+    def test_adaptor_limit(self):
+        requests = [request('Need news %s' % i) for i in range(5)]
+        admitted, backlog, wait = admit(LimitedAdaptor, requests)
+        self.assertEqual(admitted, requests[:3])
+        self.assertEqual(backlog, requests[3:])
+        self.assertEqual(wait, 2)
+
+    def test_sender_limit(self):
+        """ Should limit each sender separately, keeping request order """
+        requests = [request(sender='foo@example.com'),
+                    request(sender='bar@example.com'),
+                    request(sender='FOO@example.com'),
+                    request(sender='foo@example.com')]
+        admitted, backlog, wait = admit(LimitedAdaptor, requests)
+        self.assertEqual(admitted, requests[:3])
+        self.assertEqual(backlog, requests[3:])
+
+    def test_remote_adaptors_with_same_name(self):
+        """ Remote adaptors with the same name should not share a bucket """
+        adaptors = [RemoteAdaptor(name='gateway', source='sms',
+                                  contact='foo@example.com', rate=1.0,
+                                  burst=3) for i in range(2)]
+        ndb.put_multi(adaptors)
+        requests = [request('Need news %s' % i) for i in range(3)]
+        for adaptor in adaptors:
+            admitted, backlog, wait = admit(adaptor, requests)
+            self.assertEqual(admitted, requests)
+        limits = AdaptorLimits.of(adaptors[0])
+        self.assertEqual(admit(limits, requests)[0], [])
+
+    def test_no_sender(self):
+        """ Should only apply adaptor limit to requests without sender """
+        requests = [request(), request(), request()]
+        admitted, backlog, wait = admit(LimitedAdaptor, requests)
+        self.assertEqual(admitted, requests)
+
+
+class BacklogTestCase(DatastoreTestCase):
+    """ Tests related to deferred over-limit requests """
+
+    @patch('rh.ratelimit.deferred')
+    def test_defer(self, deferred):
+        """ Should store requests, and only defer their keys """
+        requests = [request(), request(u'Need news \u00e9', 'foo@example.com')]
+        defer_backlog(LimitedAdaptor, requests, 1.5)
+        args, kwargs = deferred.defer.call_args
+        self.assertEqual(args[0], store_backlog)
+        self.assertEqual(kwargs, {'_queue': 'request-backlog',
+                                  '_countdown': 2})
+        keys, limits = args[1:]
+        self.assertEqual([e.content for e in ndb.get_multi(keys)],
+                         [b'Need news', u'Need news \u00e9'.encode('utf8')])
+        self.assertEqual((limits.name, limits.rate, limits.sender_burst),
+                         ('limited', 1.0, 2))
+        defer_backlog(LimitedAdaptor, [])
+        self.assertEqual(deferred.defer.call_count, 1)
+
+    def backlog(self, requests):
+        with patch('rh.ratelimit.deferred') as deferred:
+            defer_backlog(LimitedAdaptor, requests)
+        return deferred.defer.call_args[0][1:]
+
+    def test_store(self):
+        """ Should store valid backlog requests, and drop invalid ones """
+        keys, limits = self.backlog([request('Need news'), request(''),
+                                     request(u'Need news \u00e9!')])
+        store_backlog(keys, limits)
+        self.assertEqual(RequestModel.query().count(), 2)
+        self.assertEqual(BacklogRequest.query().count(), 0)
+        texts = sorted(r.text_content for r in RequestModel.query())
+        self.assertEqual(texts, ['Need news', u'Need news \u00e9!'])
+
+    def test_store_image(self):
+        image = Request(adaptor=LimitedAdaptor, content=TEST_IMAGE_BIN,
+                        timestamp=datetime.datetime(2014, 4, 1),
+                        world=Request.ONLINE, content_format=Request.PNG,
+                        encoded=False)
+        keys, limits = self.backlog([image, request('Need news')])
+        with patch.object(ndb, 'put_multi', wraps=ndb.put_multi) as put:
+            store_backlog(keys, limits)
+        self.assertEqual(put.call_count, 1)
+        r = RequestModel.query(
+            RequestModel.content_type == Request.NONTRANSCRIBED).get()
+        self.assertEqual(r.get_binary_content(), TEST_IMAGE_BIN)
+
+    @patch('rh.ratelimit.MAX_BLOB_SIZE', 100)
+    def test_defer_large_image(self):
+        """ Should keep the derived master of images larger than a blob """
+        image = Request(adaptor=LimitedAdaptor, content=TEST_IMAGE_BIN,
+                        timestamp=datetime.datetime(2014, 4, 1),
+                        world=Request.ONLINE, content_format=Request.PNG,
+                        encoded=False)
+        derivatives = {'master': ('master', Request.PNG)}
+        with patch('rh.requests.derive_images', return_value=derivatives):
+            keys, limits = self.backlog([image])
+        e = keys[0].get()
+        self.assertEqual((e.content, e.content_format, e.encoded),
+                         (b'master', Request.PNG, False))
+
+    @patch('rh.ratelimit.MAX_BLOB_SIZE', 100)
+    @patch('rh.ratelimit.deferred')
+    def test_defer_too_large(self, deferred):
+        """ Should drop requests that cannot be stored in the backlog """
+        image = Request(adaptor=LimitedAdaptor, content=TEST_IMAGE_BIN,
+                        timestamp=datetime.datetime(2014, 4, 1),
+                        world=Request.ONLINE, content_format=Request.PNG,
+                        encoded=False)
+        with patch('rh.requests.derive_images', return_value={}):
+            defer_backlog(LimitedAdaptor, [image])
+        self.assertFalse(deferred.defer.called)
+        self.assertEqual(BacklogRequest.query().count(), 0)
+
+    @patch('rh.ratelimit.now_ms', Mock(return_value=1000000))
+    @patch('rh.ratelimit.deferred')
+    def test_store_limited(self, deferred):
+        """ Should defer backlog requests that are still over the limit """
+        keys, limits = self.backlog([request('Need news %s' % i)
+                                     for i in range(5)])
+        store_backlog(keys, limits)
+        self.assertEqual(RequestModel.query().count(), 3)
+        args, kwargs = deferred.defer.call_args
+        self.assertEqual(args, (store_backlog, keys[3:], limits))
+        self.assertEqual(kwargs['_countdown'], 2)
+        self.assertEqual(BacklogRequest.query().count(), 2)
@@ -1,11 +1,13 @@
 import unittest
 import datetime
 import os
+import time
 import base64
+import threading
 
 from mock import Mock, patch
 
-from rh.requests import Request
+from rh.requests import Request, check_many, decode_base64
 from rh.db import Request as RequestModel
 
 from tests.dbunit import DatastoreTestCase
@@ -120,6 +122,49 @@ class RequestObjectTestCase(RequestTestMixin, unittest.TestCase):
         r.check_content_data()
         self.assertEqual(r.processed_content, TEST_IMAGE_BIN)
 
+    def test_check_unencoded_image_content_data(self):
+        """ Should accept binary content that is not Base64-encoded """
+        r = self.request(content=TEST_IMAGE_BIN, content_format=Request.PNG,
+                         encoded=False)
+        r.check_content_data()
+        self.assertEqual(r.processed_content, TEST_IMAGE_BIN)
+
+    def test_image_not_loaded(self):
+        """ Should not load images unless image checks are configured """
+        r = self.request(content=TEST_IMAGE_B64, content_format=Request.PNG)
+        with patch.object(Request, 'image_from_string') as image_from_string:
+            r.check_content_data()
+            self.assertFalse(image_from_string.called)
+
+    @patch('rh.requests.VERIFY_IMAGES', True)
+    def test_verify_image(self):
+        """ Should reject broken images if verification is configured """
+        r = self.request(content=base64.b64encode(TEST_IMAGE_BIN[:8]),
+                         content_format=Request.PNG)
+        self.assertRequestContentDataInvalid(r,
+                                             'Cannot load image from string')
+
+    @patch('rh.requests.MAX_IMAGE_DIMENSIONS', (1, 1))
+    def test_max_image_dimensions(self):
+        r = self.request(content=TEST_IMAGE_B64, content_format=Request.PNG)
+        with self.assertRaises(Request.ImageFormatError) as ctx:
+            r.check_content_data()
+        self.assertTrue(ctx.exception.message.startswith('Image dimensions'))
+
+    def test_text_fingerprint(self):
+        """ Should ignore case, punctuation, and whitespace in text """
+        r1 = self.request(content='Need  news about\nthe World Cup!').check()
+        r2 = self.request(content='need news, about the world cup').check()
+        r3 = self.request(content='need news about the world').check()
+        self.assertEqual(r1.fingerprint, r2.fingerprint)
+        self.assertNotEqual(r1.fingerprint, r3.fingerprint)
+
+    def test_image_fingerprint(self):
+        """ Should use SHA-1 digest of decoded image data """
+        r = self.request(content=TEST_IMAGE_B64, content_format=Request.PNG)
+        r.check()
+        self.assertEqual(r.fingerprint, r.prepare().blob.id())
+
     def test_check_wrong_image_format(self):
         r = self.request(content=TEST_IMAGE_B64, content_format=Request.JPG)
         self.assertImageInvalid(r, 'Image format png does not match content '
@@ -198,6 +243,101 @@ class RequestPersistTestCase(RequestTestMixin, DatastoreTestCase):
         with self.assertRaises(Request.RequestError):
             r.persist()
 
-
-
-
+    def test_persist_source_id(self):
+        """ Should not duplicate requests harvested more than once """
+        for i in range(2):
+            r = self.request(source_id='123')
+            r.check()
+            r.persist()
+        self.assertEqual(RequestModel.query().count(), 1)
+        self.assertEqual(RequestModel.query().get().source_id, '123')
+
+
+
+
+
+
+class CheckManyTestCase(RequestTestMixin, DatastoreTestCase):
+    """ Tests for checking requests in batches """
+
+    def test_order(self):
+        """ Should return entities and errors in input order """
+        requests = [self.request(content='Need news'),
+                    self.request(content=TEST_IMAGE_B64,
+                                 content_format=Request.PNG),
+                    self.request(content=TEST_NONIMAGE,
+                                 content_format=Request.PNG),
+                    self.request(content=TEST_IMAGE_B64,
+                                 content_format=Request.PNG, source_id='2'),
+                    self.request(world=2)]
+        entities, errors = check_many(requests)
+        self.assertEqual([e.content_format for e in entities],
+                         [Request.TEXT, Request.PNG, Request.PNG])
+        self.assertEqual(entities[2].source_id, '2')
+        self.assertEqual([r for r, err in errors],
+                         [requests[2], requests[4]])
+        self.assertEqual(unicode(errors[1][1]), 'Invalid world')
+
+    def test_concurrent_images(self):
+        """ Should check images concurrently, with bounded concurrency """
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def slow_check():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+        requests = [self.request(content=TEST_IMAGE_B64,
+                                 content_format=Request.PNG)
+                    for i in range(6)]
+        for r in requests:
+            r.check = slow_check
+            r.processed_content = TEST_IMAGE_BIN
+        start = time.time()
+        entities, errors = check_many(requests, workers=3)
+        self.assertEqual(len(entities), 6)
+        self.assertEqual(max(peak), 3)
+        # Checking one by one would take 0.3s
+        self.assertTrue(time.time() - start < 0.25)
+
+    def test_unexpected_error(self):
+        """ Should not trap errors other than request errors """
+        requests = [self.request(content=TEST_IMAGE_B64,
+                                 content_format=Request.PNG)
+                    for i in range(2)]
+        requests[1].check = Mock(side_effect=ValueError)
+        with self.assertRaises(ValueError):
+            check_many(requests)
+
+
+class DecodeBase64TestCase(unittest.TestCase):
+    """ Tests related to chunked Base64 decoding """
+
+    def test_chunks(self):
+        """ Should decode text regardless of chunk boundaries """
+        data = os.urandom(1000)
+        for chunk_size in (4, 7, 64, 5000):
+            self.assertEqual(
+                decode_base64(base64.b64encode(data), chunk_size=chunk_size),
+                data)
+
+    def test_whitespace(self):
+        data = os.urandom(1000)
+        self.assertEqual(decode_base64(base64.encodestring(data),
+                                       chunk_size=10), data)
+
+    def test_max_size(self):
+        text = base64.b64encode('x' * 100)
+        self.assertEqual(decode_base64(text, max_size=100), 'x' * 100)
+        with self.assertRaises(Request.BinaryDecodeError):
+            decode_base64(text, max_size=90)
+
+    def test_invalid(self):
+        with self.assertRaises(Request.BinaryDecodeError):
+            decode_base64('abcde')
+        with self.assertRaises(Request.BinaryDecodeError):
+            decode_base64('ab=c')
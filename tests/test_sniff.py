@@ -0,0 +1,50 @@
+import base64
+
+from google.appengine.api import images
+from unittest import TestCase
+
+from rh.sniff import looks_like_base64, sniff_image_format
+
+from tests.test_request import TEST_IMAGE_BIN, TEST_TIFF_BIN
+
+
+class Base64TestCase(TestCase):
+    """ Tests related to Base64 classification """
+
+    def test_base64(self):
+        for data in ('abc', 'abcd', 'abcde', 'x' * 1000):
+            self.assertTrue(looks_like_base64(base64.b64encode(data)))
+
+    def test_text(self):
+        self.assertFalse(looks_like_base64('Need news about the World Cup'))
+        self.assertFalse(looks_like_base64(''))
+
+    def test_padding(self):
+        self.assertFalse(looks_like_base64('abc==='))
+        self.assertFalse(looks_like_base64('ab=c'))
+        self.assertFalse(looks_like_base64('ab=cabcd'))
+
+    def test_sample(self):
+        """ Should only check the start of long text """
+        data = base64.b64encode('x' * 1000)
+        self.assertFalse(looks_like_base64(data[:4] + ' ' + data[5:]))
+        self.assertTrue(looks_like_base64(data[:-8] + ' ' + data[-7:]))
+        self.assertFalse(looks_like_base64(data[:-3] + ' ==', 100))
+
+
+class ImageSniffTestCase(TestCase):
+    """ Tests related to image format sniffing """
+
+    def test_formats(self):
+        self.assertEqual(sniff_image_format(TEST_IMAGE_BIN), images.PNG)
+        self.assertEqual(sniff_image_format(TEST_TIFF_BIN), images.TIFF)
+        self.assertEqual(sniff_image_format(b'\xff\xd8\xff\xe0\x00\x10JFIF'),
+                         images.JPEG)
+        self.assertEqual(sniff_image_format(b'GIF89a\x01\x00'), images.GIF)
+        self.assertEqual(sniff_image_format(b'RIFF\x00\x00\x00\x00WEBPVP8 '),
+                         images.WEBP)
+
+    def test_unknown(self):
+        self.assertEqual(sniff_image_format(b'not an image'), None)
+        self.assertEqual(sniff_image_format(b'RIFF\x00\x00\x00\x00WAVE'), None)
+        self.assertEqual(sniff_image_format(b''), None)
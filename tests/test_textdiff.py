@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import json
+import random
+from unittest import TestCase
+
+from rh.textdiff import make_delta, apply_delta, delta_size
+
+ALPHABET = u'aeiou xyzAB.,;\n\t-éüбж中文\U0001f600'
+WORDS = [u'the', u'request', u'content', u'café', u'мир',
+         u'中文', u' ', u'  ', u'\n', u'.', u',', u'—']
+
+
+def random_text(rnd, length):
+    if rnd.random() < 0.5:
+        return u''.join(rnd.choice(ALPHABET) for i in range(length))
+    return u''.join(rnd.choice(WORDS) for i in range(length))
+
+
+def random_edit(rnd, text):
+    """ Return text with a few random insertions, deletions, and changes """
+    for i in range(rnd.randint(1, 5)):
+        start = rnd.randint(0, len(text))
+        end = min(len(text), start + rnd.randint(0, 10))
+        text = text[:start] + random_text(rnd, rnd.randint(0, 8)) + text[end:]
+    return text
+
+
+class TextDiffTestCase(TestCase):
+    """ Tests related to text deltas """
+
+    def roundtrip(self, old, new):
+        # Deltas are stored as JSON
+        delta = json.loads(json.dumps(make_delta(old, new)))
+        self.assertEqual(apply_delta(old, delta), new)
+        return delta
+
+    def test_small_edit(self):
+        """ Should only store changed words """
+        old = u'We need content about the weather in Nairobi.'
+        new = u'We need content about weather in Nairobi, Kenya.'
+        delta = self.roundtrip(old, new)
+        self.assertEqual(delta, [22, -4, 18, u', Kenya', 1])
+        self.assertLess(delta_size(delta), len(new))
+
+    def test_identical(self):
+        self.assertEqual(self.roundtrip(u'foo bar', u'foo bar'), [7])
+
+    def test_empty(self):
+        self.assertEqual(self.roundtrip(u'', u''), [])
+        self.assertEqual(self.roundtrip(u'', u'foo'), [u'foo'])
+        self.assertEqual(self.roundtrip(u'foo', u''), [-3])
+
+    def test_wrong_base(self):
+        """ Should refuse to apply delta made for a different text """
+        delta = make_delta(u'foo bar', u'foo baz')
+        with self.assertRaises(ValueError):
+            apply_delta(u'foo', delta)
+        with self.assertRaises(ValueError):
+            apply_delta(u'foo bar baz', delta)
+
+    def test_fuzz(self):
+        """ Applying delta should always reproduce the new text """
+        rnd = random.Random(1234)
+        for i in range(500):
+            old = random_text(rnd, rnd.randint(0, 200))
+            if rnd.random() < 0.2:
+                new = random_text(rnd, rnd.randint(0, 200))
+            else:
+                new = random_edit(rnd, old)
+            self.roundtrip(old, new)
+
+    def test_fuzz_chain(self):
+        """ Applying a chain of deltas should reproduce every version """
+        rnd = random.Random(4321)
+        versions = [random_text(rnd, 300)]
+        for i in range(100):
+            versions.append(random_edit(rnd, versions[-1]))
+        deltas = [make_delta(a, b) for a, b in zip(versions, versions[1:])]
+        text = versions[0]
+        for delta, expected in zip(deltas, versions[1:]):
+            text = apply_delta(text, delta)
+            self.assertEqual(text, expected)
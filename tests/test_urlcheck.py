@@ -0,0 +1,177 @@
+import time
+import socket
+import threading
+import BaseHTTPServer
+
+from mock import patch
+from google.appengine.api import memcache
+
+from cds import urlcheck
+from cds.urlcheck import check_url, check_suggestion, defer_check
+from rh.db import Content
+
+from tests.dbunit import DatastoreTestCase
+from tests.test_models import RequestFactoryMixin
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Handler of the local HTTP stub server """
+
+    def respond(self):
+        self.server.log.append((self.command, self.path))
+        if self.path == '/ok':
+            self.send_response(200)
+        elif self.path == '/nohead':
+            self.send_response(405 if self.command == 'HEAD' else 200)
+        elif self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/ok')
+        elif self.path == '/slow':
+            time.sleep(0.5)
+            self.send_response(200)
+        else:
+            self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_HEAD = do_GET = respond
+
+    def log_message(self, *args):
+        pass
+
+
+class URLCheckTestCase(RequestFactoryMixin, DatastoreTestCase):
+    """ Tests related to background URL checks """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StubHandler)
+        cls.server.log = []
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.base_url = 'http://127.0.0.1:%s' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        super(URLCheckTestCase, self).setUp()
+        self.server.log[:] = []
+
+    def url(self, path):
+        return self.base_url + path
+
+    def test_reachable(self):
+        """ Should only use HEAD for reachable URLs """
+        self.assertTrue(check_url(self.url('/ok')))
+        self.assertEqual(self.server.log, [('HEAD', '/ok')])
+
+    def test_head_not_allowed(self):
+        """ Should fall back to GET if HEAD fails """
+        self.assertTrue(check_url(self.url('/nohead')))
+        self.assertEqual(self.server.log, [('HEAD', '/nohead'),
+                                           ('GET', '/nohead')])
+
+    def test_redirect(self):
+        """ Should follow redirects using HEAD """
+        self.assertTrue(check_url(self.url('/redirect')))
+        self.assertEqual(self.server.log, [('HEAD', '/redirect'),
+                                           ('HEAD', '/ok')])
+
+    def test_not_found(self):
+        self.assertFalse(check_url(self.url('/missing')))
+
+    def test_timeout(self):
+        """ Should treat timeouts as unreachable instead of failing """
+        self.assertFalse(check_url(self.url('/slow'), timeout=0.1))
+
+    def test_timeout_not_cached(self):
+        """ Should not mark the host or the URL unreachable on timeouts """
+        self.assertFalse(check_url(self.url('/slow'), timeout=0.1))
+        self.assertTrue(check_url(self.url('/ok')))
+        self.assertTrue(check_url(self.url('/slow')))
+
+    def test_connection_refused(self):
+        """ Should cache unreachable hosts """
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+        s.close()
+        url = 'http://127.0.0.1:%s/' % port
+        self.assertFalse(check_url(url + 'a'))
+        with patch.object(urlcheck, 'probe_url') as probe:
+            self.assertFalse(check_url(url + 'b'))
+            self.assertFalse(probe.called)
+
+    def test_invalid_url(self):
+        self.assertFalse(check_url('foo://bar'))
+
+    def test_cached(self):
+        """ Should not request the same URL again """
+        check_url(self.url('/ok'))
+        check_url(self.url('/ok'))
+        self.assertEqual(len(self.server.log), 1)
+        memcache.flush_all()
+        check_url(self.url('/ok'))
+        self.assertEqual(len(self.server.log), 2)
+
+    @patch('cds.urlcheck.deferred')
+    def test_check_suggestion(self, deferred):
+        """ Should store check results on content suggestions """
+        r = self.request()
+        ok = r.suggest_url(self.url('/ok'))
+        missing = r.suggest_url(self.url('/missing'))
+        self.assertEqual(ok.status, Content.PENDING)
+        r.put()
+        check_suggestion(r.key, ok.url)
+        check_suggestion(r.key, missing.url)
+        statuses = [(c.status, c.checked is not None)
+                    for c in r.key.get().content_suggestions]
+        self.assertEqual(statuses, [(Content.REACHABLE, True),
+                                    (Content.UNREACHABLE, True)])
+
+    def test_unreachable_not_top(self):
+        """ Unreachable suggestions should not be top suggestions """
+        r = self.request()
+        r.suggest_url('http://a/').votes = 1
+        r.suggest_url('http://b/')
+        r.set_suggestion_status('http://a/', Content.UNREACHABLE)
+        self.assertEqual(r.top_url, 'http://b/')
+
+    @patch('cds.urlcheck.deferred')
+    def test_defer_check(self, deferred):
+        r = self.request()
+        r.put()
+        defer_check(r.key, 'http://a/')
+        deferred.defer.assert_called_once_with(
+            check_suggestion, r.key, 'http://a/', 0, _queue='url-checks',
+            _countdown=0)
+
+    @patch('cds.urlcheck.deferred')
+    def test_recheck_unreachable(self, deferred):
+        """ Should check unreachable URLs again, bypassing the cache """
+        r = self.request()
+        url = r.suggest_url(self.url('/missing')).url
+        r.put()
+        check_suggestion(r.key, url)
+        deferred.defer.assert_called_once_with(
+            check_suggestion, r.key, url, 1, _queue='url-checks',
+            _countdown=urlcheck.RECHECK_DELAYS[0])
+        deferred.defer.reset_mock()
+        check_suggestion(r.key, url, 1)
+        self.assertEqual(len(self.server.log), 4)
+        self.assertEqual(deferred.defer.call_args[0][3], 2)
+        deferred.defer.reset_mock()
+        check_suggestion(r.key, url, len(urlcheck.RECHECK_DELAYS))
+        self.assertFalse(deferred.defer.called)
+
+    @patch('cds.urlcheck.deferred')
+    def test_no_recheck_reachable(self, deferred):
+        r = self.request()
+        url = r.suggest_url(self.url('/ok')).url
+        r.put()
+        check_suggestion(r.key, url)
+        self.assertFalse(deferred.defer.called)
@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from rh.urlnorm import normalize_url
+
+
+class NormalizeURLTestCase(TestCase):
+    """ Tests related to URL normalization """
+
+    def assertSame(self, *urls):
+        normalized = set(normalize_url(url) for url in urls)
+        self.assertEqual(len(normalized), 1, normalized)
+
+    def test_scheme_and_host_case(self):
+        self.assertSame('http://example.com/Page', 'HTTP://Example.COM/Page')
+
+    def test_path_case_kept(self):
+        self.assertNotEqual(normalize_url('http://example.com/Page'),
+                            normalize_url('http://example.com/page'))
+
+    def test_trailing_slash(self):
+        self.assertSame('http://example.com', 'http://example.com/')
+        self.assertSame('http://example.com/page', 'http://example.com/page/')
+
+    def test_default_port(self):
+        """ Should remove default ports only """
+        self.assertSame('http://example.com/', 'http://example.com:80/')
+        self.assertSame('https://example.com/', 'https://example.com:443/')
+        self.assertNotEqual(normalize_url('http://example.com:8080/'),
+                            normalize_url('http://example.com/'))
+        self.assertNotEqual(normalize_url('https://example.com:80/'),
+                            normalize_url('https://example.com/'))
+
+    def test_ipv6_host(self):
+        self.assertEqual(normalize_url('http://[::1]:80/'), 'http://[::1]/')
+        self.assertEqual(normalize_url('http://[::1]/'), 'http://[::1]/')
+
+    def test_tracking_params(self):
+        self.assertSame('http://example.com/?id=1',
+                        'http://example.com/?utm_source=fb&id=1&fbclid=abc',
+                        'http://example.com/?id=1&UTM_Medium=email')
+
+    def test_param_order(self):
+        self.assertSame('http://example.com/?a=1&b=2',
+                        'http://example.com/?b=2&a=1')
+
+    def test_params_kept(self):
+        self.assertNotEqual(normalize_url('http://example.com/?id=1'),
+                            normalize_url('http://example.com/?id=2'))
+
+    def test_fragment(self):
+        self.assertSame('http://example.com/page',
+                        'http://example.com/page#section')
+
+    def test_whitespace(self):
+        self.assertSame('http://example.com/', ' http://example.com/\n')
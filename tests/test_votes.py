@@ -0,0 +1,249 @@
+import datetime
+import threading
+
+from mock import patch
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from rh.db import Request
+from rh.votes import *
+from rh import votes
+
+from tests.dbunit import DatastoreTestCase
+from tests.test_models import RequestFactoryMixin
+
+
+class VoteCounterTestCase(RequestFactoryMixin, DatastoreTestCase):
+    """ Tests related to sharded vote counters """
+
+    def counter(self, url='http://example.com/'):
+        r = self.request()
+        r.suggest_url(url)
+        r.put()
+        return VoteCounter(r.key, url)
+
+    def test_increment(self):
+        """ Should count votes """
+        c = self.counter()
+        for i in range(3):
+            c.increment()
+        self.assertEqual(c.get_count(), 3)
+
+    def test_count_without_cache(self):
+        """ Should sum shards when the total is not cached """
+        c = self.counter()
+        for i in range(3):
+            c.increment()
+        memcache.flush_all()
+        self.assertEqual(c.get_count(), 3)
+
+    def test_count_is_cached(self):
+        """ Should cache the total """
+        c = self.counter()
+        c.increment()
+        c.get_count()
+        self.assertEqual(memcache.get(c.cache_key), 1)
+
+    def test_counters_are_separate(self):
+        """ Different URLs should have different counters """
+        c1 = self.counter('http://foo.com/')
+        c2 = VoteCounter(c1.request_key, 'http://bar.com/')
+        c1.increment()
+        self.assertEqual(c2.get_count(), 0)
+
+    def test_many_votes(self):
+        """ Should not lose votes and should spread them across shards """
+        c = self.counter()
+        n = 500
+        for i in range(n):
+            c.increment()
+        memcache.flush_all()
+        self.assertEqual(c.get_count(), n)
+        shards = [s for s in ndb.get_multi(c.get_shard_keys()) if s]
+        self.assertTrue(len(shards) > 1)
+
+    def test_concurrent_votes(self):
+        """ Should not lose votes cast concurrently """
+        c = self.counter()
+        threads, n = 10, 50
+
+        def vote():
+            for i in range(n):
+                c.increment()
+
+        workers = [threading.Thread(target=vote) for i in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        memcache.flush_all()
+        self.assertEqual(c.get_count(), threads * n)
+
+    def test_seed_legacy_votes(self):
+        """ Should count votes the suggestion had before the counter """
+        c = self.counter()
+        r = c.request_key.get()
+        r.content_suggestions[0].votes = 5
+        r.put()
+        c.get_count()
+        c.increment()
+        self.assertEqual(c.get_count(), 6)
+        votes.flush()
+        self.assertEqual(c.request_key.get().content_suggestions[0].votes, 6)
+
+    def test_seed_once(self):
+        """ Should not seed from flushed totals again """
+        c = self.counter()
+        r = c.request_key.get()
+        r.content_suggestions[0].votes = 5
+        r.put()
+        c.increment()
+        votes.flush()
+        c.seed()
+        c.increment()
+        memcache.flush_all()
+        self.assertEqual(c.get_count(), 7)
+
+    def test_flush(self):
+        """ Should write counter totals into content suggestions """
+        c = self.counter()
+        for i in range(4):
+            c.increment()
+        self.assertEqual(votes.flush(), 1)
+        r = c.request_key.get()
+        self.assertEqual(r.content_suggestions[0].votes, 4)
+        self.assertEqual(r.top_votes, 4)
+
+    @patch('rh.votes.FLUSH_OVERLAP', datetime.timedelta(0))
+    def test_flush_only_updated(self):
+        """ Should only process counters updated since last flush """
+        c = self.counter()
+        c.increment()
+        votes.flush()
+        self.assertEqual(votes.flush(), 0)
+        c.increment()
+        self.assertEqual(votes.flush(), 1)
+        self.assertEqual(c.request_key.get().content_suggestions[0].votes, 2)
+
+    def test_flush_overlap(self):
+        """ Should flush shards updated shortly before last flush again """
+        c = self.counter()
+        c.increment()
+        VoteFlushHistory.record(datetime.datetime.utcnow() +
+                                datetime.timedelta(minutes=1))
+        self.assertEqual(votes.flush(), 1)
+        self.assertEqual(c.request_key.get().content_suggestions[0].votes, 1)
+
+    def test_flush_ignores_cache(self):
+        """ Should write totals summed from shards, not cached totals """
+        c = self.counter()
+        for i in range(2):
+            c.increment()
+        memcache.set(c.cache_key, 1)
+        votes.flush()
+        self.assertEqual(c.request_key.get().content_suggestions[0].votes, 2)
+        self.assertEqual(memcache.get(c.cache_key), 2)
+
+    def test_flush_in_pages(self):
+        """ Should flush all updated counters page by page """
+        c1 = self.counter('http://foo.com/')
+        c2 = VoteCounter(c1.request_key, 'http://bar.com/')
+        r = c1.request_key.get()
+        r.suggest_url('http://bar.com/')
+        r.put()
+        c3 = self.counter('http://baz.com/')
+        for c in (c1, c2, c2, c3):
+            c.increment()
+        self.assertEqual(votes.flush(page_size=1), 2)
+        r = c1.request_key.get()
+        self.assertEqual(r.get_suggestion('http://foo.com/').votes, 1)
+        self.assertEqual(r.get_suggestion('http://bar.com/').votes, 2)
+        self.assertEqual(c3.request_key.get().content_suggestions[0].votes, 1)
+
+
+class VoteEventTestCase(RequestFactoryMixin, DatastoreTestCase):
+    """ Tests related to deferred vote aggregation """
+
+    def suggestion(self, url='http://example.com/'):
+        r = self.request()
+        r.suggest_url(url)
+        r.put()
+        return r.key, url
+
+    def test_fold(self):
+        """ Should apply vote events to content suggestions """
+        key, url = self.suggestion()
+        for i in range(3):
+            VoteEvent.record(key, url)
+        self.assertEqual(votes.fold_events(), 3)
+        self.assertEqual(key.get().content_suggestions[0].votes, 3)
+        self.assertEqual(VoteEvent.query().count(), 0)
+
+    def test_fold_in_batches(self):
+        """ Should process at most given number of events """
+        key, url = self.suggestion()
+        for i in range(3):
+            VoteEvent.record(key, url)
+        self.assertEqual(votes.fold_events(2), 2)
+        self.assertEqual(votes.fold_events(2), 1)
+        self.assertEqual(votes.fold_events(2), 0)
+        self.assertEqual(key.get().content_suggestions[0].votes, 3)
+
+    def test_fold_multiple_requests(self):
+        """ Should save all affected requests """
+        k1, url = self.suggestion()
+        k2, url = self.suggestion()
+        VoteEvent.record(k1, url)
+        VoteEvent.record(k2, url)
+        VoteEvent.record(k2, url)
+        votes.fold_events()
+        self.assertEqual(k1.get().content_suggestions[0].votes, 1)
+        self.assertEqual(k2.get().content_suggestions[0].votes, 2)
+
+    def test_replayed_events_counted_once(self):
+        """ Should not count events again if they were not deleted """
+        key, url = self.suggestion()
+        for i in range(2):
+            VoteEvent.record(key, url)
+        with patch('rh.votes.ndb.delete_multi'):
+            votes.fold_events()
+        VoteEvent.record(key, url)
+        self.assertEqual(votes.fold_events(), 3)
+        self.assertEqual(key.get().content_suggestions[0].votes, 3)
+
+    def test_fold_normalized_url(self):
+        """ Should apply events to suggestions with the same normalized URL """
+        key, url = self.suggestion()
+        VoteEvent.record(key, 'http://EXAMPLE.com/?utm_source=fb')
+        votes.fold_events()
+        self.assertEqual(key.get().content_suggestions[0].votes, 1)
+
+    def test_discard_unknown_suggestion(self):
+        """ Should discard events for missing requests and suggestions """
+        key, url = self.suggestion()
+        VoteEvent.record(key, 'http://other.com/')
+        VoteEvent.record(ndb.Key('Request', 12345), url)
+        self.assertEqual(votes.fold_events(), 2)
+        self.assertEqual(key.get().content_suggestions[0].votes, 0)
+        self.assertEqual(VoteEvent.query().count(), 0)
+
+    def test_markers_deleted(self):
+        """ Should delete markers of deleted events """
+        key, url = self.suggestion()
+        VoteEvent.record(key, url)
+        votes.fold_events()
+        self.assertEqual(AppliedVote.query().count(), 0)
+
+    def test_legacy_applied_votes(self):
+        """ Should skip events applied before markers, and clear their ids """
+        key, url = self.suggestion()
+        e = VoteEvent.record(key, url)
+        r = key.get()
+        r.applied_votes = [e.key.id()]
+        r.put()
+        VoteEvent.record(key, url)
+        self.assertEqual(votes.fold_events(), 2)
+        r = key.get()
+        self.assertEqual(r.content_suggestions[0].votes, 1)
+        self.assertEqual(r.applied_votes, [])
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from os.path import abspath, dirname, join
+
+from flask import Flask
+from google.appengine.ext import ndb
+
+from cds.webui import WebUIList, WebUIRequest, WebUIImage
+from rqm.webui import WebUIProof
+from rh.db import Request
+
+from tests.dbunit import DatastoreTestCase
+from tests.test_models import RequestFactoryMixin
+
+TEMPLATE_DIR = join(dirname(dirname(abspath(__file__))), 'templates')
+
+
+class WebUIListTestCase(RequestFactoryMixin, DatastoreTestCase):
+    """ Tests related to the CDS request list """
+
+    def setUp(self):
+        super(WebUIListTestCase, self).setUp()
+        app = Flask(__name__, template_folder=TEMPLATE_DIR)
+        app.config['CDS_PAGE_SIZE'] = 20
+        for route in (WebUIList, WebUIRequest, WebUIImage):
+            route.register(app)
+        self.client = app.test_client()
+
+    def test_renders_thumbnails(self):
+        """ Should render text requests and thumbnails of image requests """
+        image = self.request(content_type=Request.NONTRANSCRIBED,
+                             content_format=Request.PNG,
+                             posted=datetime.datetime(2014, 4, 2))
+        image.set_binary_content(b'image')
+        image.set_derivative('thumbnail', b'thumb', Request.PNG)
+        text = self.set_content(self.request())
+        ndb.put_multi([image, text])
+        res = self.client.get('/requests/')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('/images/%s' % image.thumbnail.id(), res.data)
+        self.assertIn('We need content', res.data)
+
+
+class WebUIProofTestCase(RequestFactoryMixin, DatastoreTestCase):
+    """ Tests related to proofreading requests """
+
+    def proof(self, request):
+        route = WebUIProof.__new__(WebUIProof)
+        route.req = request.key.get(use_cache=False, use_memcache=False)
+        return route
+
+    def test_concurrent_edits(self):
+        """ Edits of a stale request should not overwrite other revisions """
+        r = self.set_content(self.request(), text_content='Need news')
+        r.put()
+        first, second = self.proof(r), self.proof(r)
+        first.update_request(lambda r: r.set_content(text_content='A'))
+        second.update_request(lambda r: r.set_content(text_content='B'))
+        r = r.key.get()
+        self.assertEqual(r.revision_count, 3)
+        self.assertEqual([rev.text_content for rev in r.get_revs(0, 3)],
+                         ['Need news', 'A', 'B'])
+
+    def test_set_revision(self):
+        r = self.set_content(self.request(), text_content='Need news')
+        r.set_content(text_content='Need weather')
+        r.put()
+        self.proof(r).update_request(lambda r: r.set_revision(0))
+        self.assertEqual(r.key.get().text_content, 'Need news')
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+""" Benchmark for locale validation and language name lookups
+
+Measures the per-request cost of locale-related work done when rendering a
+request list: validating the two language properties of a revision, and
+looking up both language names for display. The direct Babel calls (used
+before the locale registry was introduced) are compared with the locale
+registry in ``rh.locales``.
+
+The App Engine SDK is not needed. Run from the project directory::
+
+    python tools/bench_locales.py [NUMBER_OF_REQUESTS]
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+from os.path import abspath, join, dirname
+import itertools
+import timeit
+import sys
+
+PROJECT_DIR = abspath(dirname(dirname(__file__)))
+VENDOR_DIR = join(PROJECT_DIR, 'vendor')
+
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, VENDOR_DIR)
+
+import babel
+from babel import localedata
+
+from rh import locales
+
+LANGUAGES = ['en', 'fr', 'es', 'ar', 'zh', 'ru', 'pt', 'sw', 'hi', 'de']
+REPEAT = 5
+
+
+def sample(count):
+    """ Return ``count`` (content_language, language) pairs """
+    langs = itertools.cycle(LANGUAGES)
+    return [(next(langs), next(langs)) for i in range(count)]
+
+
+def babel_name(identifier):
+    try:
+        return babel.Locale(identifier).get_language_name()
+    except babel.UnknownLocaleError:
+        return None
+
+
+def render_babel(requests):
+    for content_language, language in requests:
+        localedata.exists(content_language)
+        localedata.exists(language)
+        babel_name(content_language)
+        babel_name(language)
+
+
+def render_registry(requests):
+    for content_language, language in requests:
+        locales.exists(content_language)
+        locales.exists(language)
+        locales.get_language_name(content_language)
+        locales.get_language_name(language)
+
+
+def bench(fn, requests):
+    """ Return best per-request time in microseconds """
+    best = min(timeit.repeat(lambda: fn(requests), number=1, repeat=REPEAT))
+    return best / len(requests) * 1e6
+
+
+def main(count):
+    requests = sample(count)
+    # Warm up the registry, so that steady-state rendering is measured
+    render_registry(requests)
+    direct = bench(render_babel, requests)
+    registry = bench(render_registry, requests)
+    print('Requests:        %d' % count)
+    print('Babel:           %8.2f us/request' % direct)
+    print('Locale registry: %8.2f us/request' % registry)
+    print('Speedup:         %8.1fx' % (direct / registry))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+""" Benchmark for content suggestion ordering
+
+Measures the cost of reading the top suggestion and the sorted suggestions of
+a request, and of applying votes to its suggestions. Sorting suggestions on
+each access (as done before suggestions were kept in vote order) is compared
+with the ordered suggestion list maintained by ``rh.db.Request``.
+
+Usage::
+
+    python tools/bench_suggestions.py SDK_PATH [NUMBER_OF_SUGGESTIONS]
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import random
+import timeit
+import sys
+
+REPEAT = 5
+READS = 100
+VOTES = 100
+
+
+def make_request(count):
+    from rh.db import Request
+    r = Request(adaptor_name='bench', adaptor_source='bench')
+    for i in range(count):
+        r.suggest_url('http://example.com/%s' % i)
+    for c in r.content_suggestions:
+        r.set_votes(c.url, random.randint(0, count))
+    return r
+
+
+def sort_top(r):
+    ordered = sorted([c for c in r.content_suggestions
+                      if not c.is_unreachable],
+                     key=lambda c: c.votes, reverse=True)
+    return ordered[0] if ordered else None
+
+
+def sort_all(r):
+    return sorted(r.content_suggestions, key=lambda c: c.votes, reverse=True)
+
+
+def read_sorting(r):
+    for i in range(READS):
+        sort_top(r)
+        sort_all(r)
+
+
+def read_ordered(r):
+    for i in range(READS):
+        r.top_suggestion
+        r.sorted_suggestions
+
+
+def vote_sorting(r, urls):
+    suggestions = dict((c.url, c) for c in r.content_suggestions)
+    for url in urls:
+        suggestions[url].votes += 1
+        sort_top(r)
+
+
+def vote_ordered(r, urls):
+    for url in urls:
+        r.add_votes(url)
+        r.top_suggestion
+
+
+def bench(fn, *args):
+    """ Return best per-operation time in microseconds """
+    best = min(timeit.repeat(lambda: fn(*args), number=1, repeat=REPEAT))
+    return best / READS * 1e6
+
+
+def main(count):
+    r = make_request(count)
+    urls = [random.choice(r.content_suggestions).url for i in range(VOTES)]
+    results = [
+        ('Read, sorting', bench(read_sorting, r)),
+        ('Read, ordered', bench(read_ordered, r)),
+        ('Vote, sorting', bench(vote_sorting, r, urls)),
+        ('Vote, ordered', bench(vote_ordered, r, urls)),
+    ]
+    print('Suggestions:   %d' % count)
+    for label, value in results:
+        print('%s: %10.2f us/operation' % (label, value))
+    print('Read speedup:  %10.1fx' % (results[0][1] / results[1][1]))
+    print('Vote speedup:  %10.1fx' % (results[2][1] / results[3][1]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(__doc__)
+        sys.exit(1)
+
+    # Append all necessary paths
+    sys.path.insert(0, sys.argv[1])
+    sys.path.insert(0, '.')
+    sys.path.insert(0, 'vendor')
+
+    main(int(sys.argv[2]) if len(sys.argv) == 3 else 1000)
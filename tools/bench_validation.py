@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+""" Benchmark for request content validation
+
+Measures the cost of classifying text content as Base64-encoded data, and of
+detecting the format of image content. The anchored regular expression and
+the Images API (as used before content sniffing) are compared with the
+checks in ``rh.sniff``.
+
+The corpus is generated, and consists of emails and images of realistic
+sizes: plain text emails, emails whose body is a Base64-encoded attachment,
+and phone-sized PNG and JPEG images.
+
+Usage::
+
+    python tools/bench_validation.py SDK_PATH
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import re
+import sys
+import zlib
+import struct
+import random
+import timeit
+import base64
+
+REPEAT = 5
+NUMBER = 20
+
+BASE64_RE = re.compile(r'^([A-Za-z0-9+/]{4})*'
+                       r'('
+                       r'[A-Za-z0-9+/]{4}'
+                       r'|[A-Za-z0-9+/]{3}='
+                       r'|[A-Za-z0-9+/]{2}=='
+                       r')$')
+
+WORDS = ('need news about the world cup weather forecast for nairobi '
+         'please send information on farming prices school exam results '
+         'health clinic open hours election local radio').split()
+
+
+def random_bytes(size):
+    return bytes(bytearray(random.getrandbits(8) for i in range(size)))
+
+
+def make_email(size):
+    words = []
+    length = 0
+    while length < size:
+        word = random.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def make_png(width, height):
+    def chunk(tag, data):
+        return (struct.pack(b'>I', len(data)) + tag + data +
+                struct.pack(b'>I', zlib.crc32(tag + data) & 0xffffffff))
+    # Random pixels do not compress, like detailed photos
+    rows = b''.join(b'\x00' + random_bytes(width * 3) for j in range(height))
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack(b'>IIBBBBB', width, height, 8, 2, 0,
+                                       0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows, 1)) +
+            chunk(b'IEND', b''))
+
+
+def make_jpeg(width, height, size):
+    # Headers up to the frame header, followed by random entropy-coded data
+    app0 = b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    sof = b'\xff\xc0\x00\x11\x08' + struct.pack(b'>HH', height, width) + (
+        b'\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01')
+    data = random_bytes(size)
+    return b'\xff\xd8' + app0 + sof + data + b'\xff\xd9'
+
+
+def make_corpus():
+    random.seed(0)
+    texts = [
+        ('Email, 2KB', make_email(2 * 1024)),
+        ('Email, 16KB', make_email(16 * 1024)),
+        ('Base64 body, 64KB', base64.b64encode(random_bytes(48 * 1024))),
+        ('Base64 body, 1MB', base64.b64encode(random_bytes(768 * 1024))),
+    ]
+    images = [
+        ('PNG, 640x480', make_png(640, 480)),
+        ('JPEG, 3264x2448', make_jpeg(3264, 2448, 2 * 1024 * 1024)),
+    ]
+    return texts, images
+
+
+def regex_base64(text):
+    return bool(BASE64_RE.match(text))
+
+
+def images_api_format(data):
+    from google.appengine.api.images import Image
+    return Image(image_data=data).format
+
+
+def bench(fn, arg):
+    """ Return best per-call time in microseconds """
+    best = min(timeit.repeat(lambda: fn(arg), number=NUMBER, repeat=REPEAT))
+    return best / NUMBER * 1e6
+
+
+def main():
+    from rh.sniff import looks_like_base64, sniff_image_format
+    texts, images = make_corpus()
+    print('%-20s %12s %12s %9s' % ('Content', 'Before (us)', 'After (us)',
+                                   'Speedup'))
+    for label, text in texts:
+        assert regex_base64(text) == looks_like_base64(text)
+        before = bench(regex_base64, text)
+        after = bench(looks_like_base64, text)
+        print('%-20s %12.2f %12.2f %8.0fx' % (label, before, after,
+                                              before / after))
+    for label, data in images:
+        assert images_api_format(data) == sniff_image_format(data)
+        before = bench(images_api_format, data)
+        after = bench(sniff_image_format, data)
+        print('%-20s %12.2f %12.2f %8.0fx' % (label, before, after,
+                                              before / after))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+
+    # Append all necessary paths
+    sys.path.insert(0, sys.argv[1])
+    sys.path.insert(0, '.')
+    sys.path.insert(0, 'vendor')
+
+    main()
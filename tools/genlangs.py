@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+""" Generate RQM language table module
+
+Writes the list of languages offered in RQM forms (see ``rqm.languages``) to a
+Python module, so that deployed instances do not need to build it from locale
+data. The module contains a single tuple literal, which loads in
+microseconds from its compiled form.
+
+Usage::
+
+    python tools/genlangs.py SDK_PATH [OUTPUT]
+
+OUTPUT defaults to ``rqm/_languages.py``. The build target in ``zorofile``
+writes it into the build directory.
+"""
+
+from __future__ import unicode_literals, print_function
+
+import io
+import sys
+
+HEADER = """# -*- coding: utf-8 -*-
+# This file is generated by tools/genlangs.py. Do not edit.
+
+from __future__ import unicode_literals
+
+LANGUAGES = (
+"""
+
+
+def main(output):
+    from rqm.languages import build_languages
+    languages = build_languages()
+    with io.open(output, 'w', encoding='utf8') as f:
+        f.write(HEADER)
+        for identifier, name in languages:
+            f.write('    (%r, %r),\n' % (identifier, name))
+        f.write(')\n')
+    print('Wrote %s languages to %s' % (len(languages), output))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(__doc__)
+        sys.exit(1)
+
+    # Append all necessary paths
+    sys.path.insert(0, sys.argv[1])
+    sys.path.insert(0, '.')
+    sys.path.insert(0, 'vendor')
+
+    main(sys.argv[2] if len(sys.argv) == 3 else 'rqm/_languages.py')
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+""" Measure cold import time of modules
+
+Each module is imported in a fresh interpreter (as on an instance cold
+start), several times, and the best time is reported. Modules imported
+before the measured module (e.g., the SDK and vendored libraries shared by
+all modules) can be excluded using the ``--preload`` option.
+
+Usage::
+
+    python tools/importtime.py [options] SDK_PATH MODULE [MODULE...]
+
+Example::
+
+    python tools/importtime.py -p rh.db,utils.forms $SDK rqm.forms app.main
+
+"""
+
+from __future__ import unicode_literals, print_function
+
+import optparse
+import subprocess
+import sys
+
+USAGE = '%prog [options] SDK_PATH MODULE [MODULE...]'
+
+SCRIPT = """
+import sys, time
+sys.path[0:0] = %(paths)r
+for m in %(preload)r:
+    __import__(m)
+start = time.time()
+__import__(%(module)r)
+print(time.time() - start)
+"""
+
+
+def measure(sdk_path, module, preload=(), repeat=5):
+    """ Return best import time of a module in seconds """
+    script = SCRIPT % {
+        'paths': ['vendor', '.', sdk_path],
+        'preload': list(preload),
+        'module': module,
+    }
+    times = []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', script])
+        times.append(float(out.strip().splitlines()[-1]))
+    return min(times)
+
+
+def main():
+    parser = optparse.OptionParser(USAGE)
+    parser.add_option('-p', '--preload', default='',
+                      help='comma-separated modules imported before timing')
+    parser.add_option('-n', '--repeat', type='int', default=5,
+                      help='number of fresh interpreters per module')
+    options, args = parser.parse_args()
+    if len(args) < 2:
+        parser.print_help()
+        sys.exit(1)
+    preload = [m for m in options.preload.split(',') if m]
+    for module in args[1:]:
+        t = measure(args[0], module, preload, options.repeat)
+        print('%-30s %8.1f ms' % (module, t * 1000))
+
+
+if __name__ == '__main__':
+    main()